@@ -0,0 +1,199 @@
+"""
+SmartConsult 无界面 HTTP 接口，模型输出以 SSE 流式返回
+
+路由挂载在 Gradio 界面所在的同一个 FastAPI 应用中(由 app.py 启动)，与界面共享同一个进程内的
+graph、会话存储(checkpointer)、模型调度和语音推理线程池；适合嵌入自有前端或部署在负载均衡之后
+(会话状态保存在进程内或本地 SQLite，需要按 session_id 粘性路由)
+
+接口:
+    POST   /v1/sessions                  新建会话，返回 {"session_id": ...}
+    POST   /v1/sessions/{id}/messages    发送消息 {"text": "...", "skip_to_advice": false}，SSE 返回
+    GET    /v1/sessions/{id}/review      获取待审核的病情摘要 (edit_summary_node 中断)
+    POST   /v1/sessions/{id}/review      提交审核后的摘要 {"summary": "..."}，SSE 返回医疗建议
+    POST   /v1/sessions/{id}/audio       上传录音(请求体为音频文件)，返回 {"text": 识别结果}
+    DELETE /v1/sessions/{id}             取消进行中的一轮并释放会话
+    GET    /healthz
+
+SSE 事件: token / reset / node_start / node_end / queue / interrupt / state / error
+reset {"node", "length"} 表示撤回该节点最近推送的 length 个字符(切换端点重试或调用工具前的文本)
+每轮以 state (包含 question_count、awaiting_review) 或 error 结束
+
+用法 (在 medgemma/gradio_chatbot 目录下，与界面一起启动):
+    python app.py
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import tempfile
+import uuid
+from dataclasses import fields
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from langchain_core.messages import HumanMessage
+from langgraph.types import Command
+
+from medgemma.gradio_chatbot.config.settings import API_MAX_AUDIO_BYTES, SPEECH_ENABLED
+from medgemma.gradio_chatbot.config.prompts import BUSY_MESSAGE
+from medgemma.gradio_chatbot.graph.builder import graph
+from medgemma.gradio_chatbot.graph.sessions import get_config, release_session
+from medgemma.gradio_chatbot.graph.runner import (
+    stream_events, TokenDelta, TokenReset, NodeStart, NodeEnd, QueueStatus, InterruptPayload, StateSnapshot
+)
+# 与 app.py 使用同一个模块路径，共享已加载的 ASR 模型和微批处理
+from utils.asr import speech_to_text_async
+from medgemma.gradio_chatbot.utils.inference import InferenceBusyError
+from medgemma.gradio_chatbot.utils.scheduler import BackendBusyError
+from medgemma.gradio_chatbot.utils.cancellation import (
+    TurnCancelled, start_turn, finish_turn, cancel_turn, cancel_session
+)
+
+# 事件类型 -> SSE 事件名
+SSE_EVENTS = {
+    TokenDelta: "token",
+    TokenReset: "reset",
+    NodeStart: "node_start",
+    NodeEnd: "node_end",
+    QueueStatus: "queue",
+    InterruptPayload: "interrupt",
+    StateSnapshot: "state",
+}
+
+def sse(name: str, data: dict) -> bytes:
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+def encode_event(event) -> bytes:
+    # NodeEnd.output 中是完整的消息对象，接口只返回节点名和错误
+    data = {f.name: getattr(event, f.name) for f in fields(event) if f.name != "output"}
+    return sse(SSE_EVENTS[type(event)], data)
+
+def json_error(status: int, message: str) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status)
+
+async def read_json(request: Request) -> dict | None:
+    """请求体不是 JSON 对象时返回 None"""
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return body if isinstance(body, dict) else None
+
+async def pending_review(session_id: str) -> dict | None:
+    """会话当前等待审核的摘要 (edit_summary_node 的中断内容)，没有时返回 None"""
+    state = await graph.aget_state(get_config(session_id))
+    for task in state.tasks:
+        if task.interrupts:
+            return task.interrupts[0].value
+    return None
+
+async def stream_turn(session_id: str, graph_input) -> StreamingResponse:
+    """
+    运行一轮 graph，事件以 SSE 写回客户端
+    与 Gradio 界面使用同样的轮次管理：同一会话发送新消息时取消上一轮，客户端断开时取消本轮并回滚
+    """
+    turn = await start_turn(session_id)
+
+    async def body():
+        try:
+            async for event in stream_events(graph_input, session_id):
+                yield encode_event(event)
+        except TurnCancelled as e:
+            yield sse("error", {"code": "cancelled", "message": e.reason})
+        except BackendBusyError as e:
+            print(f"⚠️ 模型后端繁忙: {e}")
+            yield sse("error", {"code": "busy", "message": BUSY_MESSAGE})
+        except asyncio.CancelledError:
+            # 客户端已断开(Starlette 取消了响应任务)，取消本轮的 graph 运行并回滚
+            # 当前任务处于取消状态，不能在这里等待，清理放到单独的任务中进行
+            asyncio.ensure_future(cancel_turn(turn, "disconnect"))
+            raise
+        except Exception as e:
+            print(f"API 流式对话错误: {e}")
+            yield sse("error", {"code": "internal", "message": str(e)})
+        finally:
+            finish_turn(turn)
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+# ==================== 路由 ====================
+
+router = APIRouter()
+
+@router.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@router.post("/v1/sessions", status_code=201)
+async def create_session():
+    return {"session_id": str(uuid.uuid4())}
+
+@router.post("/v1/sessions/{session_id}/messages")
+async def post_message(session_id: str, request: Request):
+    body = await read_json(request)
+    if body is None:
+        return json_error(400, "请求体必须是 JSON 对象")
+    text = body.get("text")
+    if not isinstance(text, str) or not text.strip():
+        return json_error(400, "text 不能为空")
+    graph_input = {
+        "messages": [HumanMessage(content=text)],
+        "skip_to_advice": bool(body.get("skip_to_advice", False))
+    }
+    return await stream_turn(session_id, graph_input)
+
+@router.get("/v1/sessions/{session_id}/review")
+async def get_review(session_id: str):
+    review = await pending_review(session_id)
+    if review is None:
+        return json_error(404, "当前会话没有待审核的摘要")
+    return review
+
+@router.post("/v1/sessions/{session_id}/review")
+async def post_review(session_id: str, request: Request):
+    body = await read_json(request)
+    if body is None:
+        return json_error(400, "请求体必须是 JSON 对象")
+    summary = body.get("summary")
+    if not isinstance(summary, str) or not summary.strip():
+        return json_error(400, "summary 不能为空")
+    if await pending_review(session_id) is None:
+        return json_error(409, "当前会话没有待审核的摘要")
+    return await stream_turn(session_id, Command(resume=summary))
+
+@router.post("/v1/sessions/{session_id}/audio")
+async def post_audio(session_id: str, request: Request):
+    if not SPEECH_ENABLED:
+        return json_error(503, "语音功能未启用")
+    if int(request.headers.get("content-length") or 0) > API_MAX_AUDIO_BYTES:
+        return json_error(413, "录音文件过大")
+    audio = await request.body()
+    if not audio:
+        return json_error(400, "请求体为空")
+    if len(audio) > API_MAX_AUDIO_BYTES:
+        return json_error(413, "录音文件过大")
+    # Whisper 按文件读取音频，扩展名用于识别格式
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    suffix = mimetypes.guess_extension(content_type) or ".wav"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(audio)
+    turn = await start_turn(session_id)
+    try:
+        text = await turn.run(speech_to_text_async(f.name))
+    except TurnCancelled as e:
+        return json_error(409, f"识别已取消 ({e.reason})")
+    except InferenceBusyError as e:
+        print(f"⚠️ ASR 繁忙: {e}")
+        return json_error(503, "当前语音识别繁忙，请稍后重试或使用文字输入。")
+    finally:
+        finish_turn(turn)
+        os.remove(f.name)
+    return {"text": text}
+
+@router.delete("/v1/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    await cancel_session(session_id, "close")
+    await release_session(session_id)
+    return Response(status_code=204)
@@ -1,97 +1,137 @@
-import json
+import threading
+import time
 import uuid
+import weakref
+from contextlib import asynccontextmanager
+
+APP_START = time.perf_counter()
+
 import gradio as gr
 from typing import AsyncGenerator, Optional
-from langchain_core.messages import AIMessageChunk, HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage
+from langgraph.types import Command
+
+from config.settings import (
+    TTS_STREAMING, SPEECH_ENABLED, SPEECH_WARMUP, METRICS_PORT, TTS_CACHE_PREWARM,
+    AUDIO_FILE_MAX_AGE, AUDIO_REAP_INTERVAL, RELEASE_SESSION_ON_EXIT, APP_HOST, APP_PORT,
+    OPENROUTER_API_KEY
+)
+from config.prompts import WELCOME_MESSAGE, BUSY_MESSAGE, TTS_PREWARM_TEXTS
+from utils.tts import text_to_speech_async, StreamingTTS, load_tts_model, is_tts_ready, prewarm_tts_cache
+from utils.asr import speech_to_text_async, load_asr_model, is_asr_ready
+from medgemma.gradio_chatbot.utils.inference import InferenceBusyError
+from medgemma.gradio_chatbot.utils.scheduler import BackendBusyError
+from medgemma.gradio_chatbot.utils.metrics import start_metrics_server
+from medgemma.gradio_chatbot.utils.cancellation import TurnCancelled, start_turn, finish_turn, cancel_session
+# 与 graph/nodes.py 使用同一个模块路径，共享编译好的 graph(及其 checkpointer)和常驻的 Agent 实例
+from medgemma.gradio_chatbot.graph.sessions import release_session
+from medgemma.gradio_chatbot.graph.runner import (
+    stream_events, GraphEvent, TokenDelta, TokenReset, QueueStatus, InterruptPayload, StateSnapshot
+)
+from medgemma.gradio_chatbot.graph.nodes import cancel_summary_drafts
+from medgemma.gradio_chatbot.tools.agent import get_agent
+from medgemma.gradio_chatbot.tools.mcp_client import close_sessions
+from medgemma.gradio_chatbot.utils.llm_clients import close_clients
+
+def new_session_id() -> str:
+    """为每个浏览器会话生成独立的 LangGraph thread_id"""
+    return str(uuid.uuid4())
+
+# 浏览器会话(Gradio session_hash) -> 当前的 thread_id，关闭页面时据此取消进行中的一轮
+_browser_sessions = {}
+
+def browser_session(request: Optional[gr.Request], session_id: Optional[str] = None) -> str:
+    """
+    事件所属的 thread_id: session_state 有值时直接使用
+    session_state 要等 demo.load 完成后才有值，在此之前触发的事件按 session_hash 分配，随后的 demo.load 沿用同一个
+    """
+    if session_id:
+        return session_id
+    if request is None or not request.session_hash:
+        return new_session_id()
+    return _browser_sessions.setdefault(request.session_hash, new_session_id())
+
+def start_session(request: gr.Request) -> str:
+    """页面加载时分配 thread_id (加载完成前已有事件分配过的沿用)"""
+    return browser_session(request)
 
-from config.settings import DEFAULT_SESSION_ID
-from config.prompts import WELCOME_MESSAGE
-from utils.tts import text_to_speech
-from utils.asr import speech_to_text
-from graph.builder import graph
+def renew_session(request: Optional[gr.Request]) -> str:
+    """清空对话后为当前浏览器会话分配新的 thread_id"""
+    session_id = new_session_id()
+    if request is not None and request.session_hash:
+        _browser_sessions[request.session_hash] = session_id
+    return session_id
+
+# 轮次 -> 该轮在对话记录中的起始位置，新消息取消上一轮时据此移除上一轮残留的消息
+_turn_entries = weakref.WeakKeyDictionary()
+
+def begin_turn_entries(history: list, turn, start: int) -> int:
+    """
+    记录本轮在对话记录中的起始位置 start (本轮的用户消息或回复)
+    上一轮被本轮取消且 graph 未运行完成时，会话已回滚到上一轮开始前，
+    将上一轮的用户消息和写了一半的回复从对话记录中移除，返回移除后本轮的起始位置
+    """
+    previous = turn.superseded
+    previous_start = _turn_entries.get(previous) if previous is not None else None
+    if previous_start is not None and not previous.committed and previous_start < start:
+        del history[previous_start:start]
+        start = previous_start
+    _turn_entries[turn] = start
+    return start
 
-# 会话 ID
-SESSION_ID = DEFAULT_SESSION_ID
+async def end_session(session_id: Optional[str], reason: str):
+    """取消会话中进行中的一轮(模型生成、工具调用、语音识别/合成)，并释放会话状态"""
+    if not session_id:
+        return
+    await cancel_session(session_id, reason)
+    if RELEASE_SESSION_ON_EXIT:
+        await release_session(session_id)
 
 # ==================== 核心功能函数 ====================
 
-async def agent_stream_response(message: Optional[str], skip_to_advice: bool = False) -> AsyncGenerator[str, None]:
+async def agent_stream_response(message: Optional[str], session_id: str, skip_to_advice: bool = False) -> AsyncGenerator[GraphEvent, None]:
     """
-    使用 consultation_flow graph 流式生成回复
+    使用 consultation_flow graph 流式生成回复，产出 graph/runner.py 中定义的事件
+    后端繁忙或出错时以 TokenDelta 返回提示文本(此时没有 StateSnapshot)
     """
     if not message or not message.strip():
         return
     
     try:
-        config = {"configurable": {"thread_id": SESSION_ID}}
-        
         input_messages = {
             "messages": [HumanMessage(content=message)],
             "skip_to_advice": skip_to_advice
         }
         
         try:
-            async for event in graph.astream(
-                input_messages,
-                config=config,
-                stream_mode="updates"
-            ):
-                for node_name, node_output in event.items():
-                    print(f"🔍 节点: {node_name}")
-                    
-                    if node_name == "__interrupt__":
-                        state = await graph.aget_state(config)
-                        if state.tasks and state.tasks[0].interrupts:
-                            interrupt_data = state.tasks[0].interrupts[0]
-                            print(f"🔔 检测到中断,返回审核数据")
-                            yield "\n\n__INTERRUPT__\n" + json.dumps(interrupt_data.value, ensure_ascii=False)
-                        continue
-                    else:
-                        if node_name == "medgemma_decision":
-                            continue
-                        
-                        if "messages" in node_output:
-                            messages = node_output["messages"]
-                            if not isinstance(messages, list):
-                                messages = [messages]
-                            
-                            if messages:
-                                msg = messages[-1]
-                                if isinstance(msg, (AIMessage, AIMessageChunk)):
-                                    content = msg.content.strip() if msg.content else ""
-                                    yield content
+            async for event in stream_events(input_messages, session_id):
+                yield event
+        except TurnCancelled:
+            raise
         except Exception as stream_error:
             print(f"⚠️ 流式输出错误: {stream_error}")
             raise
         
+    except TurnCancelled:
+        raise
+    except BackendBusyError as e:
+        print(f"⚠️ 模型后端繁忙: {e}")
+        yield TokenDelta(BUSY_MESSAGE)
     except Exception as e:
         print(f"Agent 流式对话错误: {e}")
-        yield f"抱歉，发生了错误：{str(e)}"
+        yield TokenDelta(f"抱歉，发生了错误：{str(e)}")
 
-async def resume_with_edited_summary(edited_summary: str):
-    """使用编辑后的摘要恢复执行"""
-    from langgraph.types import Command
+async def resume_stream_with_edited_summary(edited_summary: str, session_id: str) -> AsyncGenerator[GraphEvent, None]:
+    """使用编辑后的摘要恢复执行，流式返回医疗建议事件"""
     try:
-        config = {"configurable": {"thread_id": SESSION_ID}}
-        result = await graph.ainvoke(
-            Command(resume=edited_summary),
-            config=config
-        )
-        return result
+        async for event in stream_events(Command(resume=edited_summary), session_id):
+            yield event
+    except TurnCancelled:
+        raise
     except Exception as e:
         print(f"恢复执行错误: {e}")
         raise
 
-async def get_current_question_count() -> int:
-    """获取当前会话的提问轮次"""
-    try:
-        config = {"configurable": {"thread_id": SESSION_ID}}
-        state = await graph.aget_state(config)
-        return state.values.get("question_count", 0)
-    except Exception as e:
-        print(f"获取提问轮次错误: {e}")
-        return 0
-
 # ==================== Gradio UI Logic ====================
 
 def add_user_message(history, message):
@@ -104,20 +144,18 @@ def add_user_message(history, message):
         history.append({"role": "user", "content": text})
     return history, ""
 
-def check_interrupt_in_chunk(chunk):
-    if "__INTERRUPT__" in chunk:
-        parts = chunk.split("__INTERRUPT__")
-        clean_chunk = parts[0]
-        interrupt_data = None
-        if len(parts) > 1:
-            try:
-                interrupt_data = json.loads(parts[1].strip())
-            except:
-                pass
-        return True, interrupt_data, clean_chunk
-    return False, None, chunk
-
-async def process_text_input_stream(message, history, enable_tts, skip_to_advice=False):
+def queue_message(position: int) -> str:
+    return f"⏳ 当前咨询人数较多，正在排队（第 {position} 位）..." if position else ""
+
+def start_tts_stream(enable_tts, turn):
+    """启用语音回复且开启流式合成时，返回边生成边合成的 StreamingTTS (本轮取消时放弃未合成的句子)"""
+    if not (enable_tts and TTS_STREAMING):
+        return None
+    tts_stream = StreamingTTS()
+    turn.on_cancel(tts_stream.cancel)
+    return tts_stream
+
+async def process_text_input_stream(message, history, enable_tts, session_id, request: gr.Request = None, skip_to_advice=False):
     if isinstance(message, dict):
         user_text = message.get("text") or ""
     else:
@@ -127,103 +165,240 @@ async def process_text_input_stream(message, history, enable_tts, skip_to_advice
         yield history, None, gr.update(), gr.update(visible=False), ""
         return
     
+    session_id = browser_session(request, session_id)
+    # 同一会话上一轮仍在进行时先取消它(用户已经发送了新消息)
+    turn = await start_turn(session_id)
+    # 本轮的用户消息已由 add_user_message / process_voice_to_text 加入对话记录
+    begin_turn_entries(history, turn, len(history) - 1)
     history.append({"role": "assistant", "content": ""})
-    full_response = ""
-    has_interrupt = False
-    interrupt_data = None
+    reply = ""
+    review = None
+    snapshot = None
+    tts_stream = start_tts_stream(enable_tts, turn)
     
     try:
-        async for chunk in agent_stream_response(user_text, skip_to_advice=skip_to_advice):
-            has_interrupt_in_chunk, interrupt_data_in_chunk, clean_chunk = check_interrupt_in_chunk(chunk)
-            if has_interrupt_in_chunk:
-                has_interrupt = True
-                interrupt_data = interrupt_data_in_chunk
-            
-            full_response += clean_chunk
-            history[-1]["content"] = full_response
-            yield history, None, gr.update(), gr.update(visible=False), ""
+        async for event in agent_stream_response(user_text, session_id, skip_to_advice=skip_to_advice):
+            if isinstance(event, TokenDelta):
+                reply += event.text
+                history[-1]["content"] = reply
+                if tts_stream:
+                    tts_stream.feed(event.text)
+                yield history, tts_stream.pop_ready() if tts_stream else None, gr.update(), gr.update(visible=False), ""
+            elif isinstance(event, TokenReset):
+                # 切换端点重试或调用工具前的文本不是最终回复，撤回已显示和尚未播放的部分
+                reply = reply[:len(reply) - event.length]
+                history[-1]["content"] = reply
+                if tts_stream:
+                    tts_stream.reset()
+                yield history, None, gr.update(), gr.update(visible=False), ""
+            elif isinstance(event, QueueStatus):
+                history[-1]["content"] = reply or queue_message(event.position)
+                yield history, None, gr.update(), gr.update(visible=False), ""
+            elif isinstance(event, InterruptPayload):
+                review = event
+            elif isinstance(event, StateSnapshot):
+                snapshot = event
         
-        if has_interrupt and interrupt_data:
-            summary_text = interrupt_data.get("summary", "")
-            instruction = interrupt_data.get("instruction", "请审核病情摘要")
-            history[-1]["content"] = full_response + f"\n\n📋 **{instruction}**"
-            question_count = await get_current_question_count()
-            button_visible = question_count >= 1 and not has_interrupt
-            yield history, None, gr.update(visible=button_visible), gr.update(visible=True), summary_text
+        if review:
+            if tts_stream:
+                tts_stream.cancel()
+            history[-1]["content"] = reply + f"\n\n📋 **{review.instruction}**"
+            yield history, None, gr.update(visible=False), gr.update(visible=True), review.summary
             return
         
-        audio_path = text_to_speech(full_response) if enable_tts and full_response.strip() else None
-        question_count = await get_current_question_count()
-        button_visible = question_count >= 1
-        yield history, audio_path, gr.update(visible=button_visible), gr.update(visible=False), ""
+        if tts_stream:
+            tts_stream.close()
+            async for audio in tts_stream.remaining():
+                yield history, audio, gr.update(), gr.update(visible=False), ""
+            turn.check()
+            audio = None
+        else:
+            audio = await turn.run(text_to_speech_async(reply)) if enable_tts and reply.strip() else None
+        # 出错时没有状态快照，保持按钮不变
+        button = gr.update(visible=snapshot.question_count >= 1) if snapshot else gr.update()
+        yield history, audio, button, gr.update(visible=False), ""
         
+    except TurnCancelled:
+        # 本轮已被取消: 清空对话后界面已重置；发送新消息时由新的一轮移除本轮残留的消息并接管界面
+        return
     except Exception as e:
+        if tts_stream:
+            tts_stream.cancel()
         history[-1]["content"] = f"抱歉，发生了错误：{str(e)}"
         yield history, None, gr.update(), gr.update(visible=False), ""
+    finally:
+        finish_turn(turn)
 
-def process_voice_to_text(audio, history):
+async def process_voice_to_text(audio, history, session_id, request: gr.Request = None):
     if audio is None: return history, ""
-    text = speech_to_text(audio)
+    session_id = browser_session(request, session_id)
+    # 识别期间清空对话、关闭页面或发送文字消息时放弃识别
+    turn = await start_turn(session_id)
+    try:
+        text = await turn.run(speech_to_text_async(audio))
+    except TurnCancelled:
+        return history, ""
+    except InferenceBusyError as e:
+        print(f"⚠️ ASR 繁忙: {e}")
+        history.append({"role": "assistant", "content": "当前语音识别繁忙，请稍后重试或使用文字输入。"})
+        return history, ""
+    finally:
+        finish_turn(turn)
     if not text: return history, ""
     history.append({"role": "user", "content": text})
     return history, text
 
-async def process_voice_response_stream(user_text, history, enable_tts, skip_to_advice=False):
-    async for result in process_text_input_stream(user_text, history, enable_tts, skip_to_advice):
+async def process_voice_response_stream(user_text, history, enable_tts, session_id, request: gr.Request = None, skip_to_advice=False):
+    async for result in process_text_input_stream(user_text, history, enable_tts, session_id, request, skip_to_advice):
         yield result
 
-async def generate_direct_advice(history, enable_tts):
+async def generate_direct_advice(history, enable_tts, session_id, request: gr.Request = None):
+    session_id = browser_session(request, session_id)
+    turn = await start_turn(session_id)
+    begin_turn_entries(history, turn, len(history))
     history.append({"role": "assistant", "content": ""})
-    full_response = ""
-    has_interrupt = False
-    interrupt_data = None
+    reply = ""
+    review = None
+    tts_stream = start_tts_stream(enable_tts, turn)
     try:
-        async for chunk in agent_stream_response("生成用户病况摘要", skip_to_advice=True):
-            has_interrupt_in_chunk, interrupt_data_in_chunk, clean_chunk = check_interrupt_in_chunk(chunk)
-            if has_interrupt_in_chunk:
-                has_interrupt = True
-                interrupt_data = interrupt_data_in_chunk
-            full_response += clean_chunk
-            history[-1]["content"] = full_response
-            yield history, None, gr.update(visible=False), gr.update(visible=False), ""
+        async for event in agent_stream_response("生成用户病况摘要", session_id, skip_to_advice=True):
+            if isinstance(event, TokenDelta):
+                reply += event.text
+                history[-1]["content"] = reply
+                if tts_stream:
+                    tts_stream.feed(event.text)
+                yield history, tts_stream.pop_ready() if tts_stream else None, gr.update(visible=False), gr.update(visible=False), ""
+            elif isinstance(event, TokenReset):
+                # 切换端点重试或调用工具前的文本不是最终回复，撤回已显示和尚未播放的部分
+                reply = reply[:len(reply) - event.length]
+                history[-1]["content"] = reply
+                if tts_stream:
+                    tts_stream.reset()
+                yield history, None, gr.update(visible=False), gr.update(visible=False), ""
+            elif isinstance(event, QueueStatus):
+                history[-1]["content"] = reply or queue_message(event.position)
+                yield history, None, gr.update(visible=False), gr.update(visible=False), ""
+            elif isinstance(event, InterruptPayload):
+                review = event
         
-        if has_interrupt and interrupt_data:
-            summary_text = interrupt_data.get("summary", "")
-            instruction = interrupt_data.get("instruction", "请审核病情摘要")
-            history[-1]["content"] = full_response + f"\n\n📋 **{instruction}**"
-            yield history, None, gr.update(visible=False), gr.update(visible=True), summary_text
+        if review:
+            if tts_stream:
+                tts_stream.cancel()
+            history[-1]["content"] = reply + f"\n\n📋 **{review.instruction}**"
+            yield history, None, gr.update(visible=False), gr.update(visible=True), review.summary
             return
         
-        audio_path = text_to_speech(full_response) if enable_tts and full_response.strip() else None
-        yield history, audio_path, gr.update(visible=False), gr.update(visible=False), ""
+        if tts_stream:
+            tts_stream.close()
+            async for audio in tts_stream.remaining():
+                yield history, audio, gr.update(visible=False), gr.update(visible=False), ""
+            turn.check()
+            audio = None
+        else:
+            audio = await turn.run(text_to_speech_async(reply)) if enable_tts and reply.strip() else None
+        yield history, audio, gr.update(visible=False), gr.update(visible=False), ""
+    except TurnCancelled:
+        return
     except Exception as e:
+        if tts_stream:
+            tts_stream.cancel()
         history[-1]["content"] = f"抱歉，发生了错误：{str(e)}"
         yield history, None, gr.update(visible=False), gr.update(visible=False), ""
+    finally:
+        finish_turn(turn)
 
-async def submit_summary_review(edited_summary, history, enable_tts):
+async def submit_summary_review(edited_summary, history, enable_tts, session_id, request: gr.Request = None):
     if not edited_summary or not edited_summary.strip():
         yield history, None, gr.update(visible=False), ""
         return
+    session_id = browser_session(request, session_id)
+    turn = await start_turn(session_id)
+    begin_turn_entries(history, turn, len(history))
     history.append({"role": "assistant", "content": "正在基于您审核的摘要生成医疗建议..."})
     yield history, None, gr.update(visible=False), ""
+    tts_stream = start_tts_stream(enable_tts, turn)
     try:
-        result = await resume_with_edited_summary(edited_summary)
-        if result and "messages" in result:
-            advice_content = result["messages"][-1].content
-            history[-1]["content"] = advice_content
-            audio_path = text_to_speech(advice_content) if enable_tts and advice_content.strip() else None
-            yield history, audio_path, gr.update(visible=False), ""
+        advice_content = ""
+        async for event in resume_stream_with_edited_summary(edited_summary, session_id):
+            if isinstance(event, TokenDelta):
+                advice_content += event.text
+                history[-1]["content"] = advice_content
+                if tts_stream:
+                    tts_stream.feed(event.text)
+                yield history, tts_stream.pop_ready() if tts_stream else None, gr.update(visible=False), ""
+            elif isinstance(event, TokenReset):
+                # 切换端点重试或调用工具前的文本不是最终回复，撤回已显示和尚未播放的部分
+                advice_content = advice_content[:len(advice_content) - event.length]
+                history[-1]["content"] = advice_content
+                if tts_stream:
+                    tts_stream.reset()
+                yield history, None, gr.update(visible=False), ""
+            elif isinstance(event, QueueStatus):
+                history[-1]["content"] = advice_content or queue_message(event.position) or "正在基于您审核的摘要生成医疗建议..."
+                yield history, None, gr.update(visible=False), ""
+        if advice_content.strip():
+            if tts_stream:
+                tts_stream.close()
+                async for audio in tts_stream.remaining():
+                    yield history, audio, gr.update(visible=False), ""
+                turn.check()
+                audio = None
+            else:
+                audio = await turn.run(text_to_speech_async(advice_content)) if enable_tts else None
+            yield history, audio, gr.update(visible=False), ""
         else:
+            if tts_stream:
+                tts_stream.cancel()
             history[-1]["content"] = "建议生成完成"
             yield history, None, gr.update(visible=False), ""
+    except TurnCancelled:
+        return
     except Exception as e:
+        if tts_stream:
+            tts_stream.cancel()
         history[-1]["content"] = f"抱歉，处理摘要时发生错误：{str(e)}"
         yield history, None, gr.update(visible=False), ""
+    finally:
+        finish_turn(turn)
+
+async def warmup_agent():
+    """页面加载时预热 Agent：提前发现 MCP 工具并启动常驻会话"""
+    try:
+        await get_agent()
+    except Exception as e:
+        print(f"⚠️ Agent 预热失败: {e}")
+
+async def warmup_tts_cache():
+    """页面加载时预先合成固定内容的语音，只在首次加载时执行"""
+    if SPEECH_ENABLED and TTS_CACHE_PREWARM:
+        await prewarm_tts_cache(TTS_PREWARM_TEXTS)
+
+def start_speech_warmup():
+    """在后台线程中并行加载 ASR 和 TTS 模型，不阻塞应用启动"""
+    def load(name, loader):
+        try:
+            loader()
+        except Exception as e:
+            print(f"⚠️ {name} 模型预热失败: {e}")
+
+    for name, loader in (("ASR", load_asr_model), ("TTS", load_tts_model)):
+        threading.Thread(target=load, args=(name, loader), name=f"warmup-{name}", daemon=True).start()
 
-def clear_conversation():
-    global SESSION_ID
-    SESSION_ID = str(uuid.uuid4())
-    return WELCOME_MESSAGE, None, gr.update(visible=False), gr.update(visible=False), ""
+def speech_status():
+    """语音模型就绪状态，就绪后停止轮询"""
+    asr_ready, tts_ready = is_asr_ready(), is_tts_ready()
+    text = f"语音识别: {'✅ 已就绪' if asr_ready else '⏳ 加载中'} ｜ 语音合成: {'✅ 已就绪' if tts_ready else '⏳ 加载中'}"
+    return text, gr.Timer(active=not (asr_ready and tts_ready))
+
+async def clear_conversation(session_id, request: gr.Request):
+    """清空对话：取消并释放旧会话，只为当前浏览器会话分配新的 thread_id，不影响其他用户"""
+    await end_session(browser_session(request, session_id), "clear")
+    return WELCOME_MESSAGE, None, gr.update(visible=False), gr.update(visible=False), "", renew_session(request)
+
+async def close_session(request: gr.Request):
+    """关闭或刷新页面：取消该浏览器会话进行中的一轮"""
+    session_id = _browser_sessions.pop(request.session_hash, None) if request is not None else None
+    await end_session(session_id, "disconnect")
 
 # ==================== Gradio UI Layout ====================
 
@@ -273,7 +448,8 @@ custom_css = """
 }
 """
 
-with (gr.Blocks(css=custom_css, theme=gr.themes.Soft()) as demo):
+# Gradio 缓存的录音和非流式语音回复定期清理
+with (gr.Blocks(css=custom_css, theme=gr.themes.Soft(), delete_cache=(AUDIO_REAP_INTERVAL, AUDIO_FILE_MAX_AGE) if AUDIO_REAP_INTERVAL > 0 else None) as demo):
     gr.HTML("<div class='title-text'>🎙️ 智能语音助手</div><div class='subtitle-text'>支持文字输入和语音对话</div>")
     with gr.Row():
         with gr.Column(scale=3):
@@ -291,10 +467,15 @@ with (gr.Blocks(css=custom_css, theme=gr.themes.Soft()) as demo):
                     submit_summary_btn = gr.Button("✅ 确认并生成建议", variant="primary", elem_classes=["primary-btn"])
                     cancel_summary_btn = gr.Button("❌ 取消", variant="secondary", elem_classes=["secondary-btn"])
             summary_state = gr.State(value="")
+            # 每个浏览器会话独立的 thread_id，页面加载时分配 (加载完成前的事件由 browser_session 按 session_hash 分配)
+            session_state = gr.State(value=None)
         with gr.Column(scale=1):
-            audio_input = gr.Audio(sources=["microphone"], type="filepath", label="点击即可录音")
-            audio_output = gr.Audio(label="机器人语音", autoplay=True)
-            enable_tts = gr.Checkbox(label="🔈 启用语音回复", value=True)
+            # 纯文字模式(SPEECH_ENABLED=false)下隐藏语音组件，也不会加载语音模型
+            speech_status_md = gr.Markdown(visible=SPEECH_ENABLED and SPEECH_WARMUP)
+            speech_status_timer = gr.Timer(2, active=SPEECH_ENABLED and SPEECH_WARMUP)
+            audio_input = gr.Audio(sources=["microphone"], type="filepath", label="点击即可录音", visible=SPEECH_ENABLED)
+            audio_output = gr.Audio(label="机器人语音", autoplay=True, streaming=TTS_STREAMING, visible=SPEECH_ENABLED)
+            enable_tts = gr.Checkbox(label="🔈 启用语音回复", value=SPEECH_ENABLED, visible=SPEECH_ENABLED)
             direct_advice_btn = gr.Button("💡 直接生成建议回复", variant="primary", elem_classes=["primary-btn"], visible=False)
             clear_btn = gr.Button("🗑️ 清空对话", variant="secondary", elem_classes=["secondary-btn"])
 
@@ -311,7 +492,7 @@ with (gr.Blocks(css=custom_css, theme=gr.themes.Soft()) as demo):
         outputs=[chatbot, text_input]
     ).then(
         fn=process_text_input_stream,
-        inputs=[user_message_state, chatbot, enable_tts],
+        inputs=[user_message_state, chatbot, enable_tts, session_state],
         outputs=[chatbot, audio_output, direct_advice_btn, summary_review_group, summary_state]
     ).then(fn=lambda s: [s,s], inputs=[summary_state], outputs=[summary_textbox, summary_preview])
 
@@ -324,28 +505,28 @@ with (gr.Blocks(css=custom_css, theme=gr.themes.Soft()) as demo):
         inputs=[chatbot, text_input], outputs=[chatbot, text_input]
     ).then(
         fn=process_text_input_stream,
-        inputs=[user_message_state, chatbot, enable_tts],
+        inputs=[user_message_state, chatbot, enable_tts, session_state],
         outputs=[chatbot, audio_output, direct_advice_btn, summary_review_group, summary_state]
     ).then(fn=lambda s: [s, s], inputs=[summary_state], outputs=[summary_textbox, summary_preview])
 
     audio_input.stop_recording(
         fn=process_voice_to_text,
-        inputs=[audio_input, chatbot],
+        inputs=[audio_input, chatbot, session_state],
         outputs=[chatbot, user_message_state]
     ).then(
         fn=process_voice_response_stream,
-        inputs=[user_message_state, chatbot, enable_tts],
+        inputs=[user_message_state, chatbot, enable_tts, session_state],
         outputs=[chatbot, audio_output, direct_advice_btn, summary_review_group, summary_state])
 
     direct_advice_btn.click(
         fn=generate_direct_advice,
-        inputs=[chatbot, enable_tts],
+        inputs=[chatbot, enable_tts, session_state],
         outputs=[chatbot, audio_output, direct_advice_btn, summary_review_group, summary_state]
     ).then(fn=lambda s: [s,s], inputs=[summary_state], outputs=[summary_textbox, summary_preview])
 
     submit_summary_btn.click(
         fn=submit_summary_review,
-        inputs=[summary_textbox, chatbot, enable_tts],
+        inputs=[summary_textbox, chatbot, enable_tts, session_state],
         outputs=[chatbot, audio_output, summary_review_group, summary_state])
 
     cancel_summary_btn.click(
@@ -354,7 +535,52 @@ with (gr.Blocks(css=custom_css, theme=gr.themes.Soft()) as demo):
 
     clear_btn.click(
         fn=clear_conversation,
-        outputs=[chatbot, audio_output, direct_advice_btn, summary_review_group, summary_state])
+        inputs=[session_state],
+        outputs=[chatbot, audio_output, direct_advice_btn, summary_review_group, summary_state, session_state])
+
+    demo.load(fn=start_session, outputs=[session_state])
+    demo.unload(fn=close_session)
+    demo.load(fn=warmup_agent)
+    demo.load(fn=warmup_tts_cache)
+    speech_status_timer.tick(fn=speech_status, outputs=[speech_status_md, speech_status_timer])
+
+# ==================== Server ====================
+
+@asynccontextmanager
+async def lifespan(server):
+    # HTTP 接口的客户端不会触发页面加载事件，启动时就预热 Agent
+    await warmup_agent()
+    yield
+    cancel_summary_drafts()
+    await close_sessions()
+    await close_clients()
+
+def create_server():
+    """
+    Gradio 界面和 HTTP 接口(api.py)挂载在同一个 FastAPI 应用上，
+    由同一个进程持有会话存储、模型调度和推理线程池
+    """
+    if not OPENROUTER_API_KEY:
+        # 启动服务时直接报错，而不是等到第一次问诊时才返回鉴权错误
+        raise RuntimeError("OPENROUTER_API_KEY 未设置，无法启动服务。请在 .env 文件中配置此环境变量。")
+    from fastapi import FastAPI
+    from api import router as api_router
+
+    server = FastAPI(lifespan=lifespan)
+    # 接口路由先注册，其余路径交给 Gradio
+    server.include_router(api_router)
+    demo.queue(default_concurrency_limit=None)
+    return gr.mount_gradio_app(server, demo, path="/", server_name=APP_HOST, server_port=APP_PORT, show_error=True)
 
 if __name__ == "__main__":
-    demo.launch(server_name="127.0.0.1", server_port=7860, show_error=True)
+    import uvicorn
+
+    # 先检查配置，缺少密钥时不必加载语音模型
+    server = create_server()
+    if SPEECH_ENABLED and SPEECH_WARMUP:
+        start_speech_warmup()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    print(f"🚀 应用启动耗时: {time.perf_counter() - APP_START:.2f}s (语音模型{'后台预热中' if SPEECH_ENABLED and SPEECH_WARMUP else '首次使用时加载' if SPEECH_ENABLED else '已禁用'})")
+    print(f"🌐 界面: http://{APP_HOST}:{APP_PORT}  HTTP 接口: http://{APP_HOST}:{APP_PORT}/v1/sessions")
+    uvicorn.run(server, host=APP_HOST, port=APP_PORT)
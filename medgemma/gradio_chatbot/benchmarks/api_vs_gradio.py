@@ -0,0 +1,256 @@
+"""
+HTTP 接口(api.py) 与 Gradio 界面的吞吐对比
+
+两种接口由同一个服务进程(python app.py)提供，使用本地假模型服务和 MCP 桩服务；
+依次用两种接口在相同并发度下模拟多个患者进行多轮问诊，统计吞吐、首 token 延迟、每轮延迟和服务进程的 CPU 时间。
+- Gradio: 按浏览器的调用方式，每轮依次提交 save_message_to_state -> add_user_message
+  -> process_text_input_stream -> 摘要同步 四个事件(队列协议 sse_v3)
+- HTTP 接口: 每轮一次 POST /v1/sessions/{id}/messages (SSE)
+两种服务都关闭语音功能，只比较文本问诊路径。
+
+用法 (在 medgemma/gradio_chatbot 目录下):
+    python benchmarks/api_vs_gradio.py --concurrency 1 10 50 --turns 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+sys.path.insert(0, BENCH_DIR)
+
+from load_test_sessions import configure_env, percentile, REPO_ROOT
+
+# ==================== 服务进程 ====================
+
+def cpu_seconds(pid: int) -> float:
+    """进程累计的用户态 + 内核态 CPU 时间 (读取 /proc，不支持时返回 0)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+def start_server(port: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, REPO_ROOT, env.get("PYTHONPATH")]))
+    env.update({"SPEECH_ENABLED": "false", "METRICS_PORT": "0", "APP_PORT": str(port)})
+    return subprocess.Popen([sys.executable, "app.py"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+async def wait_ready(http: aiohttp.ClientSession, url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with http.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"服务未能在 {timeout}s 内启动: {url}")
+
+# ==================== 客户端 ====================
+
+class ApiClient:
+    """HTTP 接口: 每轮一个 SSE 请求"""
+    def __init__(self, http: aiohttp.ClientSession, base: str):
+        self.http = http
+        self.base = base
+
+    async def ready(self):
+        await wait_ready(self.http, f"{self.base}/healthz")
+
+    async def new_session(self):
+        async with self.http.post(f"{self.base}/v1/sessions") as response:
+            return (await response.json())["session_id"]
+
+    async def turn(self, session, text: str) -> tuple:
+        """返回 (首 token 时间, 回复文本)"""
+        start = time.perf_counter()
+        first_token, reply, event = None, "", None
+        async with self.http.post(f"{self.base}/v1/sessions/{session}/messages", json={"text": text}) as response:
+            async for line in response.content:
+                if line.startswith(b"event: "):
+                    event = line[7:].strip()
+                elif line.startswith(b"data: ") and event == b"token":
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    reply += json.loads(line[6:])["text"]
+                elif line.startswith(b"data: ") and event == b"reset":
+                    reply = reply[:len(reply) - json.loads(line[6:])["length"]]
+        return first_token, reply
+
+class GradioClient:
+    """Gradio 界面: 按浏览器的事件链调用队列接口"""
+    def __init__(self, http: aiohttp.ClientSession, base: str):
+        self.http = http
+        self.base = base
+        self.fn = {}
+
+    async def ready(self):
+        await wait_ready(self.http, f"{self.base}/config")
+        async with self.http.get(f"{self.base}/config") as response:
+            config = await response.json()
+        self.api = self.base + config.get("api_prefix", "/gradio_api")
+        self.fn = {dep["api_name"]: dep["id"] for dep in config["dependencies"]}
+
+    async def call(self, session_hash: str, api_name: str, data: list, on_generating=None) -> list:
+        """提交一个事件并等待完成，返回输出数据"""
+        async with self.http.post(f"{self.api}/queue/join", json={
+            "data": data, "event_data": None, "fn_index": self.fn[api_name],
+            "trigger_id": None, "session_hash": session_hash,
+        }) as response:
+            event_id = (await response.json())["event_id"]
+        async with self.http.get(f"{self.api}/queue/data", params={"session_hash": session_hash}) as response:
+            async for line in response.content:
+                if not line.startswith(b"data:"):
+                    continue
+                message = json.loads(line[5:])
+                if message.get("event_id") != event_id:
+                    continue
+                if message["msg"] == "process_generating" and on_generating:
+                    on_generating()
+                elif message["msg"] == "process_completed":
+                    if not message.get("success", True):
+                        raise RuntimeError(f"{api_name} 失败: {message.get('output')}")
+                    return message["output"]["data"]
+        raise RuntimeError(f"{api_name} 的事件流意外结束")
+
+    async def new_session(self):
+        session = {"hash": uuid.uuid4().hex[:11], "chat": []}
+        await self.call(session["hash"], "start_session", [])
+        return session
+
+    async def turn(self, session, text: str) -> tuple:
+        start = time.perf_counter()
+        first_token = None
+
+        def on_generating():
+            nonlocal first_token
+            if first_token is None:
+                first_token = time.perf_counter() - start
+
+        await self.call(session["hash"], "save_message_to_state_1", [text])
+        chat, _ = await self.call(session["hash"], "add_user_message_1", [session["chat"], text])
+        # State 输入由服务端按 session_hash 填充，这里传占位的 None
+        outputs = await self.call(session["hash"], "process_text_input_stream_1", [None, chat, False, None], on_generating)
+        await self.call(session["hash"], "lambda_2", [None])
+        session["chat"] = outputs[0]
+        return first_token, outputs[0][-1]["content"]
+
+# ==================== 压测 ====================
+
+async def simulate_patient(client, patient_id: int, turns: int, stats: dict):
+    session = await client.new_session()
+    tag = f"患者{patient_id}号"
+    for turn in range(turns):
+        start = time.perf_counter()
+        try:
+            first_token, reply = await client.turn(session, f"我是{tag}，第{turn + 1}轮：头痛伴随低烧")
+        except Exception as e:
+            stats["failures"].append(f"{tag} 第{turn + 1}轮: {e}")
+            continue
+        stats["latencies"].append(time.perf_counter() - start)
+        if first_token is not None:
+            stats["ttfts"].append(first_token)
+        if tag not in reply:
+            stats["failures"].append(f"{tag} 第{turn + 1}轮回复不属于自己: {reply[:60]}")
+
+async def run_level(client, pid: int, concurrency: int, turns: int, offset: int) -> dict:
+    stats = {"latencies": [], "ttfts": [], "failures": []}
+    cpu_before = cpu_seconds(pid)
+    start = time.perf_counter()
+    await asyncio.gather(*[simulate_patient(client, offset + i, turns, stats) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    completed = len(stats["latencies"])
+    cpu = cpu_seconds(pid) - cpu_before
+    return {
+        "concurrency": concurrency,
+        "turns": completed,
+        "failures": len(stats["failures"]),
+        "failure_samples": stats["failures"][:3],
+        "throughput": completed / elapsed if elapsed else 0.0,
+        "ttft_p50": percentile(stats["ttfts"], 50),
+        "ttft_p95": percentile(stats["ttfts"], 95),
+        "latency_p50": percentile(stats["latencies"], 50),
+        "latency_p95": percentile(stats["latencies"], 95),
+        "cpu_per_turn_ms": 1000 * cpu / completed if completed else 0.0,
+    }
+
+async def run_target(kind: str, http: aiohttp.ClientSession, pid: int, args, offset: int) -> list:
+    client = (ApiClient if kind == "api" else GradioClient)(http, f"http://127.0.0.1:{args.port}")
+    await client.ready()
+    # 预热: 启动 MCP 会话池并构建 Agent，不计入结果
+    await simulate_patient(client, offset - 1, 1, {"latencies": [], "ttfts": [], "failures": []})
+    results = []
+    for index, concurrency in enumerate(args.concurrency):
+        result = await run_level(client, pid, concurrency, args.turns, offset=offset + index * 10000)
+        print(f"[{kind:6}] 并发 {concurrency:>4}: {result['turns']} 轮 {result['throughput']:.2f} 轮/秒  "
+              f"TTFT p50={result['ttft_p50']:.3f}s  延迟 p50={result['latency_p50']:.3f}s "
+              f"p95={result['latency_p95']:.3f}s  CPU {result['cpu_per_turn_ms']:.1f}ms/轮  失败 {result['failures']}")
+        for failure in result["failure_samples"]:
+            print(f"  - {failure}")
+        results.append(result)
+    return results
+
+def print_comparison(gradio: list, api: list):
+    print(f"\n{'并发':>6} {'吞吐(轮/秒) Gradio → API':>28} {'TTFT p50':>22} {'CPU ms/轮':>20}")
+    for g, a in zip(gradio, api):
+        speedup = a["throughput"] / g["throughput"] if g["throughput"] else 0.0
+        print(f"{g['concurrency']:>6} {g['throughput']:>12.2f} → {a['throughput']:<8.2f} (x{speedup:.2f})"
+              f" {g['ttft_p50']:>9.3f}s → {a['ttft_p50']:.3f}s"
+              f" {g['cpu_per_turn_ms']:>9.1f} → {a['cpu_per_turn_ms']:.1f}")
+
+async def main(args):
+    from fake_openai_server import start_fake_server
+
+    runner = await start_fake_server(args.model_port, ttft=args.ttft, token_delay=args.token_delay)
+    process = start_server(args.port)
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as http:
+            # 两种接口使用不同的患者编号，会话互不重叠
+            gradio = await run_target("gradio", http, process.pid, args, offset=0)
+            api = await run_target("api", http, process.pid, args, offset=1000000)
+        print_comparison(gradio, api)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({
+                    "config": {"ttft": args.ttft, "token_delay": args.token_delay, "turns": args.turns},
+                    "gradio": gradio,
+                    "api": api,
+                }, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已写入 {args.json}")
+        failed = sum(result["failures"] for result in gradio + api)
+        return 1 if failed else 0
+    finally:
+        stop_server(process)
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP 接口与 Gradio 界面的吞吐对比")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50], help="依次测试的并发患者数")
+    parser.add_argument("--turns", type=int, default=3, help="每个患者的问诊轮次")
+    parser.add_argument("--model-port", type=int, default=9100)
+    parser.add_argument("--port", type=int, default=9180, help="服务进程(界面和 HTTP 接口)的端口")
+    parser.add_argument("--ttft", type=float, default=0.2, help="假模型首 token 延迟(秒)")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="假模型逐 token 延迟(秒)")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+    configure_env(args.model_port)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,230 @@
+"""
+本地 OpenAI 兼容的假模型服务，用于压测和基准测试(不消耗真实模型额度)
+- 决策请求(包含 QUESTION/ADVICE 指令)返回 QUESTION，其余请求回显最后一条用户消息
+- 支持 stream=True 的 SSE 流式输出
+- 可配置首 token 延迟和逐 token 延迟
+- 可通过 POST /control 在运行时调整延迟和故障率，模拟服务商故障，例如
+  {"ttft": 5.0} 或 {"fail_rate": 1.0}
+- {"cut_streams": N} 使接下来 N 个流式回复(决策请求除外)输出一半后断开连接，模拟生成中途的故障
+- tool_calls=True 时，请求带有 search_medical_knowledge 工具且最后一条是用户消息，
+  先返回一次工具调用(用于让压测覆盖 MCP 工具链路)；tool_preamble 为工具调用之前输出的铺垫文本
+- 按块模拟 vLLM 的自动前缀缓存：与之前请求相同的最长前缀计入 usage.prompt_tokens_details.cached_tokens
+
+用法: python fake_openai_server.py --port 9100 --ttft 0.3 --token-delay 0.01
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from collections import OrderedDict
+from aiohttp import web
+
+def _last_user_text(messages: list) -> str:
+    for msg in reversed(messages):
+        if msg.get("role") == "user":
+            content = msg.get("content") or ""
+            if isinstance(content, list):
+                content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return content
+    return ""
+
+def _is_decision(messages: list) -> bool:
+    return "'QUESTION' 或 'ADVICE'" in "\n".join(str(m.get("content") or "") for m in messages)
+
+def _reply_for(messages: list) -> str:
+    if _is_decision(messages):
+        return "QUESTION"
+    return f"收到：{_last_user_text(messages)}。请问症状持续多久了？"
+
+def _wants_tool_call(body: dict) -> bool:
+    tools = [t.get("function", {}).get("name") for t in body.get("tools") or []]
+    messages = body.get("messages", [])
+    return "search_medical_knowledge" in tools and bool(messages) and messages[-1].get("role") == "user"
+
+def _tokens(text: str) -> list[str]:
+    # 每个字符作为一个 token，足够模拟流式输出
+    return list(text)
+
+def _usage(messages: list, completion: str, cached_tokens: int = 0) -> dict:
+    prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(completion),
+        "total_tokens": prompt_tokens + len(completion),
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+class PrefixCache:
+    """
+    模拟 vLLM 的自动前缀缓存: 把请求渲染为文本后按固定长度分块，逐块计算链式哈希，
+    与之前请求相同的最长块前缀视为命中 (以字符近似 token)
+    """
+    def __init__(self, block_size: int = 16, max_blocks: int = 200000):
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._seen = OrderedDict()
+
+    def lookup(self, body: dict) -> int:
+        rendered = json.dumps(body.get("tools") or [], sort_keys=True) + "".join(
+            f"<{m.get('role')}>{m.get('content') or ''}</{m.get('role')}>" for m in body.get("messages", [])
+        )
+        digest = hashlib.sha256()
+        cached, hit = 0, True
+        for start in range(0, len(rendered) - self.block_size + 1, self.block_size):
+            digest.update(rendered[start:start + self.block_size].encode())
+            key = digest.copy().hexdigest()
+            if hit and key in self._seen:
+                self._seen.move_to_end(key)
+                cached = start + self.block_size
+            else:
+                hit = False
+                self._seen[key] = True
+        while len(self._seen) > self.max_blocks:
+            self._seen.popitem(last=False)
+        # 渲染文本中包含角色标记和工具定义，按 prompt_tokens 的口径折算
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in body.get("messages", []))
+        return min(prompt_tokens, int(cached * prompt_tokens / len(rendered))) if rendered else 0
+
+def create_app(ttft: float = 0.2, token_delay: float = 0.005, fail_rate: float = 0.0,
+               tool_calls: bool = False, tool_preamble: str = "") -> web.Application:
+    stats = {"requests": 0, "failed": 0, "tool_calls": 0, "prompt_tokens": 0, "cached_tokens": 0,
+             "completion_tokens": 0, "aborted": 0, "cut": 0}
+    prefix_cache = PrefixCache()
+    control = {"ttft": ttft, "token_delay": token_delay, "fail_rate": fail_rate, "cut_streams": 0}
+
+    async def chat_completions(request: web.Request):
+        body = await request.json()
+        stats["requests"] += 1
+        messages = body.get("messages", [])
+        model = body.get("model", "fake")
+        reply = _reply_for(messages)
+        cached_tokens = prefix_cache.lookup(body)
+        stats["prompt_tokens"] += _usage(messages, "")["prompt_tokens"]
+        stats["cached_tokens"] += cached_tokens
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        token_delay = control["token_delay"]
+
+        await asyncio.sleep(control["ttft"])
+        if random.random() < control["fail_rate"]:
+            stats["failed"] += 1
+            return web.json_response(
+                {"error": {"message": "fake upstream error", "type": "server_error"}}, status=503
+            )
+
+        tool_call = None
+        if tool_calls and _wants_tool_call(body):
+            stats["tool_calls"] += 1
+            tool_call = {
+                "id": f"call_{uuid.uuid4().hex[:8]}",
+                "type": "function",
+                "function": {
+                    "name": "search_medical_knowledge",
+                    "arguments": json.dumps({"query": _last_user_text(messages)[:50]}, ensure_ascii=False),
+                },
+            }
+            reply = tool_preamble
+
+        if not body.get("stream"):
+            await asyncio.sleep(token_delay * len(reply))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply, **({"tool_calls": [tool_call]} if tool_call else {})},
+                    "finish_reason": "tool_calls" if tool_call else "stop",
+                }],
+                "usage": _usage(messages, reply, cached_tokens),
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        def chunk(delta: dict, finish_reason=None, usage=None) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if usage is not None:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+        tokens = _tokens(reply)
+        cut_at = None
+        if control["cut_streams"] > 0 and not _is_decision(messages):
+            control["cut_streams"] -= 1
+            cut_at = len(tokens) // 2
+        try:
+            await response.write(chunk({"role": "assistant", "content": ""}))
+            for index, token in enumerate(tokens):
+                if request.transport is None or request.transport.is_closing():
+                    # 客户端已断开(请求被取消)，与 vLLM 一样停止生成
+                    raise ConnectionResetError
+                if index == cut_at:
+                    # 模拟生成中途的故障: 不发送结束标记直接断开连接
+                    stats["cut"] += 1
+                    request.transport.close()
+                    return response
+                await response.write(chunk({"content": token}))
+                stats["completion_tokens"] += 1
+                await asyncio.sleep(token_delay)
+            if tool_call:
+                # 与真实模型一样，工具调用在铺垫文本之后输出
+                await response.write(chunk({"tool_calls": [{"index": 0, **tool_call}]}))
+            await response.write(chunk({}, finish_reason="tool_calls" if tool_call else "stop",
+                                       usage=_usage(messages, reply, cached_tokens)))
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            stats["aborted"] += 1
+        except asyncio.CancelledError:
+            stats["aborted"] += 1
+            raise
+        return response
+
+    async def models(request: web.Request):
+        return web.json_response({"object": "list", "data": [{"id": "fake", "object": "model"}]})
+
+    async def get_stats(request: web.Request):
+        return web.json_response(stats)
+
+    async def set_control(request: web.Request):
+        control.update({k: type(control[k])(v) for k, v in (await request.json()).items() if k in control})
+        return web.json_response(control)
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/v1/models", models)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_post("/control", set_control)
+    return app
+
+async def start_fake_server(port: int, ttft: float = 0.2, token_delay: float = 0.005,
+                            fail_rate: float = 0.0, tool_calls: bool = False, tool_preamble: str = "") -> web.AppRunner:
+    """在当前事件循环中启动假模型服务，返回 runner (调用 runner.cleanup() 关闭)"""
+    runner = web.AppRunner(create_app(ttft=ttft, token_delay=token_delay, fail_rate=fail_rate,
+                                      tool_calls=tool_calls, tool_preamble=tool_preamble))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的假模型服务")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=0.2, help="首 token 延迟(秒)")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="逐 token 延迟(秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 503 的概率")
+    parser.add_argument("--tool-calls", action="store_true", help="问诊请求先返回一次知识库工具调用")
+    parser.add_argument("--tool-preamble", default="", help="工具调用之前输出的铺垫文本")
+    args = parser.parse_args()
+    web.run_app(create_app(ttft=args.ttft, token_delay=args.token_delay, fail_rate=args.fail_rate,
+                           tool_calls=args.tool_calls, tool_preamble=args.tool_preamble),
+                host="127.0.0.1", port=args.port)
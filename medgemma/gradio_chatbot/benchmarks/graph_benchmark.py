@@ -0,0 +1,301 @@
+"""
+问诊流程 (graph) 端到端基准测试
+
+使用本地假模型服务和 MCP 桩服务(延迟可配置)，按脚本回放多轮问诊对话，
+包括"直接生成建议" -> 摘要审核中断 -> Command(resume=...) 恢复的完整流程；
+在不同并发度下统计每轮延迟、首 token 延迟(TTFT)、各节点耗时、吞吐和 p50/p95/p99。
+
+用法 (在 medgemma/gradio_chatbot 目录下):
+    python benchmarks/graph_benchmark.py --concurrency 1 4 16 --json result.json
+    python benchmarks/graph_benchmark.py --scripts dialogues.json --baseline result.json
+
+脚本文件格式 (JSON):
+    [{"name": "头痛", "steps": [
+        {"user": "我头痛三天了"},
+        {"user": "没有发烧"},
+        {"user": "生成用户病况摘要", "skip_to_advice": true},
+        {"resume": null}
+    ]}]
+resume 为 null 表示不修改摘要直接提交，为字符串时作为编辑后的摘要
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+sys.path.insert(0, BENCH_DIR)
+
+from load_test_sessions import configure_env, percentile
+
+# 需要统计首 token 延迟的节点
+STREAMING_NODES = {"question_node", "advice_node"}
+
+DEFAULT_SCRIPTS = [
+    {"name": "头痛-直接建议", "steps": [
+        {"user": "我头痛三天了，太阳穴附近胀痛"},
+        {"user": "没有发烧，晚上睡不好"},
+        {"user": "最近工作压力比较大，每天看电脑十个小时"},
+        {"user": "生成用户病况摘要", "skip_to_advice": True},
+        {"resume": None},
+    ]},
+    {"name": "咳嗽-编辑摘要", "steps": [
+        {"user": "发烧咳嗽两天，体温38度5"},
+        {"user": "有黄痰，喉咙痛"},
+        {"user": "生成用户病况摘要", "skip_to_advice": True},
+        {"resume": "患者发热咳嗽两天，最高体温38.5℃，黄痰，咽痛，无基础疾病。"},
+    ]},
+    {"name": "腹痛-多轮问诊", "steps": [
+        {"user": "肚子疼，饭后更明显"},
+        {"user": "右上腹，一阵一阵的"},
+        {"user": "吃油腻的东西之后最厉害"},
+        {"user": "没有呕吐，大便正常"},
+        {"user": "以前没有胆结石"},
+    ]},
+]
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+class Metrics:
+    def __init__(self):
+        self.turns = defaultdict(list)  # 步骤类型 -> 每轮耗时
+        self.ttft = []
+        self.nodes = defaultdict(list)  # 节点名 -> 每次耗时
+        self.errors = []
+        self.interrupts = 0
+
+    def report(self, elapsed: float, dialogues: int) -> dict:
+        all_turns = [v for values in self.turns.values() for v in values]
+        return {
+            "dialogues": dialogues,
+            "turns": len(all_turns),
+            "elapsed": elapsed,
+            "throughput": len(all_turns) / elapsed if elapsed else 0.0,
+            "turn_latency": summarize(all_turns),
+            "turn_latency_by_step": {kind: summarize(values) for kind, values in self.turns.items()},
+            "ttft": summarize(self.ttft),
+            "nodes": {node: summarize(values) for node, values in sorted(self.nodes.items())},
+            "interrupts": self.interrupts,
+            "errors": len(self.errors),
+            "error_samples": self.errors[:5],
+        }
+
+async def run_turn(graph, graph_input, config: dict, kind: str, metrics: Metrics) -> bool:
+    """运行一轮 graph，返回是否停在摘要审核中断上"""
+    from langchain_core.messages import AIMessageChunk
+
+    start = time.perf_counter()
+    first_token = None
+    task_starts = {}
+    async for namespace, mode, payload in graph.astream(
+        graph_input, config=config, stream_mode=["messages", "tasks"], subgraphs=True
+    ):
+        now = time.perf_counter()
+        if mode == "messages":
+            chunk, metadata = payload
+            node = namespace[0].split(":")[0] if namespace else metadata.get("langgraph_node")
+            if first_token is None and node in STREAMING_NODES \
+                    and isinstance(chunk, AIMessageChunk) and isinstance(chunk.content, str) and chunk.content:
+                first_token = now - start
+        elif mode == "tasks" and not namespace:
+            # 顶层节点的开始/结束事件
+            if "input" in payload:
+                task_starts[payload["id"]] = now
+            elif payload["id"] in task_starts:
+                metrics.nodes[payload["name"]].append(now - task_starts.pop(payload["id"]))
+
+    metrics.turns[kind].append(time.perf_counter() - start)
+    if first_token is not None:
+        metrics.ttft.append(first_token)
+
+    state = await graph.aget_state(config)
+    return any(task.interrupts for task in state.tasks)
+
+async def run_dialogue(graph, script: dict, index: int, metrics: Metrics, unique_text: bool):
+    from langchain_core.messages import HumanMessage
+    from langgraph.types import Command
+    from medgemma.gradio_chatbot.utils.scheduler import current_session
+
+    session_id = str(uuid.uuid4())
+    current_session.set(session_id)
+    config = {"configurable": {"thread_id": session_id}}
+    interrupted = False
+    for step_index, step in enumerate(script["steps"]):
+        try:
+            if "resume" in step:
+                if not interrupted:
+                    raise RuntimeError("脚本要求恢复执行，但流程没有停在摘要审核上")
+                edited_summary = step["resume"]
+                if edited_summary is None:
+                    # 与界面一致: 不修改时提交的就是审核框里原样的摘要
+                    state = await graph.aget_state(config)
+                    edited_summary = next(t for t in state.tasks if t.interrupts).interrupts[0].value["summary"]
+                interrupted = await run_turn(graph, Command(resume=edited_summary), config, "resume", metrics)
+                continue
+            text = step["user"]
+            if unique_text and not step.get("skip_to_advice"):
+                # 不同对话使用不同的文本，避免决策缓存/问诊缓存让结果偏乐观
+                text = f"[患者{index}] {text}"
+            graph_input = {"messages": [HumanMessage(content=text)], "skip_to_advice": step.get("skip_to_advice", False)}
+            kind = "advice_request" if step.get("skip_to_advice") else "user"
+            interrupted = await run_turn(graph, graph_input, config, kind, metrics)
+            metrics.interrupts += interrupted
+        except Exception as e:
+            metrics.errors.append(f"{script['name']} 第{step_index + 1}步: {e!r}")
+            return
+
+async def run_level(graph, scripts: list, concurrency: int, dialogues: int, unique_text: bool,
+                    patients: itertools.count) -> dict:
+    """patients 为跨并发度递增的患者编号，各并发度的对话文本互不相同，不会命中上一并发度留下的缓存"""
+    metrics = Metrics()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int, patient: int):
+        async with semaphore:
+            await run_dialogue(graph, scripts[i % len(scripts)], patient, metrics, unique_text)
+
+    before = _endpoint_tokens()
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i, next(patients)) for i in range(dialogues)])
+    result = {"concurrency": concurrency, **metrics.report(time.perf_counter() - start, dialogues)}
+    result["prompt_cache"] = _prompt_cache_delta(before, _endpoint_tokens(), result["turns"])
+    return result
+
+def _endpoint_tokens() -> dict:
+    from medgemma.gradio_chatbot.utils.model_router import get_router_stats
+    return {
+        name: (endpoint["prompt_tokens"], endpoint["cached_tokens"])
+        for router in get_router_stats().values() for name, endpoint in router["endpoints"].items()
+    }
+
+def _prompt_cache_delta(before: dict, after: dict, turns: int) -> dict:
+    """各端点在本并发度下的输入 token、命中前缀缓存的比例，以及平均每轮需要重新 prefill 的 token 数"""
+    result = {}
+    for name, (prompt, cached) in after.items():
+        prompt -= before.get(name, (0, 0))[0]
+        cached -= before.get(name, (0, 0))[1]
+        if prompt:
+            result[name] = {
+                "prompt_tokens": prompt,
+                "cached_tokens": cached,
+                "ratio": cached / prompt,
+                "uncached_per_turn": (prompt - cached) / turns if turns else 0.0,
+            }
+    return result
+
+def print_level(result: dict):
+    turn, ttft = result["turn_latency"], result["ttft"]
+    print(f"\n=== 并发 {result['concurrency']}: {result['dialogues']} 段对话 / {result['turns']} 轮, "
+          f"耗时 {result['elapsed']:.2f}s, 吞吐 {result['throughput']:.2f} 轮/秒, 错误 {result['errors']} ===")
+    print(f"{'指标':<22}{'p50':>9}{'p95':>9}{'p99':>9}")
+    print(f"{'每轮延迟':<22}{turn['p50']:>9.3f}{turn['p95']:>9.3f}{turn['p99']:>9.3f}")
+    print(f"{'TTFT':<22}{ttft['p50']:>9.3f}{ttft['p95']:>9.3f}{ttft['p99']:>9.3f}")
+    for kind, stats in result["turn_latency_by_step"].items():
+        print(f"{'  步骤 ' + kind:<22}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}")
+    for node, stats in result["nodes"].items():
+        print(f"{'  节点 ' + node:<22}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}")
+    for name, cache in result["prompt_cache"].items():
+        print(f"  前缀缓存 {name}: 命中率 {cache['ratio']:.1%}, 每轮未命中输入 token {cache['uncached_per_turn']:.0f}")
+    for sample in result["error_samples"]:
+        print(f"  ❌ {sample}")
+
+def print_comparison(results: list, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {level["concurrency"]: level for level in json.load(f)["levels"]}
+
+    def delta(old: float, new: float) -> str:
+        return f"{old:.3f} -> {new:.3f} ({(new - old) / old * 100:+.1f}%)" if old else f"{new:.3f}"
+
+    print(f"\n=== 与基线对比: {baseline_path} ===")
+    for result in results:
+        old = baseline.get(result["concurrency"])
+        if old is None:
+            continue
+        print(f"并发 {result['concurrency']}: 每轮 p95 {delta(old['turn_latency']['p95'], result['turn_latency']['p95'])}"
+              f" | TTFT p50 {delta(old['ttft']['p50'], result['ttft']['p50'])}"
+              f" | 吞吐 {delta(old['throughput'], result['throughput'])}")
+
+async def main(args):
+    from fake_openai_server import start_fake_server
+
+    scripts = DEFAULT_SCRIPTS
+    if args.scripts:
+        with open(args.scripts, encoding="utf-8") as f:
+            scripts = json.load(f)
+
+    runner = await start_fake_server(args.model_port, ttft=args.ttft, token_delay=args.token_delay,
+                                     tool_calls=args.tool_calls)
+    try:
+        from medgemma.gradio_chatbot.graph.builder import graph
+
+        # 预热: 启动 MCP 会话池并构建 Agent，不计入结果
+        await run_dialogue(graph, {"name": "warmup", "steps": [{"user": "预热"}]}, -1, Metrics(), True)
+
+        results = []
+        patients = itertools.count()
+        for concurrency in args.concurrency:
+            dialogues = max(concurrency, args.dialogues)
+            result = await run_level(graph, scripts, concurrency, dialogues, not args.same_text, patients)
+            print_level(result)
+            results.append(result)
+
+        if args.baseline:
+            print_comparison(results, args.baseline)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({
+                    "config": {
+                        "ttft": args.ttft,
+                        "token_delay": args.token_delay,
+                        "mcp_latency": float(os.environ.get("STUB_MCP_LATENCY", "0.2")),
+                        "tool_calls": args.tool_calls,
+                        "scripts": [script["name"] for script in scripts],
+                    },
+                    "levels": results,
+                }, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已写入 {args.json}")
+        if args.metrics:
+            from medgemma.gradio_chatbot.utils.metrics import render_metrics
+            with open(args.metrics, "w", encoding="utf-8") as f:
+                f.write(render_metrics())
+            print(f"Prometheus 指标已写入 {args.metrics}")
+    finally:
+        from medgemma.gradio_chatbot.graph.nodes import cancel_summary_drafts
+        from medgemma.gradio_chatbot.tools.mcp_client import close_sessions
+        from medgemma.gradio_chatbot.utils.llm_clients import close_clients
+        cancel_summary_drafts()
+        await close_sessions()
+        await close_clients()
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="问诊流程端到端基准测试")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="依次测试的并发度")
+    parser.add_argument("--dialogues", type=int, default=8, help="每个并发度下至少回放的对话数")
+    parser.add_argument("--scripts", help="对话脚本 JSON 文件，不指定则使用内置脚本")
+    parser.add_argument("--model-port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=0.2, help="假模型首 token 延迟(秒)")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="假模型逐 token 延迟(秒)")
+    parser.add_argument("--mcp-latency", type=float, default=0.2, help="MCP 桩服务工具调用延迟(秒)")
+    parser.add_argument("--tool-calls", action="store_true", help="问诊时先调用一次知识库工具")
+    parser.add_argument("--same-text", action="store_true", help="所有对话使用完全相同的文本(用于测试缓存效果)")
+    parser.add_argument("--baseline", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    parser.add_argument("--metrics", help="将运行结束时的 Prometheus 指标写入文件")
+    args = parser.parse_args()
+    os.environ["STUB_MCP_LATENCY"] = str(args.mcp_latency)
+    configure_env(args.model_port)
+    sys.exit(asyncio.run(main(args)))
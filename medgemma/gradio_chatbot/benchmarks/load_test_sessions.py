@@ -0,0 +1,130 @@
+"""
+多会话并发压测：同时模拟多个患者进行问诊，验证会话之间互不干扰
+
+每个患者使用独立的 session_id，消息中带有自己的编号；
+检查每轮回复和最终的会话状态中只出现该患者自己的消息。
+
+用法 (在 medgemma/gradio_chatbot 目录下):
+    python benchmarks/load_test_sessions.py --patients 20 --turns 3
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(os.path.dirname(ROOT))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+
+def configure_env(model_port: int):
+    """将模型和 MCP 指向本地假服务 (必须在导入 app 之前调用)"""
+    os.environ.setdefault("OPENROUTER_API_KEY", "fake-key")
+    os.environ["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{model_port}/v1"
+    os.environ["MEDGEMMA_BASE_URL"] = f"http://127.0.0.1:{model_port}/v1"
+    os.environ["MCP_COMMAND"] = sys.executable
+    os.environ["MCP_MEDICAL_PATH"] = os.path.join(BENCH_DIR, "stub_mcp_server.py")
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    os.environ["AGENT_TOOLS_REFRESH_INTERVAL"] = "0"
+    for path in (ROOT, REPO_ROOT, BENCH_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+async def simulate_patient(app, patient_id: int, turns: int, latencies: list, failures: list, queue_positions: list):
+    from langchain_core.messages import HumanMessage
+    from medgemma.gradio_chatbot.graph.builder import graph
+    from medgemma.gradio_chatbot.graph.sessions import get_config
+    from medgemma.gradio_chatbot.graph.runner import TokenDelta, TokenReset, QueueStatus, StateSnapshot
+
+    session_id = app.new_session_id()
+    tag = f"患者{patient_id}号"
+    for turn in range(turns):
+        message = f"我是{tag}，第{turn + 1}轮：头痛伴随低烧"
+        start = time.perf_counter()
+        reply = ""
+        snapshot = None
+        async for event in app.agent_stream_response(message, session_id):
+            if isinstance(event, TokenDelta):
+                reply += event.text
+            elif isinstance(event, TokenReset):
+                reply = reply[:len(reply) - event.length]
+            elif isinstance(event, QueueStatus):
+                queue_positions.append(event.position)
+            elif isinstance(event, StateSnapshot):
+                snapshot = event
+        latencies.append(time.perf_counter() - start)
+        if tag not in reply:
+            failures.append(f"{tag} 第{turn + 1}轮回复不属于自己: {reply[:60]}")
+        if snapshot is None or snapshot.question_count != turn + 1:
+            failures.append(f"{tag} 第{turn + 1}轮的状态快照不正确: {snapshot}")
+
+    state = await graph.aget_state(get_config(session_id))
+    human_messages = [m.content for m in state.values.get("messages", []) if isinstance(m, HumanMessage)]
+    foreign = [m for m in human_messages if tag not in m]
+    if foreign:
+        failures.append(f"{tag} 的会话中混入了其他患者的消息: {foreign[:2]}")
+    if len(human_messages) != turns:
+        failures.append(f"{tag} 的会话消息数 {len(human_messages)} != {turns}")
+    if state.values.get("question_count", 0) != turns:
+        failures.append(f"{tag} 的提问轮次 {state.values.get('question_count')} != {turns}")
+
+async def main(args):
+    from fake_openai_server import start_fake_server
+
+    runner = await start_fake_server(args.model_port, ttft=args.ttft, token_delay=args.token_delay)
+    try:
+        import app
+
+        latencies, failures, queue_positions = [], [], []
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            simulate_patient(app, i, args.turns, latencies, failures, queue_positions)
+            for i in range(args.patients)
+        ])
+        elapsed = time.perf_counter() - start
+
+        print(f"\n患者数: {args.patients}  每人轮次: {args.turns}  总耗时: {elapsed:.2f}s")
+        print(f"吞吐: {len(latencies) / elapsed:.2f} 轮/秒")
+        if latencies:
+            print(f"单轮延迟 p50={statistics.median(latencies):.3f}s  "
+                  f"p95={percentile(latencies, 95):.3f}s  max={max(latencies):.3f}s")
+        from medgemma.gradio_chatbot.utils.scheduler import get_scheduler_stats
+        for base_url, stats in get_scheduler_stats().items():
+            print(f"后端 {base_url}: 并发峰值 {stats['peak_in_flight']}/{stats['limit']}  "
+                  f"排队 {stats['queued']} 次  平均等待 {stats['wait_avg']:.3f}s  拒绝 {stats['rejected']}")
+        if queue_positions:
+            print(f"用户看到的最大排队位置: {max(queue_positions)}")
+        if failures:
+            print(f"❌ 会话隔离检查失败 {len(failures)} 项:")
+            for failure in failures[:20]:
+                print(f"  - {failure}")
+            return 1
+        print("✅ 会话隔离检查通过")
+        return 0
+    finally:
+        from medgemma.gradio_chatbot.graph.nodes import cancel_summary_drafts
+        from medgemma.gradio_chatbot.tools.mcp_client import close_sessions
+        from medgemma.gradio_chatbot.utils.llm_clients import close_clients
+        cancel_summary_drafts()
+        await close_sessions()
+        await close_clients()
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多会话并发隔离压测")
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--model-port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    args = parser.parse_args()
+    configure_env(args.model_port)
+    sys.exit(asyncio.run(main(args)))
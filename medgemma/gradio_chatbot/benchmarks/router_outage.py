@@ -0,0 +1,110 @@
+"""
+模型路由故障演练：主模型和备用模型分别指向两个本地假服务，依次模拟
+正常 -> 主模型故障(503) -> 主模型变慢 -> 主模型恢复，记录每个阶段的请求延迟和路由统计
+
+用法 (在 medgemma/gradio_chatbot 目录下):
+    python benchmarks/router_outage.py --requests 20 --json router.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(os.path.dirname(ROOT))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+
+def configure_env(primary_port: int, fallback_port: int, breaker_reset: float):
+    """主模型和备用模型指向不同的假服务 (必须在导入路由模块之前调用)"""
+    os.environ.setdefault("OPENROUTER_API_KEY", "fake-key")
+    os.environ["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{primary_port}/v1"
+    os.environ["FALLBACK_BASE_URL"] = f"http://127.0.0.1:{fallback_port}/v1"
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    os.environ["MODEL_BREAKER_RESET"] = str(breaker_reset)
+    for path in (REPO_ROOT, BENCH_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+async def set_control(port: int, **control):
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"http://127.0.0.1:{port}/control", json=control) as resp:
+            await resp.json()
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+async def run_phase(router, name: str, requests: int, hedge: bool) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    latencies, errors = [], 0
+    before = dict(router.stats)
+    for i in range(requests):
+        start = time.perf_counter()
+        try:
+            await router.ainvoke([HumanMessage(content=f"{name} 请求 {i}")], kind="bench", hedge=hedge)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return {
+        "phase": name,
+        "requests": requests,
+        "errors": errors,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": max(latencies),
+        "failovers": router.stats["failovers"] - before["failovers"],
+        "hedged": router.stats["hedged"] - before["hedged"],
+        "hedge_wins": router.stats["hedge_wins"] - before["hedge_wins"],
+        "primary_state": router.primary.breaker.state,
+    }
+
+async def main(args):
+    from fake_openai_server import start_fake_server
+
+    primary = await start_fake_server(args.primary_port, ttft=args.ttft, token_delay=0.001)
+    fallback = await start_fake_server(args.fallback_port, ttft=args.ttft, token_delay=0.001)
+    try:
+        from medgemma.gradio_chatbot.utils.model_router import questioner_router as router
+
+        results = [await run_phase(router, "healthy", args.requests, hedge=True)]
+
+        await set_control(args.primary_port, fail_rate=1.0)
+        results.append(await run_phase(router, "primary-503", args.requests, hedge=True))
+
+        await set_control(args.primary_port, fail_rate=0.0, ttft=args.slow_ttft)
+        await asyncio.sleep(args.breaker_reset)
+        results.append(await run_phase(router, "primary-slow", args.requests, hedge=True))
+
+        await set_control(args.primary_port, ttft=args.ttft)
+        results.append(await run_phase(router, "recovered", args.requests, hedge=True))
+
+        print(f"\n{'阶段':<14}{'错误':>6}{'p50(s)':>9}{'p95(s)':>9}{'切换':>6}{'对冲':>6}{'对冲胜出':>8}  主端点")
+        for r in results:
+            print(f"{r['phase']:<14}{r['errors']:>6}{r['p50']:>9.3f}{r['p95']:>9.3f}"
+                  f"{r['failovers']:>6}{r['hedged']:>6}{r['hedge_wins']:>8}  {r['primary_state']}")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"phases": results, "router": router.get_stats()}, f, ensure_ascii=False, indent=2)
+    finally:
+        from medgemma.gradio_chatbot.utils.llm_clients import close_clients
+        await close_clients()
+        await primary.cleanup()
+        await fallback.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模型路由(熔断/切换/对冲)故障演练")
+    parser.add_argument("--requests", type=int, default=20, help="每个阶段的请求数")
+    parser.add_argument("--primary-port", type=int, default=9101)
+    parser.add_argument("--fallback-port", type=int, default=9102)
+    parser.add_argument("--ttft", type=float, default=0.1)
+    parser.add_argument("--slow-ttft", type=float, default=3.0, help="主模型变慢阶段的首 token 延迟")
+    parser.add_argument("--breaker-reset", type=float, default=2.0, help="熔断器打开后多久放行探测请求(秒)")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+    configure_env(args.primary_port, args.fallback_port, args.breaker_reset)
+    asyncio.run(main(args))
@@ -0,0 +1,34 @@
+"""
+本地 MCP 桩服务，用于在没有 medical-mcp 的环境下测试会话池和压测
+用法: 将 MCP_CONFIG 的 command/args 指向 `python stub_mcp_server.py`
+环境变量:
+    STUB_MCP_LATENCY  每次查询的模拟延迟(秒)，默认 0.2
+"""
+import asyncio
+import os
+import sys
+from mcp.server.fastmcp import FastMCP
+
+LATENCY = float(os.getenv("STUB_MCP_LATENCY", "0.2"))
+
+mcp = FastMCP("medical_query_stub")
+
+@mcp.tool()
+async def search_medical_knowledge(query: str) -> str:
+    """查询医学知识库，返回与症状或疾病相关的资料"""
+    await asyncio.sleep(LATENCY)
+    return f"[stub] 关于「{query}」的医学资料 (pid={os.getpid()})"
+
+@mcp.tool()
+async def slow_query(query: str, seconds: float = 5.0) -> str:
+    """模拟卡住的慢查询"""
+    await asyncio.sleep(seconds)
+    return f"[stub] slow result for {query}"
+
+@mcp.tool()
+def crash() -> str:
+    """模拟服务进程崩溃"""
+    sys.exit(1)
+
+if __name__ == "__main__":
+    mcp.run()
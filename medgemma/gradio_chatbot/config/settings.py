@@ -5,8 +5,20 @@ from dotenv import load_dotenv
 # 加载 .env 文件
 load_dotenv()
 
+# ==================== Data Directory ====================
+# 运行时生成的数据(语音缓存、会话 SQLite)默认放在包目录下的 data/，不随启动目录变化
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(PACKAGE_DIR, "data"))
+
 # ==================== LangSmith Configuration ====================
-os.environ["LANGCHAIN_TRACING_V2"] = os.getenv("LANGCHAIN_TRACING_V2", "true")
+# 远程 tracing 会把每次运行上报到 LangSmith，给每次调用增加网络开销
+# REMOTE_TRACING=false 时关闭；未设置时沿用 LANGCHAIN_TRACING_V2，且只有配置了 API Key 才默认开启
+REMOTE_TRACING = os.getenv(
+    "REMOTE_TRACING",
+    os.getenv("LANGCHAIN_TRACING_V2", "true" if os.getenv("LANGCHAIN_API_KEY") else "false")
+).lower() == "true"
+os.environ["LANGCHAIN_TRACING_V2"] = "true" if REMOTE_TRACING else "false"
+os.environ["LANGSMITH_TRACING"] = "true" if REMOTE_TRACING else "false"
 os.environ["LANGCHAIN_API_KEY"] = os.getenv("LANGCHAIN_API_KEY", "")
 os.environ["LANGCHAIN_PROJECT"] = os.getenv("LANGCHAIN_PROJECT", "consultation-flow")
 os.environ["LANGSMITH_ENDPOINT"] = os.getenv("LANGSMITH_ENDPOINT", "https://api.smith.langchain.com")
@@ -15,14 +27,17 @@ os.environ["LANGSMITH_ENDPOINT"] = os.getenv("LANGSMITH_ENDPOINT", "https://api.
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 
 if not OPENROUTER_API_KEY:
-    raise ValueError("OPENROUTER_API_KEY 未设置！请在 .env 文件中配置此环境变量。")
+    # 导入时只提示，压测和测试(假模型服务)不需要真实的密钥；启动服务时(app.create_server)缺少密钥直接报错
+    print("⚠️ OPENROUTER_API_KEY 未设置！请在 .env 文件中配置此环境变量。")
+
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 
 # ==================== Model Configurations ====================
 QUESTIONER_MODEL_CONFIG = {
     # "model": "z-ai/glm-4.5-air:free",
     "model": "xiaomi/mimo-v2-flash:free",
     "api_key": SecretStr(OPENROUTER_API_KEY),
-    "base_url": "https://openrouter.ai/api/v1",
+    "base_url": OPENROUTER_BASE_URL,
     "timeout": 60,
     "max_retries": 2,
 }
@@ -38,11 +53,63 @@ MEDGEMMA_MODEL_CONFIG = {
 FALLBACK_MODEL_CONFIG = {
     "model": "amazon/nova-2-lite-v1:free",
     "api_key": SecretStr(OPENROUTER_API_KEY),
-    "base_url": "https://openrouter.ai/api/v1",
+    "base_url": os.getenv("FALLBACK_BASE_URL", OPENROUTER_BASE_URL),
     "timeout": 60,
     "max_retries": 2,
 }
 
+# 可选的 MedGemma 备用端点(例如第二个 vLLM 实例)，未配置时 MedGemma 只有一个端点
+MEDGEMMA_FALLBACK_BASE_URL = os.getenv("MEDGEMMA_FALLBACK_BASE_URL", "")
+MEDGEMMA_FALLBACK_MODEL_CONFIG = {
+    **MEDGEMMA_MODEL_CONFIG,
+    "base_url": MEDGEMMA_FALLBACK_BASE_URL,
+} if MEDGEMMA_FALLBACK_BASE_URL else None
+
+# ==================== LLM Clients ====================
+# 同一后端的模型客户端共享 httpx 连接池
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"  # 需要安装 h2
+# 每个后端同时进行的请求数上限，本地 MedGemma 只有一个 vLLM 实例，限制更严
+LLM_DEFAULT_CONCURRENCY = int(os.getenv("LLM_DEFAULT_CONCURRENCY", "32"))
+MEDGEMMA_MAX_CONCURRENCY = int(os.getenv("MEDGEMMA_MAX_CONCURRENCY", "8"))
+# 流式调用也返回 token 用量(stream_options.include_usage)，OpenRouter 和 vLLM 均支持
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"
+
+# ==================== Scheduler ====================
+# 每个后端排队等待的请求数上限，超过后新请求直接返回"繁忙"
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "64"))
+# 排队期间向用户刷新排队位置的间隔(秒)
+QUEUE_STATUS_INTERVAL = float(os.getenv("QUEUE_STATUS_INTERVAL", "1.0"))
+
+# ==================== Model Router ====================
+# 熔断: 端点连续失败 N 次后打开，RESET 秒后放行一个探测请求
+MODEL_BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "3"))
+MODEL_BREAKER_RESET = float(os.getenv("MODEL_BREAKER_RESET", "30"))
+MODEL_EWMA_ALPHA = float(os.getenv("MODEL_EWMA_ALPHA", "0.2"))  # 延迟/错误率 EWMA 的平滑系数
+MODEL_LATENCY_WINDOW = int(os.getenv("MODEL_LATENCY_WINDOW", "100"))  # 计算 p95 的最近样本数
+# 对冲请求: 主端点超过 p95 延迟仍未返回时向备用端点发起请求(不用于流式输出给用户的调用)
+MODEL_HEDGE = os.getenv("MODEL_HEDGE", "true").lower() == "true"
+MODEL_HEDGE_DELAY = float(os.getenv("MODEL_HEDGE_DELAY", "5"))  # 样本不足时使用的延迟预算(秒)
+MODEL_HEDGE_MIN_DELAY = float(os.getenv("MODEL_HEDGE_MIN_DELAY", "0.5"))
+MODEL_HEDGE_MAX_DELAY = float(os.getenv("MODEL_HEDGE_MAX_DELAY", "15"))
+MODEL_HEDGE_MIN_SAMPLES = int(os.getenv("MODEL_HEDGE_MIN_SAMPLES", "10"))
+# 有备用端点时每个端点的客户端重试次数(由路由负责切换端点)
+MODEL_ROUTER_MAX_RETRIES = int(os.getenv("MODEL_ROUTER_MAX_RETRIES", "0"))
+
+# ==================== Decision Configuration ====================
+# 决策节点只需输出 QUESTION / ADVICE，使用低温度并限制生成长度
+DECISION_MAX_TOKENS = int(os.getenv("DECISION_MAX_TOKENS", "5"))
+DECISION_TEMPERATURE = float(os.getenv("DECISION_TEMPERATURE", "0"))
+# 使用 vLLM 的 guided_choice 约束输出，后端不支持时自动退回普通调用
+DECISION_GUIDED_CHOICE = os.getenv("DECISION_GUIDED_CHOICE", "true").lower() == "true"
+DECISION_CACHE_SIZE = int(os.getenv("DECISION_CACHE_SIZE", "1024"))
+# 提问轮次少于该值时直接继续提问，不调用模型
+DECISION_MIN_QUESTIONS = int(os.getenv("DECISION_MIN_QUESTIONS", "1"))
+# 用户消息中包含这些词时直接进入建议流程
+DECISION_ADVICE_KEYWORDS = ("直接给建议", "给我建议", "生成建议")
+
 # ==================== MCP Configuration ====================
 MCP_MEDICAL_PATH = os.getenv(
     "MCP_MEDICAL_PATH", 
@@ -52,11 +119,32 @@ MCP_MEDICAL_PATH = os.getenv(
 MCP_CONFIG = {
     "medical_query": {
         "transport": "stdio",
-        "command": "node",
+        "command": os.getenv("MCP_COMMAND", "node"),
         "args": [MCP_MEDICAL_PATH],
     },
 }
 
+# MCP 会话池：常驻进程数、最大等待请求数、获取会话超时、单次工具调用超时(秒)
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "2"))
+MCP_POOL_MAX_WAITING = int(os.getenv("MCP_POOL_MAX_WAITING", "32"))
+MCP_POOL_ACQUIRE_TIMEOUT = float(os.getenv("MCP_POOL_ACQUIRE_TIMEOUT", "10"))
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "30"))
+MCP_WORKER_RESTART_DELAY = float(os.getenv("MCP_WORKER_RESTART_DELAY", "1"))
+
+# 工具列表热重载检查间隔(秒)，0 表示关闭，只能通过 refresh_agent() 手动刷新
+AGENT_TOOLS_REFRESH_INTERVAL = float(os.getenv("AGENT_TOOLS_REFRESH_INTERVAL", "300"))
+
+# ==================== Tool Execution ====================
+# 每轮提问中所有工具调用(含重试和对冲)的总时间预算(秒)，预算不足时不再重试
+TOOL_TURN_BUDGET = float(os.getenv("TOOL_TURN_BUDGET", "10"))
+# 失败重试的退避: 在 [0, min(上限, 初始值 * 2^n)] 内随机取值(full jitter)
+TOOL_RETRY_BASE_DELAY = float(os.getenv("TOOL_RETRY_BASE_DELAY", "0.2"))
+TOOL_RETRY_MAX_DELAY = float(os.getenv("TOOL_RETRY_MAX_DELAY", "2"))
+# 慢调用对冲: 超过该工具近期耗时的 P95(不低于最小延迟)仍未返回时，在空闲的 MCP 会话上再发起一次
+TOOL_HEDGING = os.getenv("TOOL_HEDGING", "true").lower() == "true"
+TOOL_HEDGE_MIN_DELAY = float(os.getenv("TOOL_HEDGE_MIN_DELAY", "0.5"))
+TOOL_HEDGE_MIN_SAMPLES = int(os.getenv("TOOL_HEDGE_MIN_SAMPLES", "20"))  # 样本不足时不对冲
+
 # ==================== Kokoro TTS Paths ====================
 KOKORO_VOICES_DIR = os.getenv(
     "KOKORO_VOICES_DIR",
@@ -75,6 +163,115 @@ KOKORO_REPO_ID = os.getenv(
     "hexgrad/Kokoro-82M-v1.1-zh"
 )
 
+# ==================== Speech Configuration ====================
+# SPEECH_ENABLED=false 时为纯文字模式：不加载语音模型，界面隐藏语音组件
+SPEECH_ENABLED = os.getenv("SPEECH_ENABLED", "true").lower() == "true"
+# 启动时在后台线程中并行预热 ASR/TTS 模型；关闭时在首次使用时加载
+SPEECH_WARMUP = os.getenv("SPEECH_WARMUP", "true").lower() == "true"
+
+# ==================== TTS Cache ====================
+# 按句缓存合成好的语音(磁盘存储)，固定提示语和常见句子不再重复合成
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(DATA_DIR, "tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# 首次打开页面时预先合成欢迎语、审核提示和免责声明等固定内容
+TTS_CACHE_PREWARM = os.getenv("TTS_CACHE_PREWARM", "true").lower() == "true"
+
+# ==================== Audio Delivery ====================
+# 语音回复在内存中编码后直接交给 Gradio: wav / mp3 / opus (流式输出的音频块固定为 wav，由 Gradio 转码)
+TTS_AUDIO_FORMAT = os.getenv("TTS_AUDIO_FORMAT", "wav")
+# 应用本身不写音频文件，也没有单独的清理线程。落盘的只有 Gradio 缓存目录(GRADIO_TEMP_DIR)中的文件:
+# 上传的录音，以及非流式的语音回复(关闭 TTS_STREAMING 时整段合成的音频经 Audio.postprocess -> save_bytes_to_cache 写入)
+# 这些文件由 gr.Blocks(delete_cache=...) 定期清理，有意以此代替自行实现的过期清理
+# delete_cache 的参数: 文件保留时间和清理间隔(秒)，AUDIO_REAP_INTERVAL=0 关闭清理
+AUDIO_FILE_MAX_AGE = int(os.getenv("AUDIO_FILE_MAX_AGE", "3600"))
+AUDIO_REAP_INTERVAL = int(os.getenv("AUDIO_REAP_INTERVAL", "600"))
+
+# ==================== Inference Executor ====================
+# ASR/TTS 推理线程数和最大排队任务数，超出后语音请求降级(跳过语音回复/提示稍后重试)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "16"))
+
+# ==================== ASR Micro-batching ====================
+# 在时间窗口(秒)内收集并发的语音识别请求，合并为一批送入 Whisper
+ASR_BATCHING = os.getenv("ASR_BATCHING", "true").lower() == "true"
+ASR_BATCH_WINDOW = float(os.getenv("ASR_BATCH_WINDOW", "0.05"))
+ASR_MAX_BATCH_SIZE = int(os.getenv("ASR_MAX_BATCH_SIZE", "8"))
+ASR_CHUNK_LENGTH = int(os.getenv("ASR_CHUNK_LENGTH", "30"))  # 长音频分块长度(秒)
+
+# ==================== Checkpointer Configuration ====================
+# memory: 原始 MemorySaver(无上限) / lru: 有界内存(LRU + TTL) / sqlite: SQLite(WAL) 持久化
+CHECKPOINTER_BACKEND = os.getenv("CHECKPOINTER_BACKEND", "lru")
+# 问诊 Agent 的 checkpoint 只在单轮提问内有效，默认不落盘
+AGENT_CHECKPOINTER_BACKEND = os.getenv("AGENT_CHECKPOINTER_BACKEND", "lru")
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", os.path.join(DATA_DIR, "checkpoints.sqlite"))
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))  # 内存中最多保留的会话数
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", "21600"))  # 会话闲置多久后从内存淘汰(秒)，0 表示不过期
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "10"))  # 每个会话只保留最近 K 个 checkpoint
+CHECKPOINT_FLUSH_INTERVAL = float(os.getenv("CHECKPOINT_FLUSH_INTERVAL", "0.5"))  # SQLite 批量落盘间隔(秒)
+CHECKPOINT_FLUSH_BATCH = int(os.getenv("CHECKPOINT_FLUSH_BATCH", "200"))  # 待写条数达到该值时立即落盘
+
+# ==================== Streaming Configuration ====================
+# messages: 逐 token 推送模型输出 / updates: 节点完成后一次性返回
+GRAPH_STREAM_MODE = os.getenv("GRAPH_STREAM_MODE", "messages")
+# 流式语音合成：按句切分，边生成回复边合成并推送音频
+TTS_STREAMING = os.getenv("TTS_STREAMING", "true").lower() == "true"
+
+# ==================== History Compaction ====================
+# 较早的对话折叠为滚动摘要，只把摘要 + 最近 K 轮对话发给模型
+HISTORY_KEEP_EXCHANGES = int(os.getenv("HISTORY_KEEP_EXCHANGES", "3"))  # 原样保留的最近对话轮数(一问一答为一轮)
+HISTORY_COMPACT_BATCH = int(os.getenv("HISTORY_COMPACT_BATCH", "4"))  # 待折叠的消息达到该条数时才更新摘要
+# 超出 token 预算时按 N 条消息为一块丢弃最早的对话，起点在多轮之间保持不变，前缀缓存才能命中
+HISTORY_TRIM_ALIGN = int(os.getenv("HISTORY_TRIM_ALIGN", "4"))
+HISTORY_VIEW_CACHE_SIZE = int(os.getenv("HISTORY_VIEW_CACHE_SIZE", "1000"))  # 增量对话视图最多缓存的会话数
+# 各模型的对话历史 token 预算(估算值，不含系统提示词)
+MEDGEMMA_HISTORY_BUDGET = int(os.getenv("MEDGEMMA_HISTORY_BUDGET", "1500"))  # MedGemma max-model-len 为 4096
+QUESTIONER_HISTORY_BUDGET = int(os.getenv("QUESTIONER_HISTORY_BUDGET", "6000"))
+
+# ==================== Cancellation ====================
+# 用户发送新消息时取消同一会话中仍在进行的上一轮(模型生成、工具调用、语音合成)
+CANCEL_ON_NEW_MESSAGE = os.getenv("CANCEL_ON_NEW_MESSAGE", "true").lower() == "true"
+# 取消后等待进行中的任务退出(并回滚 checkpoint)的最长时间(秒)
+CANCEL_WAIT_TIMEOUT = float(os.getenv("CANCEL_WAIT_TIMEOUT", "5"))
+# 清空对话或关闭页面后释放该会话的 checkpoint、对话视图和摘要草稿
+RELEASE_SESSION_ON_EXIT = os.getenv("RELEASE_SESSION_ON_EXIT", "true").lower() == "true"
+
+# ==================== Server ====================
+# Gradio 界面和无界面的 HTTP 接口(api.py，SSE 流式输出)由同一个进程在同一端口提供，
+# 共享 graph、会话存储、模型调度和推理线程池
+APP_HOST = os.getenv("APP_HOST", "127.0.0.1")
+APP_PORT = int(os.getenv("APP_PORT", "7860"))
+API_MAX_AUDIO_BYTES = int(os.getenv("API_MAX_AUDIO_BYTES", str(25 * 1024 * 1024)))  # 上传录音的大小上限
+
+# ==================== Speculative Summary ====================
+# 提问轮次达到阈值后，每轮提问结束就在后台预先生成病情摘要草稿
+SPECULATIVE_SUMMARY = os.getenv("SPECULATIVE_SUMMARY", "true").lower() == "true"
+SPECULATIVE_SUMMARY_MIN_QUESTIONS = int(os.getenv("SPECULATIVE_SUMMARY_MIN_QUESTIONS", "3"))
+
+# ==================== Response Cache ====================
+# MCP 工具结果缓存: 按服务名 + 工具名 + 参数精确匹配 (默认关闭)
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "false").lower() == "true"
+# 允许缓存的工具名，逗号分隔；留空表示缓存所有工具
+TOOL_CACHE_TOOLS = tuple(t.strip() for t in os.getenv("TOOL_CACHE_TOOLS", "").split(",") if t.strip())
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "3600"))
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "2048"))
+TOOL_CACHE_MAX_BYTES = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# 首轮问诊缓存: 患者第一句话(繁简转换、去空白标点后)相同时直接复用首个问题 (默认关闭)
+QUESTION_CACHE_ENABLED = os.getenv("QUESTION_CACHE_ENABLED", "false").lower() == "true"
+QUESTION_CACHE_TTL = float(os.getenv("QUESTION_CACHE_TTL", "86400"))
+QUESTION_CACHE_MAX_ENTRIES = int(os.getenv("QUESTION_CACHE_MAX_ENTRIES", "1024"))
+QUESTION_CACHE_MAX_BYTES = int(os.getenv("QUESTION_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# ==================== Observability ====================
+# 本地指标: 节点耗时、排队时间、模型延迟、token 用量、重试/备用模型、ASR/TTS 耗时
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "smartconsult")
+# Prometheus 指标端点 http://127.0.0.1:<端口>/metrics，0 表示不启动
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+# 结构化日志(JSON 行): 留空不输出 / stdout / 文件路径
+METRICS_LOG = os.getenv("METRICS_LOG", "")
+METRICS_MAX_SESSIONS = int(os.getenv("METRICS_MAX_SESSIONS", "1000"))  # 按会话累计的指标最多保留的会话数
+
 # ==================== Session Configuration ====================
 DEFAULT_SESSION_ID = "default_session"
 MAX_QUESTIONS = 10
@@ -1,19 +1,23 @@
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
 from medgemma.gradio_chatbot.graph.state import CustomFlowState
-from medgemma.gradio_chatbot.graph.nodes import medgemma_decision, question_node, summary_node, edit_summary_node, advice_node
+from medgemma.gradio_chatbot.graph.nodes import compact_history, medgemma_decision, question_node, summary_node, edit_summary_node, advice_node
 from medgemma.gradio_chatbot.graph.edges import route_decision, route_after_question
+from medgemma.gradio_chatbot.graph.checkpointer import create_checkpointer
+from medgemma.gradio_chatbot.utils.metrics import instrument_node
 
 # ==================== 图构建 ====================
 workflow = StateGraph(CustomFlowState)
 
-workflow.add_node("medgemma_decision", medgemma_decision)
-workflow.add_node("question_node", question_node)
-workflow.add_node("summary_node", summary_node)
-workflow.add_node("edit_summary_node", edit_summary_node)
-workflow.add_node("advice_node", advice_node)
+# 每个节点都记录耗时，节点内的模型调用按节点名归类
+workflow.add_node("compact_history", instrument_node("compact_history", compact_history))
+workflow.add_node("medgemma_decision", instrument_node("medgemma_decision", medgemma_decision))
+workflow.add_node("question_node", instrument_node("question_node", question_node))
+workflow.add_node("summary_node", instrument_node("summary_node", summary_node))
+workflow.add_node("edit_summary_node", instrument_node("edit_summary_node", edit_summary_node))
+workflow.add_node("advice_node", instrument_node("advice_node", advice_node))
 
-workflow.add_edge(START, "medgemma_decision")
+workflow.add_edge(START, "compact_history")
+workflow.add_edge("compact_history", "medgemma_decision")
 
 workflow.add_conditional_edges(
     "medgemma_decision",
@@ -38,4 +42,4 @@ workflow.add_edge("edit_summary_node", "advice_node")
 workflow.add_edge("advice_node", END)
 
 # ==================== 编译图 ====================
-graph = workflow.compile(checkpointer=MemorySaver())
+graph = workflow.compile(checkpointer=create_checkpointer())
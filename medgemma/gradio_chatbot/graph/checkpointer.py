@@ -0,0 +1,378 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from langgraph.checkpoint.memory import MemorySaver
+from medgemma.gradio_chatbot.config.settings import (
+    CHECKPOINTER_BACKEND, CHECKPOINT_DB_PATH, CHECKPOINT_MAX_THREADS, CHECKPOINT_TTL,
+    CHECKPOINT_KEEP_LAST, CHECKPOINT_FLUSH_INTERVAL, CHECKPOINT_FLUSH_BATCH
+)
+
+# ==================== 内存 LRU Checkpointer ====================
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    有界的内存 Checkpointer
+    - 最多保留 max_threads 个会话，超出时淘汰最久未访问的会话(LRU)
+    - 超过 ttl 秒未访问的会话被淘汰
+    - 每个会话(每个命名空间)只保留最近 keep_last 个 checkpoint
+    """
+    def __init__(self, max_threads: int = CHECKPOINT_MAX_THREADS, ttl: float = CHECKPOINT_TTL,
+                 keep_last: int = CHECKPOINT_KEEP_LAST, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.keep_last = max(1, keep_last)
+        self._last_access = OrderedDict()  # thread_id -> 最近访问时间
+        self.stats = {"evicted": 0, "pruned": 0}
+
+    def _touch(self, thread_id: str):
+        self._last_access[thread_id] = time.monotonic()
+        self._last_access.move_to_end(thread_id)
+        self._evict()
+
+    def _can_evict(self, thread_id: str) -> bool:
+        return True
+
+    def _evict(self):
+        """淘汰超过数量上限或已过期的会话"""
+        now = time.monotonic()
+        for thread_id, last_access in list(self._last_access.items()):
+            over_limit = len(self._last_access) > self.max_threads
+            expired = self.ttl > 0 and now - last_access > self.ttl
+            if not over_limit and not expired:
+                break
+            if not self._can_evict(thread_id):
+                continue
+            self._drop_thread(thread_id)
+            self.stats["evicted"] += 1
+
+    def _drop_thread(self, thread_id: str):
+        """从内存中移除会话"""
+        self._last_access.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> list:
+        """
+        只保留最近 keep_last 个 checkpoint，并清理不再被引用的 writes 和 blobs
+        返回被删除的 (checkpoint_ids, blob_keys)
+        """
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_last:
+            return [], []
+
+        ordered = sorted(checkpoints.keys())
+        stale_ids = ordered[:-self.keep_last]
+        for checkpoint_id in stale_ids:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        referenced = set()
+        for saved_checkpoint, _, _ in checkpoints.values():
+            versions = self.serde.loads_typed(saved_checkpoint).get("channel_versions", {})
+            referenced.update(versions.items())
+        stale_blobs = [
+            key for key in self.blobs
+            if key[0] == thread_id and key[1] == checkpoint_ns and (key[2], key[3]) not in referenced
+        ]
+        for key in stale_blobs:
+            del self.blobs[key]
+
+        self.stats["pruned"] += len(stale_ids)
+        return stale_ids, stale_blobs
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        result = super().get_tuple(config)
+        if result is not None:
+            self._touch(thread_id)
+        elif not self.storage.get(thread_id):
+            # MemorySaver 的 defaultdict 会为不存在的会话创建空条目，这里清理掉
+            self.storage.pop(thread_id, None)
+        return result
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        self._prune(thread_id, config["configurable"]["checkpoint_ns"])
+        self._touch(thread_id)
+        return next_config
+
+    def delete_thread(self, thread_id: str):
+        self._drop_thread(thread_id)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "threads": len(self._last_access), "blobs": len(self.blobs)}
+
+# ==================== SQLite Checkpointer ====================
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    checkpoint_type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    parent_checkpoint_id TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    value_type TEXT NOT NULL,
+    value BLOB NOT NULL,
+    task_path TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    value_type TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+"""
+
+class SqliteCheckpointSaver(BoundedMemorySaver):
+    """
+    SQLite(WAL) 持久化的 Checkpointer，适用于单节点部署
+    - 读写都走内存中的 BoundedMemorySaver，内存中没有的会话从 SQLite 加载
+    - 写入先进入待写队列，由后台线程每 flush_interval 秒(或攒够 flush_batch 条)批量提交
+    - 超出 keep_last 的旧 checkpoint 同步从 SQLite 中删除
+    进程重启后，尚未完成的摘要审核(interrupt)可以从 SQLite 恢复
+    """
+    def __init__(self, path: str = CHECKPOINT_DB_PATH, flush_interval: float = CHECKPOINT_FLUSH_INTERVAL,
+                 flush_batch: int = CHECKPOINT_FLUSH_BATCH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+        self._db_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = []        # [(sql, params)]
+        self._dirty = set()       # 有未落盘数据的会话
+        self._deleting = {}       # 会话 -> 尚未提交的 DELETE 批次数，提交前不从 SQLite 重新加载
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.stats.update({"flushes": 0, "rows_written": 0, "loaded": 0})
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="checkpoint-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    # ---------- 写入队列 ----------
+
+    def _enqueue(self, thread_id: str, statements: list):
+        with self._pending_lock:
+            self._pending.extend(statements)
+            self._dirty.add(thread_id)
+            pending = len(self._pending)
+        if pending >= self.flush_batch:
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Checkpoint 落盘失败: {e}")
+
+    def flush(self):
+        """将待写队列一次性提交到 SQLite"""
+        with self._pending_lock:
+            statements, self._pending = self._pending, []
+            dirty, self._dirty = self._dirty, set()
+            deleting = dict(self._deleting)
+        if not statements:
+            return
+        try:
+            with self._db_lock, self._conn:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+        except Exception:
+            with self._pending_lock:
+                self._pending = statements + self._pending
+                self._dirty |= dirty
+            raise
+        with self._pending_lock:
+            # 本次提交包含的 DELETE 已生效；提交期间再次删除的会话继续等待下一次提交
+            for thread_id, count in deleting.items():
+                remaining = self._deleting.get(thread_id, 0) - count
+                if remaining > 0:
+                    self._deleting[thread_id] = remaining
+                else:
+                    self._deleting.pop(thread_id, None)
+        self.stats["flushes"] += 1
+        self.stats["rows_written"] += len(statements)
+
+    def _can_evict(self, thread_id: str) -> bool:
+        # 还有未落盘数据的会话暂不从内存淘汰
+        with self._pending_lock:
+            return thread_id not in self._dirty
+
+    # ---------- 从 SQLite 加载 ----------
+
+    def _load_thread(self, thread_id: str):
+        """将 SQLite 中的会话加载到内存"""
+        with self._db_lock:
+            checkpoints = self._conn.execute(
+                "SELECT checkpoint_ns, checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata, "
+                "parent_checkpoint_id FROM checkpoints WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+            if not checkpoints:
+                return
+            writes = self._conn.execute(
+                "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path "
+                "FROM writes WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+            blobs = self._conn.execute(
+                "SELECT checkpoint_ns, channel, version, value_type, value FROM blobs WHERE thread_id = ?",
+                (thread_id,)
+            ).fetchall()
+
+        for ns, checkpoint_id, c_type, c_value, m_type, m_value, parent_id in checkpoints:
+            self.storage[thread_id][ns][checkpoint_id] = ((c_type, c_value), (m_type, m_value), parent_id)
+        for ns, checkpoint_id, task_id, idx, channel, v_type, v_value, task_path in writes:
+            self.writes.setdefault((thread_id, ns, checkpoint_id), {})[(task_id, idx)] = (
+                task_id, channel, (v_type, v_value), task_path
+            )
+        for ns, channel, version, v_type, v_value in blobs:
+            self.blobs[(thread_id, ns, channel, version)] = (v_type, v_value)
+        self.stats["loaded"] += 1
+
+    def _ensure_loaded(self, thread_id: str):
+        if thread_id not in self._last_access and not self.storage.get(thread_id):
+            with self._pending_lock:
+                # 已删除但 DELETE 尚未落盘的会话，SQLite 中的旧数据不再有效
+                if thread_id in self._deleting:
+                    return
+            self._load_thread(thread_id)
+
+    def get_tuple(self, config):
+        self._ensure_loaded(config["configurable"]["thread_id"])
+        return super().get_tuple(config)
+
+    def list(self, config, **kwargs):
+        if config:
+            self._ensure_loaded(config["configurable"]["thread_id"])
+        return super().list(config, **kwargs)
+
+    # ---------- 写入 ----------
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        stale_ids, stale_blobs = super()._prune(thread_id, checkpoint_ns)
+        statements = []
+        for checkpoint_id in stale_ids:
+            key = (thread_id, checkpoint_ns, checkpoint_id)
+            statements.append(("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", key))
+            statements.append(("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", key))
+        for key in stale_blobs:
+            statements.append((
+                "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (key[0], key[1], key[2], str(key[3]))
+            ))
+        if statements:
+            self._enqueue(thread_id, statements)
+        return stale_ids, stale_blobs
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        self._ensure_loaded(thread_id)
+
+        # 先入队本次写入，再由父类 put 触发剪枝(剪枝的删除语句排在后面)
+        saved_config = MemorySaver.put(self, config, checkpoint, metadata, new_versions)
+        checkpoint_id = checkpoint["id"]
+        (c_type, c_value), (m_type, m_value), parent_id = self.storage[thread_id][checkpoint_ns][checkpoint_id]
+        statements = [(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (thread_id, checkpoint_ns, checkpoint_id, c_type, c_value, m_type, m_value, parent_id)
+        )]
+        for channel, version in new_versions.items():
+            v_type, v_value = self.blobs[(thread_id, checkpoint_ns, channel, version)]
+            statements.append((
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, channel, str(version), v_type, v_value)
+            ))
+        self._enqueue(thread_id, statements)
+
+        self._prune(thread_id, checkpoint_ns)
+        self._touch(thread_id)
+        return saved_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        self._ensure_loaded(thread_id)
+        super().put_writes(config, writes, task_id, task_path)
+
+        stored = self.writes.get((thread_id, checkpoint_ns, checkpoint_id), {})
+        statements = [
+            (
+                "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint_id, w_task_id, idx, channel, v_type, v_value, w_task_path)
+            )
+            for (w_task_id, idx), (_, channel, (v_type, v_value), w_task_path) in stored.items()
+            if w_task_id == task_id
+        ]
+        if statements:
+            self._enqueue(thread_id, statements)
+
+    def delete_thread(self, thread_id: str):
+        with self._pending_lock:
+            self._deleting[thread_id] = self._deleting.get(thread_id, 0) + 1
+        super().delete_thread(thread_id)
+        self._enqueue(thread_id, [
+            (f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            for table in ("checkpoints", "writes", "blobs")
+        ])
+
+    def close(self):
+        """停止后台线程并提交剩余写入"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+# ==================== 工厂函数 ====================
+
+def create_checkpointer(backend: str = CHECKPOINTER_BACKEND):
+    """
+    根据配置创建 Checkpointer
+    - memory: 原始 MemorySaver(无上限，仅用于调试)
+    - lru: 有界内存 Checkpointer (LRU + TTL + 只保留最近 K 步)
+    - sqlite: SQLite(WAL) 持久化，批量落盘
+    """
+    backend = (backend or "lru").lower()
+    if backend == "memory":
+        return MemorySaver()
+    if backend == "lru":
+        return BoundedMemorySaver()
+    if backend == "sqlite":
+        return SqliteCheckpointSaver()
+    raise ValueError(f"未知的 CHECKPOINTER_BACKEND: {backend}，可选 memory / lru / sqlite")
@@ -0,0 +1,110 @@
+import re
+from collections import OrderedDict
+from langchain_core.messages import AIMessage, HumanMessage
+from medgemma.gradio_chatbot.config.settings import HISTORY_VIEW_CACHE_SIZE, HISTORY_TRIM_ALIGN
+
+# ==================== 对话视图 ====================
+
+def is_dialogue_message(msg) -> bool:
+    """只保留用户消息和有文本内容的 AI 回复，去掉工具调用和工具返回"""
+    if isinstance(msg, HumanMessage):
+        return True
+    if isinstance(msg, AIMessage):
+        return not msg.tool_calls and bool(msg.content)
+    return False
+
+class ConversationView:
+    """
+    增量维护的对话视图
+    记录已扫描的消息位置，新一轮只扫描新增的消息；消息列表被改写时才整体重建
+    """
+    def __init__(self):
+        self.scanned = 0
+        self.last_id = None
+        self.messages = []
+
+    def update(self, messages: list) -> list:
+        rewritten = self.scanned > len(messages) or (
+            self.scanned and messages[self.scanned - 1].id != self.last_id
+        )
+        if rewritten:
+            self.scanned, self.messages = 0, []
+        for msg in messages[self.scanned:]:
+            if is_dialogue_message(msg):
+                self.messages.append(msg)
+        self.scanned = len(messages)
+        self.last_id = messages[-1].id if messages else None
+        return self.messages
+
+# thread_id -> ConversationView (LRU)
+_views = OrderedDict()
+
+def get_dialogue(state, config) -> list:
+    """返回当前会话的对话视图(只读，不要修改返回的列表)"""
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    if thread_id is None:
+        return ConversationView().update(state["messages"])
+    view = _views.get(thread_id)
+    if view is None:
+        view = _views[thread_id] = ConversationView()
+    _views.move_to_end(thread_id)
+    while len(_views) > HISTORY_VIEW_CACHE_SIZE:
+        _views.popitem(last=False)
+    return view.update(state["messages"])
+
+def drop_dialogue_view(thread_id: str):
+    """会话结束后丢弃其对话视图"""
+    _views.pop(thread_id, None)
+
+# ==================== Token 预算 ====================
+
+_CJK_PATTERN = re.compile(r'[一-鿿　-〿＀-￯]')
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文字符按 1 个 token，其余按 4 个字符 1 个 token"""
+    text = str(text)
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+def trim_to_budget(messages: list, budget: int, align: int = HISTORY_TRIM_ALIGN) -> list:
+    """
+    从最早的消息开始按 align 条一块丢弃，直到总 token 数不超过预算
+    按块丢弃使保留部分的起点在多轮之间不变，请求前缀保持稳定
+    至少保留最后一条消息，并保证第一条是用户消息(部分聊天模板要求 user/assistant 交替)
+    """
+    sizes = [estimate_tokens(m.content) for m in messages]
+    total = sum(sizes)
+    start = 0
+    while start < len(messages) - 1 and total > budget:
+        end = min(start + max(align, 1), len(messages) - 1)
+        total -= sum(sizes[start:end])
+        start = end
+    while start < len(messages) - 1 and not isinstance(messages[start], HumanMessage):
+        start += 1
+    return messages[start:]
+
+def get_history(state, config, budget: int, skip_last_human: bool = False) -> tuple[str, list]:
+    """
+    返回 (滚动摘要, 最近的对话)
+    已折叠进摘要的对话不再重复发送，剩余对话裁剪到 token 预算以内
+    skip_last_human=True 时去掉末尾的用户消息(如"直接生成建议"附带的触发消息)
+    """
+    dialogue = get_dialogue(state, config)
+    summary = state.get("history_summary", "") or ""
+    recent = list(dialogue[state.get("summarized_count", 0):])
+    if skip_last_human and recent and isinstance(recent[-1], HumanMessage):
+        recent.pop()
+    return summary, trim_to_budget(recent, max(budget - estimate_tokens(summary), 0))
+
+def with_history_summary(prompt: str, summary: str) -> str:
+    """把滚动摘要拼接到系统提示词中"""
+    if not summary:
+        return prompt
+    return f"{prompt}\n\n【此前问诊要点】\n{summary}"
+
+def format_dialogue(messages: list) -> str:
+    lines = []
+    for msg in messages:
+        role = "患者" if isinstance(msg, HumanMessage) else "助手"
+        lines.append(f"{role}: {msg.content}")
+    return "\n".join(lines)
@@ -1,92 +1,362 @@
 import asyncio
+import contextvars
+import hashlib
+import uuid
+from collections import OrderedDict
 from langchain_core.messages import SystemMessage, AIMessage, HumanMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableConfig
 from langgraph.types import interrupt
-from medgemma.gradio_chatbot.config.settings import MEDGEMMA_MODEL_CONFIG, QUESTIONER_MODEL_CONFIG
-from medgemma.gradio_chatbot.config.prompts import DECISION_PROMPT, QUESTIONER_PROMPT, SUMMARY_PROMPT, ADVICE_SYSTEM_PROMPT
+from medgemma.gradio_chatbot.config.settings import (
+    MAX_QUESTIONS,
+    DECISION_MAX_TOKENS, DECISION_TEMPERATURE, DECISION_GUIDED_CHOICE, DECISION_CACHE_SIZE,
+    DECISION_MIN_QUESTIONS, DECISION_ADVICE_KEYWORDS,
+    HISTORY_KEEP_EXCHANGES, HISTORY_COMPACT_BATCH, MEDGEMMA_HISTORY_BUDGET, QUESTIONER_HISTORY_BUDGET,
+    SPECULATIVE_SUMMARY, SPECULATIVE_SUMMARY_MIN_QUESTIONS, CHECKPOINT_MAX_THREADS, QUESTION_CACHE_ENABLED
+)
+from medgemma.gradio_chatbot.config.prompts import (
+    MEDGEMMA_SYSTEM_PROMPT, DECISION_PROMPT, QUESTIONER_PROMPT, SUMMARY_PROMPT, ADVICE_PROMPT, HISTORY_SUMMARY_PROMPT,
+    SUMMARY_REVIEW_INSTRUCTION
+)
 from medgemma.gradio_chatbot.graph.state import CustomFlowState
+from medgemma.gradio_chatbot.graph.history import is_dialogue_message, get_dialogue, get_history, format_dialogue
+from medgemma.gradio_chatbot.graph.prompting import build_messages
 from medgemma.gradio_chatbot.utils.text_utils import clean_markdown
 from medgemma.gradio_chatbot.tools.agent import get_agent
+from medgemma.gradio_chatbot.tools.tool_executor import start_tool_budget
+from medgemma.gradio_chatbot.utils.model_router import questioner_router, medgemma_router
+from medgemma.gradio_chatbot.utils.response_cache import question_cache, normalize_text
 
-# Initialize models
-medgemma_model = ChatOpenAI(**MEDGEMMA_MODEL_CONFIG)
-questioner_model = ChatOpenAI(**QUESTIONER_MODEL_CONFIG)
+# Models: 通过 utils.model_router 调用(熔断、端点切换、对冲请求)，客户端首次使用时创建
+# Prompts: 通过 graph.prompting.build_messages 组装，系统提示词和对话历史在前、任务指令在后
 
 # Node Definitions
 
-async def medgemma_decision(state: CustomFlowState):
+# ==================== History Compaction ====================
+
+async def compact_history(state: CustomFlowState, config: RunnableConfig):
+    """
+    History Node: 把最近 K 轮之前的对话折叠进滚动摘要
+    待折叠的消息攒够 HISTORY_COMPACT_BATCH 条才调用一次模型，其余轮次直接跳过
+    """
+    updates = _sync_summary_draft(state, config)
+    if state.get("skip_to_advice", False):
+        # 直接生成建议时不折叠，保证摘要请求与后台草稿使用的历史一致
+        return updates
+
+    dialogue = get_dialogue(state, config)
+    summarized = state.get("summarized_count", 0)
+    end = len(dialogue) - HISTORY_KEEP_EXCHANGES * 2
+    # 保留部分从用户消息开始，保证一问一答不被拆开
+    while end > summarized and not isinstance(dialogue[end], HumanMessage):
+        end -= 1
+    if end - summarized < HISTORY_COMPACT_BATCH:
+        return updates
+
+    previous = state.get("history_summary", "") or "(暂无)"
+    request = f"""【已有要点】
+{previous}
+
+【新增对话】
+{format_dialogue(dialogue[summarized:end])}"""
+    try:
+        response = await questioner_router.ainvoke([
+            SystemMessage(content=HISTORY_SUMMARY_PROMPT),
+            HumanMessage(content=request)
+        ], kind="compact")
+    except Exception as e:
+        # 折叠失败不影响本轮问诊，下一轮再试
+        print(f"⚠️ 对话历史折叠失败: {e}")
+        return updates
+
+    print(f"🗜️ 对话历史已折叠: {summarized} -> {end} 条消息")
+    return {**updates, "history_summary": response.content, "summarized_count": end}
+
+# ==================== Speculative Summary ====================
+
+# thread_id -> (对话指纹, 生成摘要草稿的后台任务, 是否已开始调用模型)
+_summary_drafts = OrderedDict()
+
+SPECULATION_STATS = {
+    "started": 0,    # 启动的后台摘要任务
+    "hits": 0,       # summary_node 直接使用了草稿
+    "misses": 0,     # 没有可用草稿，同步生成
+    "discarded": 0,  # 因新的用户输入而作废的草稿
+}
+
+def _thread_id(config) -> str | None:
+    return (config or {}).get("configurable", {}).get("thread_id")
+
+def _summary_request(state, config) -> tuple[str, list]:
+    """构造摘要请求，返回 (对话指纹, 发给模型的消息)"""
+    # "直接生成建议"附带的触发消息不是新的病情信息，不参与摘要
+    history_summary, filtered_messages = get_history(
+        state, config, QUESTIONER_HISTORY_BUDGET, skip_last_human=state.get("skip_to_advice", False)
+    )
+    messages = build_messages(SUMMARY_PROMPT, history_summary, filtered_messages)
+    return _messages_digest(messages), messages
+
+async def _generate_summary(messages: list, kind: str = "summary", started: asyncio.Event | None = None) -> str:
+    def call(endpoint):
+        # 排到后端名额、真正开始调用模型时标记
+        if started is not None:
+            started.set()
+        return endpoint.model().ainvoke(messages)
+    response = await questioner_router.run(call, kind=kind)
+    return response.content
+
+def _start_summary_draft(thread_id: str, key: str, messages: list):
+    """在后台生成摘要草稿，不阻塞本轮回复"""
+    _discard_summary_draft(thread_id, count=False)
+    # 使用空的 context，避免后台调用挂到当前节点的回调上(否则其输出会被当作本轮回复流式推送)
+    # 后台草稿以最低优先级排队，不和用户正在等待的请求争抢后端
+    started = asyncio.Event()
+    task = asyncio.create_task(
+        _generate_summary(messages, kind="speculative", started=started), context=contextvars.Context()
+    )
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    _summary_drafts[thread_id] = (key, task, started)
+    SPECULATION_STATS["started"] += 1
+    while len(_summary_drafts) > CHECKPOINT_MAX_THREADS:
+        _, (_, stale, _) = _summary_drafts.popitem(last=False)
+        stale.cancel()
+
+def _discard_summary_draft(thread_id: str, count: bool = True):
+    entry = _summary_drafts.pop(thread_id, None)
+    if entry is not None:
+        entry[1].cancel()
+        if count:
+            SPECULATION_STATS["discarded"] += 1
+
+def discard_summary_draft(thread_id: str):
+    """会话结束(清空对话、关闭页面)时取消其后台摘要任务"""
+    _discard_summary_draft(thread_id, count=False)
+
+def cancel_summary_drafts():
+    """取消所有后台摘要任务(进程退出或压测结束时调用)"""
+    for _, task, _ in _summary_drafts.values():
+        task.cancel()
+    _summary_drafts.clear()
+
+def _sync_summary_draft(state, config) -> dict:
+    """
+    每轮开始时同步草稿到会话状态：
+    有新的用户输入则作废草稿；"直接生成建议"时把已完成的草稿写入状态
+    """
+    thread_id = _thread_id(config)
+    entry = _summary_drafts.get(thread_id)
+    if entry is None:
+        return {}
+    if not state.get("skip_to_advice", False):
+        _discard_summary_draft(thread_id)
+        return {"summary_draft": "", "summary_draft_key": ""}
+    key, task, _ = entry
+    if task.done() and not task.cancelled() and task.exception() is None:
+        return {"summary_draft": task.result(), "summary_draft_key": key}
+    return {}
+
+async def _take_summary_draft(state, config, key: str) -> str | None:
+    """
+    取出与当前对话一致的草稿；后台任务已在生成时等待其完成
+    草稿还在低优先级队列中排队时放弃它，由调用方按正常优先级重新生成
+    """
+    if state.get("summary_draft") and state.get("summary_draft_key") == key:
+        return state["summary_draft"]
+    entry = _summary_drafts.get(_thread_id(config))
+    if entry is None or entry[0] != key:
+        return None
+    if not entry[2].is_set():
+        _discard_summary_draft(_thread_id(config), count=False)
+        return None
+    try:
+        return await asyncio.shield(entry[1])
+    except Exception as e:
+        print(f"⚠️ 后台摘要草稿生成失败: {e}")
+        return None
+
+# ==================== Decision ====================
+
+DECISION_CHOICES = ["QUESTION", "ADVICE"]
+
+# 决策缓存: 对话前缀哈希 -> 决策结果 (LRU)
+_decision_cache = OrderedDict()
+_guided_choice_supported = DECISION_GUIDED_CHOICE
+
+DECISION_STATS = {
+    "short_circuit": 0,  # 由提问轮次或用户请求直接决定，未调用模型
+    "cache_hits": 0,     # 命中决策缓存
+    "model_calls": 0,    # 实际调用 MedGemma 的次数
+}
+
+def _decision_overrides(guided: bool) -> dict:
+    """
+    决策专用的 MedGemma 参数：低温度、只生成几个 token
+    guided=True 时通过 vLLM 的 guided_choice 把输出约束为 QUESTION / ADVICE
+    """
+    overrides = {"temperature": DECISION_TEMPERATURE, "max_tokens": DECISION_MAX_TOKENS}
+    if guided:
+        overrides["extra_body"] = {"guided_choice": DECISION_CHOICES}
+    return overrides
+
+def _short_circuit_decision(state: CustomFlowState, filtered_messages: list) -> str | None:
+    """不需要调用模型就能确定的路由"""
+    if state.get("skip_to_advice", False):
+        return "ADVICE"
+
+    question_count = state.get("question_count", 0)
+    if question_count >= MAX_QUESTIONS:
+        return "ADVICE"
+    if question_count < DECISION_MIN_QUESTIONS:
+        return "QUESTION"
+
+    last_human = next((m for m in reversed(filtered_messages) if isinstance(m, HumanMessage)), None)
+    if last_human is not None and isinstance(last_human.content, str):
+        if any(keyword in last_human.content for keyword in DECISION_ADVICE_KEYWORDS):
+            return "ADVICE"
+    return None
+
+def _messages_digest(filtered_messages: list, history_summary: str = "") -> str:
+    digest = hashlib.sha256()
+    digest.update(history_summary.encode())
+    digest.update(b"\x02")
+    for msg in filtered_messages:
+        digest.update(msg.type.encode())
+        digest.update(b"\x00")
+        digest.update(str(msg.content).encode())
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+def _remember_decision(key: str, decision: str):
+    _decision_cache[key] = decision
+    _decision_cache.move_to_end(key)
+    while len(_decision_cache) > DECISION_CACHE_SIZE:
+        _decision_cache.popitem(last=False)
+
+async def _classify(messages: list) -> str | None:
+    """调用 MedGemma 做一次 QUESTION / ADVICE 分类，无法解析时返回 None"""
+    global _guided_choice_supported
+    DECISION_STATS["model_calls"] += 1
+    try:
+        response = await medgemma_router.ainvoke(
+            messages, kind="decision", **_decision_overrides(_guided_choice_supported)
+        )
+    except Exception as e:
+        # 只有后端拒绝请求参数(4xx)才认为不支持 guided_choice，超时、连接错误、5xx 和熔断直接抛出
+        if not _guided_choice_supported or getattr(e, "status_code", None) not in (400, 422):
+            raise
+        # 后端不支持 guided_choice 时退回普通调用(只靠 max_tokens 和低温度)
+        print(f"⚠️ 后端不支持受约束解码，改用普通分类调用: {e}")
+        _guided_choice_supported = False
+        response = await medgemma_router.ainvoke(messages, kind="decision", **_decision_overrides(False))
+
+    content = response.content.strip().upper()
+    if "ADVICE" in content:
+        return "ADVICE"
+    if "QUESTION" in content:
+        return "QUESTION"
+    print(f"⚠️ 决策验证失败: {response.content}")
+    return None
+
+async def medgemma_decision(state: CustomFlowState, config: RunnableConfig):
     """
     Decision Node: 分析对话历史，决定是继续提问还是给出建议
+    依次尝试：确定性规则 -> 决策缓存 -> MedGemma 分类
     """
-    filtered_messages = []
-    for msg in state["messages"]:
-        if isinstance(msg, (HumanMessage, AIMessage)):
-            filtered_messages.append(msg)
-    
-    if filtered_messages and isinstance(filtered_messages[-1], AIMessage):
-        filtered_messages.append(HumanMessage(content="[继续分析]"))
+    history_summary, filtered_messages = get_history(state, config, MEDGEMMA_HISTORY_BUDGET)
+
+    decision = _short_circuit_decision(state, filtered_messages)
+    if decision is not None:
+        DECISION_STATS["short_circuit"] += 1
+        print(f"✅ 决策(规则): {decision}")
+        return {"decision_result": decision}
+
+    cache_key = _messages_digest(filtered_messages, history_summary)
+    decision = _decision_cache.get(cache_key)
+    if decision is not None:
+        _decision_cache.move_to_end(cache_key)
+        DECISION_STATS["cache_hits"] += 1
+        print(f"✅ 决策(缓存): {decision}")
+        return {"decision_result": decision}
     
-    messages = filtered_messages + [SystemMessage(content=DECISION_PROMPT)]
+    # 与 advice_node 共用系统提示词和对话前缀，决策指令放在最后
+    messages = build_messages(MEDGEMMA_SYSTEM_PROMPT, history_summary, filtered_messages, DECISION_PROMPT)
     
-    MAX_RETRIES = 3
+    MAX_RETRIES = 2
     for attempt in range(MAX_RETRIES):
         try:
-            response = await medgemma_model.ainvoke(messages)
-            content = response.content.strip().upper()
-            
-            if "ADVICE" in content:
-                print(f"✅ 决策验证通过 (尝试 {attempt + 1}): ADVICE")
-                return {"decision_result": "ADVICE"}
-            elif "QUESTION" in content:
-                print(f"✅ 决策验证通过 (尝试 {attempt + 1}): QUESTION")
-                return {"decision_result": "QUESTION"}
-            else:
-                print(f"⚠️ 决策验证失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {response.content}")
-                if attempt < MAX_RETRIES - 1:
-                    continue
-                    
+            decision = await _classify(messages)
+            if decision is not None:
+                print(f"✅ 决策验证通过 (尝试 {attempt + 1}): {decision}")
+                _remember_decision(cache_key, decision)
+                return {"decision_result": decision}
         except Exception as e:
             print(f"❌ 决策调用失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {e}")
-            if attempt < MAX_RETRIES - 1:
-                continue
     
     print("⚠️ 所有重试失败，使用默认决策: QUESTION")
     return {"decision_result": "QUESTION"}
 
-async def question_node(state: CustomFlowState):
+async def question_node(state: CustomFlowState, config: RunnableConfig):
     """
     Questioner Node: 提出一个关键问题或调用工具
+    只把滚动摘要和最近的对话交给 Agent，历史中的工具调用和工具返回不再重复发送
     """
-    ai_agent = await get_agent()
-    messages = [SystemMessage(content=QUESTIONER_PROMPT)] + state["messages"]
+    history_summary, recent = get_history(state, config, QUESTIONER_HISTORY_BUDGET)
+    messages = build_messages(QUESTIONER_PROMPT, history_summary, recent)
+
+    # 首轮问诊只取决于患者的第一句话，相同的开场白直接复用缓存的问题
+    cache_key = None
+    if QUESTION_CACHE_ENABLED and state.get("question_count", 0) == 0 and not history_summary \
+            and len(recent) == 1 and isinstance(recent[0].content, str):
+        cache_key = normalize_text(recent[0].content)
+    cached = question_cache.get(cache_key) if cache_key else None
     
-    agent_input = {"messages": messages}
-    agent_response = await ai_agent.ainvoke(agent_input)
+    if cached is not None:
+        print("⚡ 首轮问诊命中缓存")
+        # 与模型生成的消息一样带上 id，对话视图按 id 增量跟踪消息
+        new_messages = [AIMessage(content=cached, id=str(uuid.uuid4()))]
+    else:
+        ai_agent = await get_agent()
+        agent_input = {"messages": messages}
+        start_tool_budget()
+        agent_response = await ai_agent.ainvoke(agent_input)
+        new_messages = agent_response.get("messages", [])[len(messages):]
+        if cache_key and new_messages and is_dialogue_message(new_messages[-1]) \
+                and isinstance(new_messages[-1], AIMessage) and isinstance(new_messages[-1].content, str):
+            question_cache.put(cache_key, new_messages[-1].content)
     
     new_count = state.get("question_count", 0) + 1
+
+    thread_id = _thread_id(config)
+    if SPECULATIVE_SUMMARY and thread_id and new_count >= SPECULATIVE_SUMMARY_MIN_QUESTIONS:
+        # 用户回答问题期间，后台按本轮结束时的对话预先生成摘要
+        next_state = {**state, "messages": state["messages"] + new_messages, "skip_to_advice": False}
+        _start_summary_draft(thread_id, *_summary_request(next_state, config))
     
     return {
-        "messages": agent_response.get("messages", []),
+        # 只写回本轮新产生的消息(输入的系统提示词和历史不重复写入状态)
+        "messages": new_messages,
         "question_count": new_count
     }
 
-async def summary_node(state: CustomFlowState):
+async def summary_node(state: CustomFlowState, config: RunnableConfig):
     """
     Summary Node: 生成患者病情信息摘要
+    优先使用后台预生成、且与当前对话一致的摘要草稿
     """
-    filtered_messages = []
-    for msg in state["messages"]:
-        if isinstance(msg, (HumanMessage, AIMessage)):
-            filtered_messages.append(msg)
+    key, messages = _summary_request(state, config)
     
-    if filtered_messages and isinstance(filtered_messages[-1], AIMessage):
-        filtered_messages.append(HumanMessage(content="[继续分析]"))
-        
-    messages = [SystemMessage(content=SUMMARY_PROMPT)] + filtered_messages
+    summary = await _take_summary_draft(state, config, key)
+    if summary is not None:
+        SPECULATION_STATS["hits"] += 1
+        print("⚡ 使用后台预生成的摘要草稿")
+    else:
+        SPECULATION_STATS["misses"] += 1
+        summary = await _generate_summary(messages)
+    _summary_drafts.pop(_thread_id(config), None)
     
-    response = await questioner_model.ainvoke(messages)
     return {
-        "patient_summary": response.content
+        "patient_summary": summary,
+        "summary_draft": "",
+        "summary_draft_key": ""
     }
 
 async def edit_summary_node(state: CustomFlowState):
@@ -94,7 +364,7 @@ async def edit_summary_node(state: CustomFlowState):
     Edit Summary Node: 人工审核和编辑摘要
     """
     edited_summary = interrupt({
-        "instruction": "请审核并编辑患者病情信息摘要。如果信息准确完整，可以直接继续；如果需要修改，请编辑后提交。",
+        "instruction": SUMMARY_REVIEW_INSTRUCTION,
         "summary": state["patient_summary"]
     })
     
@@ -105,7 +375,7 @@ async def edit_summary_node(state: CustomFlowState):
         "patient_summary": edited_summary
     }
 
-async def advice_node(state: CustomFlowState):
+async def advice_node(state: CustomFlowState, config: RunnableConfig):
     """
     Advice Node: 基于患者病情摘要生成最终医疗建议
     """
@@ -113,24 +383,13 @@ async def advice_node(state: CustomFlowState):
     
     if patient_summary:
         clean_summary = clean_markdown(patient_summary)
-        user_request = f"""【患者病情摘要】
-{clean_summary}
-
-请基于以上信息给出诊疗建议。"""
-        
-        messages = [
-            SystemMessage(content=ADVICE_SYSTEM_PROMPT),
-            HumanMessage(content=user_request)
-        ]
+        user_request = HumanMessage(content=f"""【患者病情摘要】
+{clean_summary}""")
+        messages = build_messages(MEDGEMMA_SYSTEM_PROMPT, "", [user_request], ADVICE_PROMPT)
     else:
-        messages = [SystemMessage(content=ADVICE_SYSTEM_PROMPT)]
-        filtered_messages = []
-        for msg in state["messages"]:
-            if isinstance(msg, (HumanMessage, AIMessage)):
-                filtered_messages.append(msg)
-        if filtered_messages and isinstance(filtered_messages[-1], AIMessage):
-            filtered_messages.append(HumanMessage(content="[继续分析]"))
-        messages = messages + filtered_messages
-
-    response = await medgemma_model.ainvoke(messages)
+        history_summary, filtered_messages = get_history(state, config, MEDGEMMA_HISTORY_BUDGET)
+        messages = build_messages(MEDGEMMA_SYSTEM_PROMPT, history_summary, filtered_messages, ADVICE_PROMPT)
+
+    # 建议会流式推送给用户，不做对冲请求
+    response = await medgemma_router.ainvoke(messages, kind="advice", hedge=False)
     return {"messages": [response], "advice": response.content}
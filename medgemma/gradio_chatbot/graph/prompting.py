@@ -0,0 +1,25 @@
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from medgemma.gradio_chatbot.graph.history import with_history_summary
+
+# 对话以 AI 回复结尾且没有任务指令时补一条用户消息，避免模型续写上一条回复
+CONTINUE_MARKER = "[继续分析]"
+
+def build_messages(system_prompt: str, history_summary: str, dialogue: list, instruction: str = "") -> list:
+    """
+    按"稳定在前、易变在后"的顺序组装请求，使同一会话的相邻轮次、同一后端的不同节点共享尽可能长的前缀
+    (vLLM 的自动前缀缓存和服务商的 prompt caching 都按前缀命中)：
+    1. 系统提示词: 每个后端固定，后面接滚动摘要(只在折叠历史时变化)
+    2. 对话历史: 只追加，已发送过的消息原样保留
+    3. 本次任务指令: 并入最后一条用户消息的末尾(部分聊天模板要求 user/assistant 严格交替)
+    """
+    messages = [SystemMessage(content=with_history_summary(system_prompt, history_summary))] + list(dialogue)
+    last = messages[-1]
+    if not instruction:
+        if isinstance(last, AIMessage):
+            messages.append(HumanMessage(content=CONTINUE_MARKER))
+        return messages
+    if isinstance(last, HumanMessage) and isinstance(last.content, str):
+        messages[-1] = HumanMessage(content=f"{last.content}\n\n{instruction}")
+    else:
+        messages.append(HumanMessage(content=instruction))
+    return messages
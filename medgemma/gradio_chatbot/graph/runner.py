@@ -0,0 +1,243 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Optional, Union
+from langchain_core.messages import AIMessageChunk, AIMessage
+from medgemma.gradio_chatbot.config.settings import GRAPH_STREAM_MODE, QUEUE_STATUS_INTERVAL
+from medgemma.gradio_chatbot.graph.builder import graph
+from medgemma.gradio_chatbot.graph.sessions import get_config, rollback_turn
+from medgemma.gradio_chatbot.utils.scheduler import current_session, queue_position
+from medgemma.gradio_chatbot.utils.metrics import record_turn, log_event
+from medgemma.gradio_chatbot.utils.cancellation import TurnCancelled, current_turn, get_turn
+
+# ==================== Graph 事件 ====================
+# graph 运行过程以类型化事件的形式交给界面(Gradio 处理函数、HTTP 接口)，调用方按类型分派，无需解析文本
+
+@dataclass(slots=True)
+class TokenDelta:
+    """回复文本增量；node 为产生回复的节点，为空表示繁忙提示、错误信息等非模型输出"""
+    text: str
+    node: str = ""
+
+@dataclass(slots=True)
+class TokenReset:
+    """
+    撤回 node 最近推送的 length 个字符，之后的 TokenDelta 接着撤回后的文本继续
+    模型调用中途失败、切换到备用端点重新生成，或 Agent 调用工具前输出了铺垫文本时产生
+    """
+    node: str
+    length: int
+
+@dataclass(slots=True)
+class NodeStart:
+    node: str
+
+@dataclass(slots=True)
+class NodeEnd:
+    """节点完成；output 为节点写入状态的内容"""
+    node: str
+    output: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+@dataclass(slots=True)
+class QueueStatus:
+    """在模型后端的排队位置，0 表示已开始处理"""
+    position: int
+
+@dataclass(slots=True)
+class InterruptPayload:
+    """graph 暂停等待用户审核摘要"""
+    summary: str
+    instruction: str
+
+@dataclass(slots=True)
+class StateSnapshot:
+    """一轮结束时的会话状态，总是最后一个事件"""
+    question_count: int
+    awaiting_review: bool = False
+    ttft: Optional[float] = None
+    elapsed: float = 0.0
+
+GraphEvent = Union[TokenDelta, TokenReset, NodeStart, NodeEnd, QueueStatus, InterruptPayload, StateSnapshot]
+
+# 需要把 token 实时推送给用户的节点 (决策和摘要节点的输出不直接展示)
+STREAMING_NODES = {"question_node", "advice_node"}
+
+# ==================== Graph 运行 ====================
+
+def _reply_text(node: str, output: dict) -> str:
+    """节点输出中的最后一条 AI 回复(未逐 token 推送时一次性返回)"""
+    if node == "medgemma_decision" or not output or "messages" not in output:
+        return ""
+    messages = output["messages"]
+    if not isinstance(messages, list):
+        messages = [messages]
+    if messages and isinstance(messages[-1], (AIMessage, AIMessageChunk)):
+        return messages[-1].content.strip() if messages[-1].content else ""
+    return ""
+
+async def run_graph(graph_input, config: dict, before) -> AsyncGenerator[GraphEvent, None]:
+    """
+    运行 graph 并把输出转换为事件
+    - messages 模式: 逐 token 推送 question_node / advice_node 的模型输出，只保留最终回复的文本:
+      新的一次模型调用(切换端点重试、工具调用后的下一步)或调用工具的消息会撤回已推送的文本
+    - tasks 模式: 顶层节点的开始/结束，结束事件带有节点输出和中断内容
+    被取消时回滚到运行前的 checkpoint (before)，不留下写了一半的一轮
+    (取消会沿 graph 任务传到节点中的模型 HTTP 请求和 MCP 工具调用)
+    """
+    stream_mode = ["messages", "tasks"] if GRAPH_STREAM_MODE == "messages" else ["tasks"]
+    # 节点 -> 正在推送的消息: id、已推送的文本、是否为工具调用消息(不推送)
+    streamed = {}
+    try:
+        async for namespace, mode, payload in graph.astream(graph_input, config=config, stream_mode=stream_mode, subgraphs=True):
+            if mode == "messages":
+                chunk, metadata = payload
+                # 子图(问诊 Agent)的命名空间形如 "question_node:<task_id>"
+                node_name = namespace[0].split(":")[0] if namespace else metadata.get("langgraph_node")
+                if node_name not in STREAMING_NODES or not isinstance(chunk, AIMessageChunk):
+                    continue
+                current = streamed.setdefault(node_name, {"id": None, "text": "", "tools": False})
+                if chunk.id != current["id"]:
+                    # 新的一次模型调用(切换端点重试，或工具调用后的下一步): 上一条消息推送的文本不是最终回复
+                    if current["text"]:
+                        yield TokenReset(node_name, len(current["text"]))
+                    current.update(id=chunk.id, text="", tools=False)
+                if chunk.tool_call_chunks and not current["tools"]:
+                    # 当前消息是工具调用，撤回其中的铺垫文本，之后的文本也不再推送
+                    if current["text"]:
+                        yield TokenReset(node_name, len(current["text"]))
+                    current.update(text="", tools=True)
+                if current["tools"] or not isinstance(chunk.content, str) or not chunk.content:
+                    continue
+                current["text"] += chunk.content
+                yield TokenDelta(chunk.content, node_name)
+                continue
+
+            # 子图内部的节点不单独产出事件
+            if namespace:
+                continue
+            node_name = payload["name"]
+            if "input" in payload:
+                yield NodeStart(node_name)
+                continue
+
+            log_event("node_end", session=current_session.get(), node=node_name)
+            output = payload.get("result") or {}
+            # 未逐 token 推送(或推送的文本与最终回复不一致)时，以节点输出中的回复为准
+            streamed_text = streamed.pop(node_name, {}).get("text", "")
+            text = _reply_text(node_name, output)
+            if text and text != streamed_text.strip():
+                if streamed_text:
+                    yield TokenReset(node_name, len(streamed_text))
+                yield TokenDelta(text, node_name)
+            for item in payload.get("interrupts") or ():
+                value = item.get("value") if isinstance(item, dict) else item.value
+                log_event("interrupt", session=current_session.get(), node=node_name)
+                yield InterruptPayload(value.get("summary", ""), value.get("instruction", "请审核病情摘要"))
+            error = payload.get("error")
+            yield NodeEnd(node_name, output, str(error) if error else None)
+        turn = current_turn.get()
+        if turn is not None:
+            turn.committed = True
+    except asyncio.CancelledError:
+        await rollback_turn(config["configurable"]["thread_id"], before)
+        raise
+
+def _coalesce(events: list) -> list:
+    """合并同一节点相邻的文本增量，消费较慢时减少界面刷新次数"""
+    merged = []
+    for event in events:
+        if merged and isinstance(event, TokenDelta) and isinstance(merged[-1], TokenDelta) \
+                and merged[-1].node == event.node:
+            merged[-1] = TokenDelta(merged[-1].text + event.text, event.node)
+        else:
+            merged.append(event)
+    return merged
+
+async def with_queue_status(events, session_id: str) -> AsyncGenerator[GraphEvent, None]:
+    """
+    等待 graph 输出期间定期检查该会话在模型后端的排队位置，位置变化时产出 QueueStatus
+    graph 在单独的任务中完整运行，保证其内部的上下文变量前后一致
+    """
+    items = asyncio.Queue()
+    finished = object()
+    cancelled = object()
+
+    async def pump():
+        try:
+            async for event in events:
+                items.put_nowait(event)
+            items.put_nowait(finished)
+        except asyncio.CancelledError:
+            items.put_nowait(cancelled)
+            raise
+        except Exception as e:
+            items.put_nowait(e)
+
+    task = asyncio.create_task(pump())
+    # 登记到本轮，清空对话、发送新消息或关闭页面时取消 graph 的运行
+    turn = current_turn.get()
+    if turn is not None:
+        turn.add_task(task)
+    last_position = 0
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(items.get(), timeout=QUEUE_STATUS_INTERVAL)
+            except asyncio.TimeoutError:
+                position = queue_position(session_id)
+                if position != last_position:
+                    last_position = position
+                    yield QueueStatus(position)
+                continue
+            # 取出已到达的全部事件，一起处理
+            batch = [item]
+            while not items.empty() and isinstance(batch[-1], (TokenDelta, TokenReset, NodeStart, NodeEnd, InterruptPayload)):
+                batch.append(items.get_nowait())
+            if last_position:
+                last_position = 0
+                yield QueueStatus(0)
+            for item in _coalesce(batch):
+                if item is cancelled or (turn is not None and turn.cancelled):
+                    # graph 已完成但本轮随后被取消时，剩余事件也不再交给界面(新的一轮已接管界面)
+                    raise TurnCancelled(turn.reason if turn is not None else "cancelled")
+                if item is finished:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        task.cancel()
+
+async def stream_events(graph_input, session_id: str) -> AsyncGenerator[GraphEvent, None]:
+    """
+    运行一轮 graph，依次产出 TokenDelta / TokenReset / NodeStart / NodeEnd / QueueStatus / InterruptPayload 事件，
+    最后产出 StateSnapshot；提问轮次由运行前的状态和节点输出推算，不再额外读取 checkpoint
+    """
+    config = get_config(session_id)
+    start_time = time.perf_counter()
+    first_token_time = None
+    # 模型调用按会话排队，调度器通过该变量识别请求所属的会话
+    current_session.set(session_id)
+    # 模型和工具调用通过该变量区分用户取消和对冲等内部取消
+    current_turn.set(get_turn(session_id))
+
+    # 运行前的状态：被取消时据此回滚，同时作为提问轮次的起点
+    before = await graph.aget_state(config)
+    question_count = before.values.get("question_count", 0)
+    awaiting_review = False
+
+    async for event in with_queue_status(run_graph(graph_input, config, before), session_id):
+        if isinstance(event, TokenDelta):
+            if first_token_time is None:
+                first_token_time = time.perf_counter() - start_time
+                log_event("first_token", session=session_id, node=event.node, ttft=round(first_token_time, 4))
+        elif isinstance(event, NodeEnd):
+            question_count = event.output.get("question_count", question_count)
+        elif isinstance(event, InterruptPayload):
+            awaiting_review = True
+        yield event
+
+    elapsed = time.perf_counter() - start_time
+    record_turn(session_id, elapsed, first_token_time)
+    yield StateSnapshot(question_count, awaiting_review, first_token_time, elapsed)
@@ -0,0 +1,42 @@
+from medgemma.gradio_chatbot.graph.builder import graph
+from medgemma.gradio_chatbot.graph.history import drop_dialogue_view
+from medgemma.gradio_chatbot.graph.nodes import discard_summary_draft
+
+# ==================== 会话生命周期 ====================
+
+def get_config(session_id: str) -> dict:
+    return {"configurable": {"thread_id": session_id}}
+
+async def rollback_turn(session_id: str, before) -> bool:
+    """
+    被取消的一轮可能已写入部分节点的 checkpoint(如用户消息已写入但没有回复)
+    基于运行前的状态快照 before 新建一个 checkpoint，会话回到本轮开始前的状态(包括等待审核的中断)
+    返回是否发生了回滚
+    """
+    config = get_config(session_id)
+    latest = await graph.aget_state(config)
+    before_id = before.config.get("configurable", {}).get("checkpoint_id")
+    if latest.config.get("configurable", {}).get("checkpoint_id") == before_id:
+        return False
+    if before_id is None:
+        # 会话的第一轮被取消，直接删除整个会话
+        await graph.checkpointer.adelete_thread(session_id)
+    elif await graph.checkpointer.aget_tuple(before.config) is None:
+        # 运行前的 checkpoint 已被清理(超过 CHECKPOINT_KEEP_LAST)，保留当前状态
+        print(f"⚠️ 会话 {session_id[:8]} 运行前的 checkpoint 已不存在，无法回滚")
+        return False
+    else:
+        await graph.aupdate_state(before.config, None)
+        if any(task.interrupts for task in before.tasks):
+            # 中断保存在原 checkpoint 的 pending writes 中，分叉出的 checkpoint 不带中断
+            # (如提交审核后生成建议时被取消)，重新执行等待审核的节点，恢复待审核的摘要
+            # edit_summary_node 在 interrupt 之前没有其他操作，重新执行不会调用模型
+            await graph.ainvoke(None, config)
+    print(f"↩️ 会话 {session_id[:8]} 已回滚到本轮开始前的状态")
+    return True
+
+async def release_session(session_id: str):
+    """会话结束(清空对话、关闭页面)：删除 checkpoint，丢弃对话视图和后台摘要草稿"""
+    discard_summary_draft(session_id)
+    drop_dialogue_view(session_id)
+    await graph.checkpointer.adelete_thread(session_id)
@@ -7,3 +7,7 @@ class CustomFlowState(TypedDict):
     skip_to_advice: bool  # 用户请求直接生成建议
     patient_summary: str  # 患者病情信息摘要
     decision_result: str  # 决策结果: "QUESTION" 或 "ADVICE",不放入messages
+    history_summary: str  # 较早对话的滚动摘要
+    summarized_count: int  # 已折叠进滚动摘要的对话消息数
+    summary_draft: str  # 后台预先生成的病情摘要草稿
+    summary_draft_key: str  # 草稿对应的对话指纹，对话变化后草稿失效
@@ -0,0 +1,45 @@
+"""
+测试公共配置：模型和 MCP 指向 benchmarks/ 中的假服务 (fake_openai_server / stub_mcp_server)
+
+用法 (在仓库根目录下):
+    python -m pytest -q medgemma/gradio_chatbot/tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from load_test_sessions import configure_env
+
+MODEL_PORT = int(os.getenv("TEST_MODEL_PORT", "9310"))
+
+# 必须在导入 medgemma.gradio_chatbot 的任何模块之前完成
+configure_env(MODEL_PORT)
+os.environ["CHECKPOINTER_BACKEND"] = "lru"
+
+@pytest.fixture
+def backend():
+    """
+    在新的事件循环中启动假模型服务并运行测试协程，结束后关闭 MCP 会话和模型连接
+    用法: backend(coro_fn, ttft=0.05, ...)，coro_fn 接收 fake server 的 runner
+    """
+    from fake_openai_server import start_fake_server
+
+    def run(coro_fn, ttft: float = 0.05, token_delay: float = 0.001, **server_options):
+        async def main():
+            runner = await start_fake_server(MODEL_PORT, ttft=ttft, token_delay=token_delay, **server_options)
+            try:
+                return await coro_fn(runner)
+            finally:
+                from medgemma.gradio_chatbot.graph.nodes import cancel_summary_drafts
+                from medgemma.gradio_chatbot.tools.mcp_client import close_sessions
+                from medgemma.gradio_chatbot.utils.llm_clients import close_clients
+                cancel_summary_drafts()
+                await close_sessions()
+                await close_clients()
+                await runner.cleanup()
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,57 @@
+"""HTTP 接口：SSE 事件流和摘要审核流程"""
+import json
+
+import httpx
+from fastapi import FastAPI
+
+def parse_sse(text: str) -> list:
+    """返回 [(事件名, 数据)]"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_message_and_review_flow(backend):
+    from api import router
+
+    server = FastAPI()
+    server.include_router(router)
+
+    async def scenario(runner):
+        transport = httpx.ASGITransport(app=server)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            assert (await client.get("/healthz")).json() == {"status": "ok"}
+            session_id = (await client.post("/v1/sessions")).json()["session_id"]
+            results = {"no_review": await client.get(f"/v1/sessions/{session_id}/review")}
+
+            response = await client.post(f"/v1/sessions/{session_id}/messages", json={"text": "头痛两天"})
+            results["question"] = parse_sse(response.text)
+            response = await client.post(f"/v1/sessions/{session_id}/messages",
+                                         json={"text": "请直接给建议", "skip_to_advice": True})
+            results["summary"] = parse_sse(response.text)
+            results["review"] = await client.get(f"/v1/sessions/{session_id}/review")
+            response = await client.post(f"/v1/sessions/{session_id}/review", json={"summary": "头痛两天，无发热"})
+            results["advice"] = parse_sse(response.text)
+            results["resubmit"] = await client.post(f"/v1/sessions/{session_id}/review", json={"summary": "再次提交"})
+            results["bad_body"] = await client.post(f"/v1/sessions/{session_id}/messages", content=b"[]")
+            results["delete"] = await client.delete(f"/v1/sessions/{session_id}")
+        return results
+
+    results = backend(scenario)
+    assert results["no_review"].status_code == 404
+
+    names = [name for name, _ in results["question"]]
+    assert "token" in names and names[-1] == "state"
+    assert results["question"][-1][1]["question_count"] == 1
+
+    assert results["summary"][-1] == ("state", results["summary"][-1][1])
+    assert results["summary"][-1][1]["awaiting_review"] is True
+    assert any(name == "interrupt" for name, _ in results["summary"])
+    assert results["review"].status_code == 200 and results["review"].json()["summary"]
+
+    assert results["advice"][-1][0] == "state" and results["advice"][-1][1]["awaiting_review"] is False
+    assert any(name == "token" and data["node"] == "advice_node" for name, data in results["advice"])
+    assert results["resubmit"].status_code == 409
+    assert results["bad_body"].status_code == 400
+    assert results["delete"].status_code == 204
@@ -0,0 +1,84 @@
+"""Gradio 处理函数：新消息取消上一轮后，对话记录与会话状态保持一致"""
+import asyncio
+import copy
+
+from langchain_core.messages import HumanMessage
+
+from medgemma.gradio_chatbot.graph.builder import graph
+from medgemma.gradio_chatbot.graph.sessions import get_config, release_session
+
+def contents(history: list) -> list:
+    return [(message["role"], message["content"]) for message in history]
+
+def test_superseded_turn_entries_are_removed(backend):
+    import app
+
+    async def scenario(runner):
+        session_id = app.new_session_id()
+        frontend = copy.deepcopy(app.WELCOME_MESSAGE) + [{"role": "user", "content": "第一条"}]
+        streaming = asyncio.Event()
+
+        async def first_turn():
+            nonlocal frontend
+            async for history, *_ in app.process_text_input_stream("第一条", copy.deepcopy(frontend), False, session_id):
+                frontend = copy.deepcopy(history)
+                if history[-1]["content"]:
+                    streaming.set()
+
+        first = asyncio.create_task(first_turn())
+        await streaming.wait()
+        # 回复输出到一半时发送第二条消息 (界面上已有第一条消息和写了一半的回复)
+        second_input, _ = app.add_user_message(copy.deepcopy(frontend), "第二条")
+        async for history, *_ in app.process_text_input_stream("第二条", second_input, False, session_id):
+            final = copy.deepcopy(history)
+        await first
+        state = await graph.aget_state(get_config(session_id))
+        await release_session(session_id)
+        return final, state
+
+    final, state = backend(scenario, ttft=0.05, token_delay=0.05)
+    welcome = contents(app.WELCOME_MESSAGE)
+    assert contents(final)[:len(welcome)] == welcome
+    turn_entries = contents(final)[len(welcome):]
+    assert [role for role, _ in turn_entries] == ["user", "assistant"]
+    assert turn_entries[0][1] == "第二条" and "第二条" in turn_entries[1][1]
+    assert [m.content for m in state.values["messages"] if isinstance(m, HumanMessage)] == ["第二条"]
+
+def test_completed_turn_entries_are_kept(backend):
+    import app
+
+    async def scenario(runner):
+        session_id = app.new_session_id()
+        history = copy.deepcopy(app.WELCOME_MESSAGE)
+        for text in ("第一条", "第二条"):
+            history, _ = app.add_user_message(history, text)
+            async for history, *_ in app.process_text_input_stream(text, history, False, session_id):
+                pass
+        await release_session(session_id)
+        return history
+
+    history = backend(scenario, ttft=0.02, token_delay=0.001)
+    roles = [role for role, _ in contents(history)[len(app.WELCOME_MESSAGE):]]
+    assert roles == ["user", "assistant", "user", "assistant"]
+
+def test_events_before_page_load_share_a_session(backend):
+    import app
+    from types import SimpleNamespace
+
+    async def scenario(runner):
+        # demo.load 尚未完成，session_state 仍为 None
+        request = SimpleNamespace(session_hash="before-load")
+        history = copy.deepcopy(app.WELCOME_MESSAGE)
+        for text in ("第一条", "第二条"):
+            history, _ = app.add_user_message(history, text)
+            async for history, *_ in app.process_text_input_stream(text, history, False, None, request):
+                pass
+        session_id = app.start_session(request)
+        state = await graph.aget_state(get_config(session_id))
+        await app.close_session(request)
+        await release_session(session_id)
+        return session_id, state
+
+    session_id, state = backend(scenario, ttft=0.02, token_delay=0.001)
+    assert session_id
+    assert [m.content for m in state.values["messages"] if isinstance(m, HumanMessage)] == ["第一条", "第二条"]
@@ -0,0 +1,114 @@
+"""轮次取消：取消后回滚到本轮开始前的 checkpoint，等待审核的摘要在回滚后仍可恢复"""
+import asyncio
+
+from langchain_core.messages import HumanMessage
+from langgraph.types import Command
+
+from medgemma.gradio_chatbot.graph.builder import graph
+from medgemma.gradio_chatbot.graph.runner import stream_events, TokenDelta, NodeStart, InterruptPayload, StateSnapshot
+from medgemma.gradio_chatbot.graph.sessions import get_config, release_session
+from medgemma.gradio_chatbot.utils.cancellation import (
+    TurnCancelled, start_turn, finish_turn, cancel_turn, get_turn
+)
+
+async def run_turn(session_id: str, graph_input) -> list:
+    """完整运行一轮，返回全部事件"""
+    turn = await start_turn(session_id)
+    try:
+        return [event async for event in stream_events(graph_input, session_id)]
+    finally:
+        finish_turn(turn)
+
+async def cancel_at(session_id: str, graph_input, node: str, reason: str = "clear") -> str:
+    """运行一轮，node 开始后取消，返回消费方收到的取消原因"""
+    turn = await start_turn(session_id)
+    try:
+        async for event in stream_events(graph_input, session_id):
+            if isinstance(event, NodeStart) and event.node == node:
+                # 等模型请求发出后再取消
+                await asyncio.sleep(0.1)
+                asyncio.create_task(cancel_turn(turn, reason))
+    except TurnCancelled as e:
+        return e.reason
+    finally:
+        finish_turn(turn)
+    return ""
+
+def message(text: str, skip_to_advice: bool = False) -> dict:
+    return {"messages": [HumanMessage(content=text)], "skip_to_advice": skip_to_advice}
+
+async def review_of(session_id: str):
+    state = await graph.aget_state(get_config(session_id))
+    for task in state.tasks:
+        if task.interrupts:
+            return task.interrupts[0].value
+    return None
+
+def test_cancel_first_turn_deletes_session(backend):
+    async def scenario(runner):
+        reason = await cancel_at("cancel-first", message("头痛"), "question_node")
+        state = await graph.aget_state(get_config("cancel-first"))
+        return reason, state
+
+    reason, state = backend(scenario, ttft=0.5)
+    assert reason == "clear"
+    assert state.values == {}
+
+def test_cancel_rolls_back_to_previous_turn(backend):
+    async def scenario(runner):
+        session_id = "cancel-rollback"
+        await run_turn(session_id, message("第一轮：头痛"))
+        before = await graph.aget_state(get_config(session_id))
+        reason = await cancel_at(session_id, message("第二轮：发烧"), "question_node")
+        after = await graph.aget_state(get_config(session_id))
+        await release_session(session_id)
+        return reason, before, after
+
+    reason, before, after = backend(scenario, ttft=0.5)
+    assert reason == "clear"
+    assert after.values["question_count"] == before.values["question_count"] == 1
+    assert [m.content for m in after.values["messages"]] == [m.content for m in before.values["messages"]]
+
+def test_new_message_supersedes_running_turn(backend):
+    async def scenario(runner):
+        session_id = "cancel-supersede"
+        first = asyncio.create_task(run_turn(session_id, message("第一条")))
+        await asyncio.sleep(0.2)
+        events = await run_turn(session_id, message("第二条"))
+        first_error = await asyncio.gather(first, return_exceptions=True)
+        state = await graph.aget_state(get_config(session_id))
+        await release_session(session_id)
+        return first_error[0], events, state
+
+    first_error, events, state = backend(scenario, ttft=0.5)
+    assert isinstance(first_error, TurnCancelled) and first_error.reason == "superseded"
+    assert isinstance(events[-1], StateSnapshot) and events[-1].question_count == 1
+    assert [m.content for m in state.values["messages"] if isinstance(m, HumanMessage)] == ["第二条"]
+    assert get_turn("cancel-supersede") is None
+
+def test_cancel_during_advice_keeps_review_and_resumes(backend):
+    async def scenario(runner):
+        session_id = "cancel-advice"
+        events = await run_turn(session_id, message("头痛三天，请给建议", skip_to_advice=True))
+        review = await review_of(session_id)
+
+        # 提交审核后生成建议时取消，会话回到等待审核的状态
+        reason = await cancel_at(session_id, Command(resume="审核后的摘要"), "advice_node")
+        review_after_cancel = await review_of(session_id)
+
+        # 再次提交审核，正常生成建议
+        resumed = await run_turn(session_id, Command(resume="再次审核的摘要"))
+        state = await graph.aget_state(get_config(session_id))
+        await release_session(session_id)
+        return events, review, reason, review_after_cancel, resumed, state
+
+    events, review, reason, review_after_cancel, resumed, state = backend(scenario, ttft=0.5)
+    assert any(isinstance(event, InterruptPayload) for event in events)
+    assert events[-1].awaiting_review
+    assert reason == "clear"
+    assert review_after_cancel == review
+    assert not resumed[-1].awaiting_review
+    assert any(isinstance(event, NodeStart) and event.node == "advice_node" for event in resumed)
+    assert state.values["patient_summary"] == "再次审核的摘要"
+    assert any(isinstance(event, TokenDelta) and event.node == "advice_node" for event in resumed)
+    assert not state.next
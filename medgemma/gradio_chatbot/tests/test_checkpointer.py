@@ -0,0 +1,150 @@
+"""Checkpointer 的剪枝、淘汰和 SQLite 重新加载"""
+import operator
+from collections import Counter
+from typing import Annotated, TypedDict
+
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import Command, interrupt
+
+from medgemma.gradio_chatbot.graph.builder import graph
+from medgemma.gradio_chatbot.graph.checkpointer import BoundedMemorySaver, SqliteCheckpointSaver
+
+class CounterState(TypedDict):
+    steps: Annotated[list, operator.add]
+
+def build_counter_graph(checkpointer):
+    builder = StateGraph(CounterState)
+    builder.add_node("step", lambda state: {"steps": [len(state["steps"])]})
+    builder.add_edge(START, "step")
+    builder.add_edge("step", END)
+    return builder.compile(checkpointer=checkpointer)
+
+def build_review_graph(checkpointer):
+    """与 edit_summary_node 一样，在节点中等待人工审核"""
+    builder = StateGraph(CounterState)
+    builder.add_node("draft", lambda state: {"steps": ["draft"]})
+    builder.add_node("review", lambda state: {"steps": [interrupt({"summary": "草稿"})]})
+    builder.add_edge(START, "draft")
+    builder.add_edge("draft", "review")
+    builder.add_edge("review", END)
+    return builder.compile(checkpointer=checkpointer)
+
+def config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+def test_prune_keeps_last_checkpoints_and_referenced_blobs():
+    saver = BoundedMemorySaver(max_threads=10, ttl=0, keep_last=3)
+    graph = build_counter_graph(saver)
+    for _ in range(5):
+        graph.invoke({"steps": []}, config("a"))
+
+    assert len(list(saver.list(config("a")))) == 3
+    assert saver.stats["pruned"] > 0
+    # 剪枝后最新状态完整，剩余 checkpoint 引用的 blob 都还在
+    assert graph.get_state(config("a")).values["steps"] == [0, 1, 2, 3, 4]
+    for checkpoint in saver.list(config("a")):
+        versions = checkpoint.checkpoint["channel_versions"]
+        for channel, version in versions.items():
+            if channel in checkpoint.checkpoint["channel_values"]:
+                assert ("a", "", channel, version) in saver.blobs
+
+def test_lru_evicts_least_recently_used_thread():
+    saver = BoundedMemorySaver(max_threads=2, ttl=0, keep_last=2)
+    graph = build_counter_graph(saver)
+    graph.invoke({"steps": []}, config("a"))
+    graph.invoke({"steps": []}, config("b"))
+    graph.get_state(config("a"))  # a 比 b 更近被访问
+    graph.invoke({"steps": []}, config("c"))
+
+    assert saver.get_stats()["threads"] == 2
+    assert saver.stats["evicted"] == 1
+    assert graph.get_state(config("b")).values == {}
+    assert graph.get_state(config("a")).values["steps"] == [0]
+
+def test_ttl_evicts_idle_threads(monkeypatch):
+    saver = BoundedMemorySaver(max_threads=10, ttl=60, keep_last=2)
+    graph = build_counter_graph(saver)
+    graph.invoke({"steps": []}, config("idle"))
+
+    import medgemma.gradio_chatbot.graph.checkpointer as checkpointer
+    now = checkpointer.time.monotonic()
+    monkeypatch.setattr(checkpointer.time, "monotonic", lambda: now + 120)
+    graph.invoke({"steps": []}, config("active"))
+
+    assert "idle" not in saver.storage
+    assert graph.get_state(config("active")).values["steps"] == [0]
+
+def test_sqlite_reload_after_restart(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    saver = SqliteCheckpointSaver(path=path, flush_interval=60, keep_last=3, ttl=0)
+    graph = build_counter_graph(saver)
+    for _ in range(5):
+        graph.invoke({"steps": []}, config("a"))
+    saver.close()
+
+    reloaded = SqliteCheckpointSaver(path=path, flush_interval=60, keep_last=3, ttl=0)
+    try:
+        graph = build_counter_graph(reloaded)
+        assert graph.get_state(config("a")).values["steps"] == [0, 1, 2, 3, 4]
+        assert reloaded.stats["loaded"] == 1
+        # 被剪枝的 checkpoint 也已从 SQLite 删除
+        assert len(list(reloaded.list(config("a")))) == 3
+        rows = reloaded._conn.execute("SELECT COUNT(*) FROM checkpoints WHERE thread_id = 'a'").fetchone()
+        assert rows[0] == 3
+    finally:
+        reloaded.close()
+
+def test_sqlite_restores_pending_interrupt(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    saver = SqliteCheckpointSaver(path=path, flush_interval=60, keep_last=3, ttl=0)
+    build_review_graph(saver).invoke({"steps": []}, config("review"))
+    saver.close()
+
+    reloaded = SqliteCheckpointSaver(path=path, flush_interval=60, keep_last=3, ttl=0)
+    try:
+        graph = build_review_graph(reloaded)
+        state = graph.get_state(config("review"))
+        assert state.tasks[0].interrupts[0].value == {"summary": "草稿"}
+        result = graph.invoke(Command(resume="审核后"), config("review"))
+        assert result["steps"] == ["draft", "审核后"]
+    finally:
+        reloaded.close()
+
+def test_sqlite_deleted_thread_is_not_reloaded_before_flush(tmp_path):
+    saver = SqliteCheckpointSaver(path=str(tmp_path / "checkpoints.sqlite"), flush_interval=60, keep_last=3, ttl=0)
+    try:
+        graph = build_counter_graph(saver)
+        graph.invoke({"steps": []}, config("deleted"))
+        saver.flush()
+        saver.delete_thread("deleted")
+        # DELETE 仍在待写队列中，SQLite 里的旧数据不能被重新加载
+        assert saver.get_tuple(config("deleted")) is None
+        assert graph.get_state(config("deleted")).values == {}
+        saver.flush()
+        assert saver.get_tuple(config("deleted")) is None
+        # 同一会话重新使用时从空状态开始
+        assert graph.invoke({"steps": []}, config("deleted"))["steps"] == [0]
+    finally:
+        saver.close()
+
+def test_consultation_graph_prunes_checkpoints(backend):
+    """真实问诊 graph (假模型服务 + MCP 桩服务) 多轮对话后，每个会话的 checkpoint 数不超过上限"""
+    from langchain_core.messages import HumanMessage
+    from medgemma.gradio_chatbot.graph.sessions import get_config, release_session
+
+    async def scenario(runner):
+        session_id = "test-prune"
+        for turn in range(4):
+            await graph.ainvoke({"messages": [HumanMessage(content=f"第{turn + 1}轮：头痛")]},
+                                get_config(session_id))
+        checkpoints = [c async for c in graph.checkpointer.alist(get_config(session_id))]
+        state = await graph.aget_state(get_config(session_id))
+        await release_session(session_id)
+        return checkpoints, state
+
+    checkpoints, state = backend(scenario)
+    # 剪枝按命名空间进行 (主 graph 和子 graph 各自保留最近 keep_last 个)
+    per_namespace = Counter(c.config["configurable"]["checkpoint_ns"] for c in checkpoints)
+    assert per_namespace[""] == graph.checkpointer.keep_last
+    assert max(per_namespace.values()) <= graph.checkpointer.keep_last
+    assert state.values["question_count"] == 4
@@ -0,0 +1,57 @@
+"""逐 token 推送：切换端点重试和工具调用前的铺垫文本会被撤回，消费方拼出的回复与最终回复一致"""
+import aiohttp
+from langchain_core.messages import HumanMessage, AIMessage
+
+from medgemma.gradio_chatbot.graph.builder import graph
+from medgemma.gradio_chatbot.graph.runner import stream_events, TokenDelta, TokenReset
+from medgemma.gradio_chatbot.graph.sessions import get_config
+from medgemma.gradio_chatbot.utils.cancellation import start_turn, finish_turn
+
+from conftest import MODEL_PORT
+
+async def streamed_reply(session_id: str, text: str) -> tuple:
+    """按界面的方式拼接 TokenDelta / TokenReset，返回 (拼出的回复, 撤回次数)"""
+    turn = await start_turn(session_id)
+    reply, resets = "", 0
+    try:
+        async for event in stream_events({"messages": [HumanMessage(content=text)], "skip_to_advice": False}, session_id):
+            if isinstance(event, TokenDelta):
+                reply += event.text
+            elif isinstance(event, TokenReset):
+                reply = reply[:len(reply) - event.length]
+                resets += 1
+    finally:
+        finish_turn(turn)
+    return reply, resets
+
+async def final_reply(session_id: str) -> str:
+    state = await graph.aget_state(get_config(session_id))
+    return [m for m in state.values["messages"] if isinstance(m, AIMessage)][-1].content
+
+def test_tool_preamble_is_retracted(backend):
+    preamble = "让我先查一下相关的医学知识。"
+
+    async def scenario(runner):
+        reply, resets = await streamed_reply("runner-preamble", "头痛伴随低烧")
+        return reply, resets, await final_reply("runner-preamble")
+
+    reply, resets, final = backend(scenario, tool_calls=True, tool_preamble=preamble)
+    assert preamble not in reply
+    assert reply == final
+    assert resets == 1
+
+def test_failover_does_not_duplicate_partial_tokens(backend):
+    async def scenario(runner):
+        async with aiohttp.ClientSession() as http:
+            # 主端点的流式回复输出一半后断开，路由切换到备用端点重新生成
+            await http.post(f"http://127.0.0.1:{MODEL_PORT}/control", json={"cut_streams": 1})
+            reply, resets = await streamed_reply("runner-failover", "头痛伴随低烧")
+            async with http.get(f"http://127.0.0.1:{MODEL_PORT}/stats") as response:
+                stats = await response.json()
+        return reply, resets, await final_reply("runner-failover"), stats
+
+    reply, resets, final, stats = backend(scenario)
+    assert stats["cut"] == 1
+    assert reply == final
+    assert reply.count("头痛伴随低烧") == 1
+    assert resets == 1
@@ -0,0 +1,123 @@
+"""后端调度器的排队顺序、排队中取消，以及模型路由的延迟统计不包含本地排队时间"""
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from medgemma.gradio_chatbot.config.settings import QUESTIONER_MODEL_CONFIG
+from medgemma.gradio_chatbot.utils import model_router, scheduler
+from medgemma.gradio_chatbot.utils.model_router import ModelRouter
+from medgemma.gradio_chatbot.utils.scheduler import BackendScheduler, BackendBusyError, PRIORITIES
+
+async def acquire_in_order(backend: BackendScheduler, requests: list) -> list:
+    """占满后端后按顺序提交 requests [(name, priority, session)]，返回依次获得名额的请求名"""
+    await backend.acquire(0, "holder")
+    order = []
+
+    async def request(name, priority, session):
+        await backend.acquire(priority, session)
+        order.append(name)
+        await asyncio.sleep(0)
+        backend.release()
+
+    tasks = []
+    for name, priority, session in requests:
+        tasks.append(asyncio.create_task(request(name, priority, session)))
+        await asyncio.sleep(0)  # 按提交顺序入队
+    backend.release()
+    await asyncio.gather(*tasks)
+    return order
+
+def test_priority_before_fifo():
+    backend = BackendScheduler("test", limit=1)
+    order = asyncio.run(acquire_in_order(backend, [
+        ("speculative", PRIORITIES["speculative"], "s1"),
+        ("decision", PRIORITIES["decision"], "s2"),
+        ("advice", PRIORITIES["advice"], "s3"),
+    ]))
+    assert order == ["advice", "decision", "speculative"]
+
+def test_round_robin_between_sessions():
+    backend = BackendScheduler("test", limit=1)
+    order = asyncio.run(acquire_in_order(backend, [
+        ("a1", 1, "a"), ("a2", 1, "a"), ("a3", 1, "a"),
+        ("b1", 1, "b"), ("b2", 1, "b"),
+    ]))
+    # 同一会话内先进先出，会话之间轮转，a 不会连续占用后端
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+
+def test_cancel_while_queued_frees_position():
+    async def scenario():
+        backend = BackendScheduler("test", limit=1)
+        await backend.acquire(1, "holder")
+        first = asyncio.create_task(backend.acquire(1, "first"))
+        second = asyncio.create_task(backend.acquire(1, "second"))
+        await asyncio.sleep(0)
+        assert backend.position("second") == 2
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert backend.position("first") == 0
+        assert backend.position("second") == 1
+
+        backend.release()
+        await second
+        stats = backend.get_stats()
+        backend.release()
+        return stats, backend.in_flight
+
+    stats, in_flight = asyncio.run(scenario())
+    assert stats["waiting"] == 0 and stats["in_flight"] == 1
+    assert in_flight == 0
+
+def test_cancel_after_admission_returns_slot():
+    async def scenario():
+        backend = BackendScheduler("test", limit=1)
+        await backend.acquire(1, "holder")
+        waiter = asyncio.create_task(backend.acquire(1, "waiter"))
+        await asyncio.sleep(0)
+        # 名额已分配给 waiter，但它在恢复执行前被取消
+        backend.release()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return backend.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+def test_rejects_when_queue_full():
+    async def scenario():
+        backend = BackendScheduler("test", limit=1, max_queue=1)
+        await backend.acquire(1, "holder")
+        queued = asyncio.create_task(backend.acquire(1, "queued"))
+        await asyncio.sleep(0)
+        with pytest.raises(BackendBusyError):
+            await backend.acquire(1, "rejected")
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        return backend.stats["rejected"]
+
+    assert asyncio.run(scenario()) == 1
+
+def test_router_latency_excludes_local_queue_wait(backend, monkeypatch):
+    """
+    后端只有 1 个名额时，第二个请求要在本地排队一整个请求的时间
+    记录的延迟和对冲计时都应从获得名额开始，排队不会触发对冲
+    """
+    primary = QUESTIONER_MODEL_CONFIG
+    # 同一个假服务的另一个地址作为备用端点
+    hedge_target = {**primary, "base_url": primary["base_url"].replace("127.0.0.1", "localhost")}
+    monkeypatch.setitem(scheduler._schedulers, primary["base_url"], BackendScheduler("primary", limit=1))
+    monkeypatch.setattr(model_router, "MODEL_HEDGE_DELAY", 0.6)
+    router = ModelRouter("test", [primary, hedge_target], hedge=True)
+
+    async def scenario(runner):
+        call = lambda endpoint: endpoint.model().ainvoke([HumanMessage(content="头痛")])
+        await router.run(call, kind="warmup", hedge=False)  # 建立连接，避免首次请求的额外耗时
+        return await asyncio.gather(router.run(call, kind="test"), router.run(call, kind="test"))
+
+    backend(scenario, ttft=0.4, token_delay=0)
+    latencies = list(router.primary.latencies["test"])
+    assert len(latencies) == 2
+    # 第二个请求从提交到返回约 0.8 秒，其中一半是本地排队
+    assert max(latencies) < 0.6
+    assert router.stats["hedged"] == 0
@@ -0,0 +1,107 @@
+"""工具执行中间件：预算内的退避重试，以及慢调用时的对冲 (工具来自 MCP 桩服务)"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from medgemma.gradio_chatbot.tools import tool_executor as executor_module
+from medgemma.gradio_chatbot.tools.mcp_client import get_tools
+from medgemma.gradio_chatbot.tools.tool_executor import ToolExecutionMiddleware, tool_deadline
+
+def tool_request(tools: dict, name: str, args: dict):
+    return SimpleNamespace(tool=tools[name], tool_call={"id": f"call_{name}", "name": name, "args": args})
+
+def failing_then(handler, failures: int, calls: list):
+    """前 failures 次调用抛出异常，之后调用真实的 MCP 工具"""
+    async def wrapped(request):
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise ConnectionError("MCP 会话断开")
+        return await handler(request)
+    return wrapped
+
+async def invoke_tool(request):
+    return await request.tool.ainvoke(request.tool_call["args"])
+
+async def load_tools() -> dict:
+    return {tool.name: tool for tool in await get_tools()}
+
+def test_retries_until_success_within_budget(backend, monkeypatch):
+    monkeypatch.setattr(executor_module, "TOOL_RETRY_BASE_DELAY", 0.01)
+    executor = ToolExecutionMiddleware()
+    calls = []
+
+    async def scenario(runner):
+        tools = await load_tools()
+        tool_deadline.set(asyncio.get_running_loop().time() + 5)
+        request = tool_request(tools, "search_medical_knowledge", {"query": "重试测试"})
+        return await executor.awrap_tool_call(request, failing_then(invoke_tool, 2, calls))
+
+    result = backend(scenario)
+    assert "重试测试" in str(result)
+    assert len(calls) == 3
+    assert executor.stats["retries"] == 2
+    assert executor.stats["failures"] == 0
+
+def test_gives_up_when_budget_exhausted(backend, monkeypatch):
+    monkeypatch.setattr(executor_module, "TOOL_RETRY_BASE_DELAY", 0.05)
+    executor = ToolExecutionMiddleware()
+    calls = []
+
+    async def scenario(runner):
+        tools = await load_tools()
+        tool_deadline.set(asyncio.get_running_loop().time() + 0.5)
+        request = tool_request(tools, "search_medical_knowledge", {"query": "预算测试"})
+        start = time.monotonic()
+        result = await executor.awrap_tool_call(request, failing_then(invoke_tool, 1000, calls))
+        return result, time.monotonic() - start
+
+    result, elapsed = backend(scenario)
+    # 不限固定次数，但不会超出本轮预算；失败作为工具结果交给模型
+    assert result.status == "error"
+    assert len(calls) > 1
+    assert elapsed < 0.6
+    assert executor.stats["failures"] == 1
+
+def test_hedge_on_idle_session_wins(backend, monkeypatch):
+    monkeypatch.setattr(executor_module, "TOOL_HEDGE_MIN_DELAY", 0.1)
+    # 会话池的常驻进程按需启动，这里直接视为有空闲进程
+    monkeypatch.setattr(executor_module, "has_idle_session", lambda: True)
+    executor = ToolExecutionMiddleware()
+    executor._latencies["search_medical_knowledge"].extend([0.1] * 20)  # 近期 P95 为 0.1 秒
+    attempts = []
+
+    async def scenario(runner):
+        tools = await load_tools()
+
+        async def handler(request):
+            # 主调用卡在慢查询上，对冲调用走正常查询
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                return await tools["slow_query"].ainvoke({"query": "卡住", "seconds": 5})
+            return await invoke_tool(request)
+
+        request = tool_request(tools, "search_medical_knowledge", {"query": "对冲测试"})
+        start = time.monotonic()
+        result = await executor.awrap_tool_call(request, handler)
+        return result, time.monotonic() - start
+
+    result, elapsed = backend(scenario)
+    assert "对冲测试" in str(result)
+    assert len(attempts) == 2
+    assert elapsed < 2
+    assert executor.stats["hedges"] == 1 and executor.stats["hedge_wins"] == 1
+
+def test_no_hedge_without_idle_session(backend, monkeypatch):
+    monkeypatch.setattr(executor_module, "TOOL_HEDGE_MIN_DELAY", 0.05)
+    monkeypatch.setattr(executor_module, "has_idle_session", lambda: False)
+    executor = ToolExecutionMiddleware()
+    executor._latencies["search_medical_knowledge"].extend([0.05] * 20)
+
+    async def scenario(runner):
+        tools = await load_tools()
+        request = tool_request(tools, "search_medical_knowledge", {"query": "无空闲会话"})
+        return await executor.awrap_tool_call(request, invoke_tool)
+
+    result = backend(scenario)
+    assert "无空闲会话" in str(result)
+    assert executor.stats["hedges"] == 0
@@ -1,16 +1,14 @@
+import asyncio
 from typing import Annotated, Callable
 from langchain.agents import create_agent, AgentState
-from langchain.agents.middleware import ToolRetryMiddleware
-from langchain_openai import ChatOpenAI
+from langchain.agents.middleware import wrap_model_call
 from langgraph.graph import add_messages
-from langgraph.checkpoint.memory import MemorySaver
 from pydantic import BaseModel
-from medgemma.gradio_chatbot.config.settings import QUESTIONER_MODEL_CONFIG, FALLBACK_MODEL_CONFIG
+from medgemma.gradio_chatbot.config.settings import AGENT_TOOLS_REFRESH_INTERVAL, AGENT_CHECKPOINTER_BACKEND
+from medgemma.gradio_chatbot.graph.checkpointer import create_checkpointer
+from medgemma.gradio_chatbot.utils.model_router import questioner_router
 from .mcp_client import get_tools
-
-# Models
-model = ChatOpenAI(**QUESTIONER_MODEL_CONFIG)
-fallback_model_instance = ChatOpenAI(**FALLBACK_MODEL_CONFIG)
+from .tool_executor import tool_executor
 
 class ContextSchema(BaseModel):
     user_name: str
@@ -18,41 +16,103 @@ class ContextSchema(BaseModel):
 class CustomState(AgentState):
     messages: Annotated[list, add_messages]
 
-def wrap_model_call(state_schema=None):
-    """Simple wrapper for model calls (placeholder for logic in mcp_agent.py)"""
-    def decorator(fn):
-        fn._state_schema = state_schema
-        return fn
-    return decorator
-
 @wrap_model_call(state_schema=CustomState)
 async def fallback_model(request, handler: Callable):
-    """异步版本的 fallback model middleware"""
-    try:
-        return await handler(request)
-    except Exception:
-        pass
-    request = request.override(model=fallback_model_instance)
-    return await handler(request)
+    """
+    异步版本的 fallback model middleware
+    由 questioner_router 在主模型和备用模型之间路由(熔断、快速切换)
+    问诊回复会流式推送给用户，因此不做对冲请求
+    """
+    return await questioner_router.run(
+        lambda endpoint: handler(request.override(model=endpoint.model())),
+        kind="agent",
+        hedge=False
+    )
 
 # Agent checkpointer
-checkpointer = MemorySaver()
+checkpointer = create_checkpointer(AGENT_CHECKPOINTER_BACKEND)
 
-async def get_agent():
-    tools = await get_tools()
-    agent = create_agent(
-        model,
+# ==================== Agent Registry ====================
+# 工具只在首次使用时发现一次，Agent 构建后常驻复用
+_agent = None
+_tools_signature = None
+_agent_lock = asyncio.Lock()
+_watcher_task = None
+
+AGENT_CACHE_STATS = {
+    "hits": 0,      # 直接复用已构建的 Agent
+    "builds": 0,    # 构建(或重建) Agent 的次数
+    "refreshes": 0, # 检查工具列表变化的次数
+}
+
+def _signature(tools) -> tuple:
+    """工具列表签名，用于判断 MCP 服务的工具是否发生变化"""
+    return tuple(sorted((t.name, t.description or "", str(t.args)) for t in tools))
+
+def _build_agent(tools):
+    return create_agent(
+        questioner_router.primary.model(),
         tools=tools,
         context_schema=ContextSchema,
         checkpointer=checkpointer,
         middleware=[
             fallback_model,
-            ToolRetryMiddleware(
-                max_retries=3,
-                backoff_factor=2.0,
-                initial_delay=1.0,
-                on_failure='continue'
-            ),
+            # 工具调用并发执行，按本轮时间预算重试，慢调用对冲
+            tool_executor,
         ]
     )
-    return agent
+
+async def get_agent():
+    """获取常驻的问诊 Agent，首次调用时发现工具并构建"""
+    global _agent, _tools_signature
+    if _agent is not None:
+        AGENT_CACHE_STATS["hits"] += 1
+        return _agent
+
+    async with _agent_lock:
+        if _agent is not None:
+            AGENT_CACHE_STATS["hits"] += 1
+            return _agent
+        tools = await get_tools()
+        _agent = _build_agent(tools)
+        _tools_signature = _signature(tools)
+        AGENT_CACHE_STATS["builds"] += 1
+        print(f"✅ Agent 构建完成，工具数: {len(tools)}")
+        _start_watcher()
+    return _agent
+
+async def refresh_agent(force: bool = False):
+    """
+    重新拉取 MCP 工具列表，工具发生变化(或 force=True)时重建 Agent
+    返回是否发生了重建
+    """
+    global _agent, _tools_signature
+    async with _agent_lock:
+        AGENT_CACHE_STATS["refreshes"] += 1
+        tools = await get_tools(refresh=True)
+        signature = _signature(tools)
+        if not force and _agent is not None and signature == _tools_signature:
+            return False
+        _agent = _build_agent(tools)
+        _tools_signature = signature
+        AGENT_CACHE_STATS["builds"] += 1
+        print(f"🔄 MCP 工具列表已更新，Agent 已重建，工具数: {len(tools)}")
+        return True
+
+async def _watch_tools(interval: float):
+    """定期检查 MCP 服务的工具列表，变化时热重载 Agent"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_agent()
+        except Exception as e:
+            print(f"⚠️ 检查 MCP 工具列表失败: {e}")
+
+def _start_watcher():
+    global _watcher_task
+    if AGENT_TOOLS_REFRESH_INTERVAL > 0 and _watcher_task is None:
+        _watcher_task = asyncio.create_task(_watch_tools(AGENT_TOOLS_REFRESH_INTERVAL))
+
+def get_agent_cache_stats() -> dict:
+    """返回 Agent 缓存命中/重建计数"""
+    return dict(AGENT_CACHE_STATS)
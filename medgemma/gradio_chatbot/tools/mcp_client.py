@@ -1,8 +1,68 @@
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from medgemma.gradio_chatbot.config.settings import MCP_CONFIG
+from langchain_mcp_adapters.tools import load_mcp_tools
+from medgemma.gradio_chatbot.config.settings import MCP_CONFIG, TOOL_CACHE_ENABLED, TOOL_CACHE_TOOLS
+from medgemma.gradio_chatbot.utils.response_cache import tool_cache, tool_cache_key
+from .mcp_pool import MCPSessionPool
 
 client = MultiServerMCPClient(MCP_CONFIG)
 
-async def get_tools():
-    tools = await client.get_tools()
+# ==================== MCP 会话池 ====================
+# 每个 MCP 服务保持若干常驻进程，不同会话的并发工具调用分发到空闲进程上
+pools = {server_name: MCPSessionPool(client, server_name) for server_name in MCP_CONFIG}
+
+# 工具列表缓存
+_tools = None
+
+async def _pool_interceptor(request, handler):
+    """将工具调用转发到对应服务的会话池，而不是工具加载时绑定的会话"""
+    pool = pools.get(request.server_name)
+    if pool is None:
+        return await handler(request)
+    if not TOOL_CACHE_ENABLED or (TOOL_CACHE_TOOLS and request.name not in TOOL_CACHE_TOOLS):
+        return await pool.call_tool(request.name, request.args)
+
+    # 相同工具 + 相同参数的查询结果在 TTL 内直接复用
+    key = tool_cache_key(request.server_name, request.name, request.args)
+    result = tool_cache.get(key)
+    if result is None:
+        result = await pool.call_tool(request.name, request.args)
+        if not getattr(result, "isError", False):
+            tool_cache.put(key, result)
+    return result
+
+async def list_tools():
+    """从会话池中重新拉取所有 MCP 服务的工具列表"""
+    tools = []
+    for server_name, pool in pools.items():
+        async with pool.session() as session:
+            tools.extend(await load_mcp_tools(
+                session,
+                server_name=server_name,
+                tool_interceptors=[_pool_interceptor]
+            ))
     return tools
+
+async def get_tools(refresh: bool = False):
+    """
+    获取 MCP 工具列表
+    默认返回缓存的工具列表，refresh=True 时重新拉取
+    """
+    global _tools
+    if _tools is None or refresh:
+        _tools = await list_tools()
+    return _tools
+
+def has_idle_session() -> bool:
+    """是否有会话池存在空闲进程(用于判断能否发起对冲调用)"""
+    return any(pool.get_stats()["idle"] > 0 for pool in pools.values())
+
+def get_pool_stats() -> dict:
+    """返回各 MCP 会话池的状态"""
+    return {server_name: pool.get_stats() for server_name, pool in pools.items()}
+
+async def close_sessions():
+    """关闭所有 MCP 会话池"""
+    global _tools
+    for pool in pools.values():
+        await pool.close()
+    _tools = None
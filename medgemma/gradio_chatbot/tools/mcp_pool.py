@@ -0,0 +1,193 @@
+import asyncio
+from contextlib import asynccontextmanager
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from medgemma.gradio_chatbot.config.settings import (
+    MCP_POOL_SIZE, MCP_POOL_MAX_WAITING, MCP_POOL_ACQUIRE_TIMEOUT,
+    MCP_CALL_TIMEOUT, MCP_WORKER_RESTART_DELAY
+)
+
+class MCPPoolBusyError(RuntimeError):
+    """会话池繁忙：等待队列已满或在超时时间内没有空闲会话"""
+
+class _Worker:
+    """一个常驻的 MCP 服务进程及其会话"""
+    def __init__(self, index: int):
+        self.index = index
+        self.session = None
+        self.task = None
+        self.ready = asyncio.Event()
+        self.retire = asyncio.Event()  # 置位后关闭当前进程(崩溃、超时或关闭池)
+        self.calls = 0
+        self.restarts = 0
+
+class MCPSessionPool:
+    """
+    MCP stdio 服务的会话池
+    - 保持 size 个常驻服务进程，并发的工具调用分发给空闲进程
+    - 等待者超过 max_waiting 或 acquire_timeout 内无空闲进程时拒绝请求(背压)
+    - 单次调用超过 call_timeout 视为卡死，重启该进程
+    - 进程崩溃后自动重启
+    """
+    def __init__(
+        self,
+        client: MultiServerMCPClient,
+        server_name: str,
+        size: int = MCP_POOL_SIZE,
+        max_waiting: int = MCP_POOL_MAX_WAITING,
+        acquire_timeout: float = MCP_POOL_ACQUIRE_TIMEOUT,
+        call_timeout: float = MCP_CALL_TIMEOUT,
+        restart_delay: float = MCP_WORKER_RESTART_DELAY,
+    ):
+        self.client = client
+        self.server_name = server_name
+        self.size = max(1, size)
+        self.max_waiting = max_waiting
+        self.acquire_timeout = acquire_timeout
+        self.call_timeout = call_timeout
+        self.restart_delay = restart_delay
+
+        self._workers = []
+        self._idle = None
+        self._waiting = 0
+        self._started = False
+        self._closed = False
+        self._start_lock = asyncio.Lock()
+        self.stats = {
+            "calls": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "rejected": 0,
+            "restarts": 0,
+        }
+
+    async def start(self):
+        """启动所有工作进程，至少一个就绪后返回"""
+        if self._started:
+            return
+        async with self._start_lock:
+            if self._started:
+                return
+            self._closed = False
+            self._idle = asyncio.Queue()
+            self._workers = [_Worker(i) for i in range(self.size)]
+            for worker in self._workers:
+                worker.task = asyncio.create_task(self._run_worker(worker))
+
+            waiters = [asyncio.create_task(w.ready.wait()) for w in self._workers]
+            done, pending = await asyncio.wait(
+                waiters,
+                timeout=self.acquire_timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in pending:
+                task.cancel()
+            if not done:
+                await self.close()
+                raise MCPPoolBusyError(f"MCP 服务 {self.server_name} 启动超时")
+            self._started = True
+            print(f"✅ MCP 会话池已启动: {self.server_name} (进程数: {self.size})")
+
+    async def _run_worker(self, worker: _Worker):
+        """持有一个服务进程，退出后自动重启，直到会话池关闭"""
+        while not self._closed:
+            worker.retire.clear()
+            try:
+                async with self.client.session(self.server_name) as session:
+                    worker.session = session
+                    worker.ready.set()
+                    self._idle.put_nowait(worker)
+                    await worker.retire.wait()
+            except Exception as e:
+                print(f"❌ MCP 进程 {self.server_name}#{worker.index} 异常退出: {e}")
+            finally:
+                worker.session = None
+
+            if self._closed:
+                break
+            worker.restarts += 1
+            self.stats["restarts"] += 1
+            print(f"🔄 重启 MCP 进程 {self.server_name}#{worker.index}")
+            await asyncio.sleep(self.restart_delay)
+
+    async def _acquire(self) -> _Worker:
+        if self._waiting >= self.max_waiting:
+            self.stats["rejected"] += 1
+            raise MCPPoolBusyError(f"MCP 服务 {self.server_name} 繁忙，等待队列已满")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.acquire_timeout
+        self._waiting += 1
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                try:
+                    worker = await asyncio.wait_for(self._idle.get(), max(remaining, 0))
+                except asyncio.TimeoutError:
+                    self.stats["rejected"] += 1
+                    raise MCPPoolBusyError(
+                        f"MCP 服务 {self.server_name} 繁忙，{self.acquire_timeout}s 内无空闲会话"
+                    ) from None
+                # 跳过已失效的进程(它们重启就绪后会重新入队)
+                if worker.session is not None and not worker.retire.is_set():
+                    return worker
+        finally:
+            self._waiting -= 1
+
+    @asynccontextmanager
+    async def session(self):
+        """独占借出一个就绪的会话，出错时重启对应进程"""
+        await self.start()
+        worker = await self._acquire()
+        worker.calls += 1
+        healthy = True
+        try:
+            yield worker.session
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            if healthy and not self._closed:
+                self._idle.put_nowait(worker)
+            else:
+                worker.retire.set()
+
+    async def call_tool(self, name: str, arguments: dict):
+        """在空闲会话上调用工具，超过 call_timeout 则中止并重启该进程"""
+        self.stats["calls"] += 1
+        try:
+            async with self.session() as session:
+                return await asyncio.wait_for(session.call_tool(name, arguments), self.call_timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise TimeoutError(f"MCP 工具 {name} 调用超时 ({self.call_timeout}s)") from None
+        except MCPPoolBusyError:
+            raise
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+    def get_stats(self) -> dict:
+        """返回会话池状态"""
+        return {
+            **self.stats,
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle else 0,
+            "waiting": self._waiting,
+            "workers": [
+                {"index": w.index, "alive": w.session is not None, "calls": w.calls, "restarts": w.restarts}
+                for w in self._workers
+            ],
+        }
+
+    async def close(self):
+        """关闭所有工作进程"""
+        self._closed = True
+        self._started = False
+        for worker in self._workers:
+            worker.retire.set()
+        tasks = [w.task for w in self._workers if w.task]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
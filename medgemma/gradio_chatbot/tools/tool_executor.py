@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import random
+import time
+from collections import defaultdict, deque
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import ToolMessage
+from langgraph.errors import GraphBubbleUp
+from medgemma.gradio_chatbot.config.settings import (
+    TOOL_TURN_BUDGET, TOOL_RETRY_BASE_DELAY, TOOL_RETRY_MAX_DELAY,
+    TOOL_HEDGING, TOOL_HEDGE_MIN_DELAY, TOOL_HEDGE_MIN_SAMPLES
+)
+from medgemma.gradio_chatbot.utils.metrics import record_tool_call, record_tool_attempt, record_cancelled_work
+from medgemma.gradio_chatbot.utils.cancellation import is_cancelled
+from .mcp_client import has_idle_session
+
+class ToolBudgetExceeded(TimeoutError):
+    """本轮工具调用的时间预算已用完"""
+
+# 本轮工具调用的截止时间(事件循环时间)，由问诊节点在调用 Agent 前设置
+# Agent 内部的工具任务继承该上下文，同一轮中并发、重试和对冲的调用共享同一个预算
+tool_deadline = contextvars.ContextVar("tool_deadline", default=None)
+
+def start_tool_budget(seconds: float = TOOL_TURN_BUDGET):
+    """开始本轮的工具调用时间预算"""
+    tool_deadline.set(asyncio.get_running_loop().time() + seconds)
+
+class ToolExecutionMiddleware(AgentMiddleware):
+    """
+    问诊 Agent 的工具执行阶段
+    - 同一条 AIMessage 中的多个工具调用由 Agent 分发为并发任务，各自经过本中间件
+    - 失败后按 full jitter 退避重试，直到本轮剩余时间预算不够再完成一次调用为止(不限固定次数)
+    - 超过该工具近期耗时 P95 仍未返回时，在空闲的 MCP 会话上发起对冲调用，先返回的结果胜出
+    - 按工具记录单次尝试和整体调用的延迟直方图
+    """
+    def __init__(self):
+        super().__init__()
+        self._latencies = defaultdict(lambda: deque(maxlen=200))  # 工具名 -> 近期成功调用耗时
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "budget_exhausted": 0, "failures": 0}
+
+    def _quantile(self, tool: str, q: float) -> float | None:
+        samples = self._latencies[tool]
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(q * (len(ordered) - 1))]
+
+    def _hedge_delay(self, tool: str) -> float | None:
+        if not TOOL_HEDGING or len(self._latencies[tool]) < TOOL_HEDGE_MIN_SAMPLES:
+            return None
+        return max(TOOL_HEDGE_MIN_DELAY, self._quantile(tool, 0.95))
+
+    async def _attempt(self, tool: str, request, handler, hedge: bool = False):
+        start = time.perf_counter()
+        try:
+            result = await handler(request)
+        except asyncio.CancelledError:
+            # 对冲中落败或超出预算被取消，不计入延迟；用户取消本轮时记为被取消的调用
+            if is_cancelled():
+                record_cancelled_work("tool", time.perf_counter() - start, tool=tool)
+            raise
+        except Exception:
+            record_tool_attempt(tool, time.perf_counter() - start, error=True, hedge=hedge)
+            raise
+        elapsed = time.perf_counter() - start
+        self._latencies[tool].append(elapsed)
+        record_tool_attempt(tool, elapsed, error=False, hedge=hedge)
+        return result
+
+    async def _call_once(self, tool: str, request, handler, deadline: float | None):
+        """完成一次调用(重试时不超过截止时间)，慢调用时对冲"""
+        loop = asyncio.get_running_loop()
+        tasks = {asyncio.ensure_future(self._attempt(tool, request, handler)): False}  # 任务 -> 是否为对冲
+        hedge_delay = self._hedge_delay(tool)
+        try:
+            while True:
+                wait = None
+                if deadline is not None:
+                    wait = deadline - loop.time()
+                    if wait <= 0:
+                        raise ToolBudgetExceeded(f"工具 {tool} 超出本轮时间预算")
+                if hedge_delay is not None:
+                    wait = hedge_delay if wait is None else min(wait, hedge_delay)
+                done, _ = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    hedged = tasks.pop(task)
+                    if task.exception() is None:
+                        if hedged:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    if not tasks:
+                        raise task.exception()
+                if not done and hedge_delay is not None:
+                    # 主调用超过 P95 仍未返回，空闲会话上再发起一次，先返回者胜出
+                    # 会话池没有空闲进程时不对冲，避免挤占其他会话的工具调用
+                    hedge_delay = None
+                    if has_idle_session():
+                        self.stats["hedges"] += 1
+                        tasks[asyncio.ensure_future(self._attempt(tool, request, handler, hedge=True))] = True
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def awrap_tool_call(self, request, handler):
+        tool = request.tool.name if request.tool else request.tool_call["name"]
+        loop = asyncio.get_running_loop()
+        deadline = tool_deadline.get()
+        if deadline is None:
+            deadline = loop.time() + TOOL_TURN_BUDGET
+        self.stats["calls"] += 1
+
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # 首次调用总会发出(由 MCP 会话池的单次调用超时兜底)，预算只约束重试
+                result = await self._call_once(tool, request, handler, deadline if attempt > 1 else None)
+                record_tool_call(tool, time.perf_counter() - start, "ok", attempt)
+                return result
+            except GraphBubbleUp:
+                # 中断等控制流信号直接向上传递
+                raise
+            except Exception as e:
+                error = e
+
+            # 退避后还要留出一次调用的时间(近期耗时中位数)，否则放弃重试
+            delay = random.uniform(0, min(TOOL_RETRY_MAX_DELAY, TOOL_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            expected = self._quantile(tool, 0.5) or 0.0
+            if loop.time() + delay + expected >= deadline:
+                break
+            self.stats["retries"] += 1
+            print(f"🔁 工具 {tool} 调用失败，{delay:.2f}s 后重试: {error}")
+            await asyncio.sleep(delay)
+
+        exhausted = isinstance(error, ToolBudgetExceeded)
+        self.stats["budget_exhausted" if exhausted else "failures"] += 1
+        record_tool_call(tool, time.perf_counter() - start, "budget" if exhausted else "error", attempt)
+        # 与原先 on_failure='continue' 一致: 把错误作为工具结果交给模型，由模型决定如何继续
+        return ToolMessage(
+            content=f"工具 {tool} 调用失败(尝试 {attempt} 次): {type(error).__name__}: {error}",
+            tool_call_id=request.tool_call["id"],
+            name=tool,
+            status="error",
+        )
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "p50": {tool: self._quantile(tool, 0.5) for tool in list(self._latencies)},
+            "p95": {tool: self._quantile(tool, 0.95) for tool in list(self._latencies)},
+        }
+
+# 常驻的工具执行中间件，Agent 重建后延迟统计仍然保留
+tool_executor = ToolExecutionMiddleware()
@@ -1,13 +1,38 @@
-from transformers import pipeline
+import asyncio
+import contextvars
+import threading
+import time
 from medgemma.gradio_chatbot.utils import text_utils
-# ASR 模型 (Whisper)
-print("正在加载 ASR 模型...")
-asr_pipe = pipeline(
-    "automatic-speech-recognition", 
-    model="openai/whisper-small",
-    generate_kwargs={"language": "zh", "task": "transcribe"}
-)
-print("ASR 模型加载完成！")
+from medgemma.gradio_chatbot.utils.inference import inference_executor
+from medgemma.gradio_chatbot.utils.metrics import record_cancelled_work
+from medgemma.gradio_chatbot.config.settings import ASR_BATCHING, ASR_BATCH_WINDOW, ASR_MAX_BATCH_SIZE, ASR_CHUNK_LENGTH
+
+# ASR 模型 (Whisper)，首次使用或后台预热时加载
+asr_pipe = None
+_load_lock = threading.Lock()
+
+def load_asr_model():
+    """加载 Whisper 模型(只加载一次，线程安全)"""
+    global asr_pipe
+    if asr_pipe is not None:
+        return asr_pipe
+    with _load_lock:
+        if asr_pipe is not None:
+            return asr_pipe
+        print("正在加载 ASR 模型...")
+        start = time.perf_counter()
+        from transformers import pipeline
+        asr_pipe = pipeline(
+            "automatic-speech-recognition", 
+            model="openai/whisper-small",
+            generate_kwargs={"language": "zh", "task": "transcribe"},
+            chunk_length_s=ASR_CHUNK_LENGTH  # 长音频分块识别，分块可与其他请求一起批处理
+        )
+        print(f"ASR 模型加载完成！耗时 {time.perf_counter() - start:.1f}s")
+        return asr_pipe
+
+def is_asr_ready() -> bool:
+    return asr_pipe is not None
 
 def speech_to_text(audio_path: str) -> str:
     """
@@ -17,7 +42,7 @@ def speech_to_text(audio_path: str) -> str:
         return ""
     
     try:
-        result = asr_pipe(audio_path)
+        result = load_asr_model()(audio_path)
         user_text = result["text"].strip()
         # 将繁体转换为简体
         user_text = text_utils.convert_t2s(user_text)
@@ -25,3 +50,98 @@ def speech_to_text(audio_path: str) -> str:
     except Exception as e:
         print(f"ASR 错误: {e}")
         return ""
+
+def speech_to_text_batch(audio_paths: list[str]) -> list[str]:
+    """
+    批量语音识别：一次前向处理多段音频
+    整批失败时逐条重试，避免一段坏音频影响同批的其他请求
+    """
+    try:
+        results = load_asr_model()(audio_paths, batch_size=len(audio_paths))
+        return [text_utils.convert_t2s(result["text"].strip()) for result in results]
+    except Exception as e:
+        print(f"ASR 批处理错误，逐条重试: {e}")
+        return [speech_to_text(audio_path) for audio_path in audio_paths]
+
+class ASRBatcher:
+    """
+    ASR 微批处理服务
+    在 window 秒的时间窗口内收集并发的识别请求(最多 max_batch_size 条)，
+    合并为一个批次送入 Whisper，再把结果分发给各自的调用方
+    """
+    def __init__(self, window: float = ASR_BATCH_WINDOW, max_batch_size: int = ASR_MAX_BATCH_SIZE):
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue = None
+        self._worker = None
+        self.stats = {"requests": 0, "batches": 0}
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            # 批处理任务服务所有会话，不继承首个调用方的上下文(避免耗时指标记到该会话上)
+            self._worker = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    async def transcribe(self, audio_path: str) -> str:
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((audio_path, future))
+        self.stats["requests"] += 1
+        return await future
+
+    async def _collect(self) -> list:
+        """等待第一条请求，然后在时间窗口内继续收集，直到凑满一批"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # 调用方已取消(清空对话、关闭页面)的请求不再识别
+            for _, future in batch:
+                if future.cancelled():
+                    record_cancelled_work("asr", 0.0)
+            batch = [(path, future) for path, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            self.stats["batches"] += 1
+            try:
+                texts = await inference_executor.run(
+                    speech_to_text_batch, [path for path, _ in batch], name=f"asr x{len(batch)}"
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+
+    def get_stats(self) -> dict:
+        batches = self.stats["batches"]
+        return {**self.stats, "avg_batch_size": self.stats["requests"] / batches if batches else 0.0}
+
+asr_batcher = ASRBatcher()
+
+async def speech_to_text_async(audio_path: str) -> str:
+    """
+    在推理线程池中执行语音识别，不阻塞事件循环
+    开启 ASR_BATCHING 时与其他并发请求合并批处理
+    推理队列已满时抛出 InferenceBusyError
+    """
+    if audio_path is None:
+        return ""
+    if ASR_BATCHING:
+        return await asr_batcher.transcribe(audio_path)
+    return await inference_executor.run(speech_to_text, audio_path, name="asr")
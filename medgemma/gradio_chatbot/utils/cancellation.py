@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import time
+from medgemma.gradio_chatbot.config.settings import CANCEL_ON_NEW_MESSAGE, CANCEL_WAIT_TIMEOUT
+from medgemma.gradio_chatbot.utils.metrics import record_cancellation
+
+class TurnCancelled(Exception):
+    """本轮已被取消(清空对话、发送了新消息或关闭页面)，调用方直接结束，不再更新界面"""
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class Turn:
+    """
+    一个会话中正在进行的一轮对话
+    graph 运行、语音识别和语音合成等任务登记在轮次上，取消轮次时一并取消
+    """
+    def __init__(self, session: str):
+        self.session = session
+        self.reason = ""
+        # graph 已运行完成，本轮的输入和回复已写入会话(之后被取消也不会回滚)
+        self.committed = False
+        # 开始本轮时被取消的上一轮(同一会话发送了新消息)
+        self.superseded = None
+        self._tasks = set()
+        self._callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return bool(self.reason)
+
+    def add_task(self, task: asyncio.Task):
+        if self.cancelled:
+            task.cancel()
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def on_cancel(self, callback):
+        """登记取消时执行的清理(如放弃尚未合成的句子)"""
+        if self.cancelled:
+            callback()
+        else:
+            self._callbacks.append(callback)
+
+    def check(self):
+        """本轮已被取消时抛出 TurnCancelled"""
+        if self.cancelled:
+            raise TurnCancelled(self.reason)
+
+    async def run(self, coro):
+        """在登记的任务中执行 coro，本轮被取消时抛出 TurnCancelled"""
+        task = asyncio.ensure_future(coro)
+        self.add_task(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # 只有本轮被取消时才转换，调用方自身被取消时照常向上传递
+            if self.cancelled and task.cancelled():
+                raise TurnCancelled(self.reason) from None
+            raise
+
+    def cancel(self, reason: str) -> bool:
+        if self.cancelled:
+            return False
+        self.reason = reason
+        for task in list(self._tasks):
+            task.cancel()
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ 取消清理失败: {e}")
+        return True
+
+    async def wait(self, timeout: float = CANCEL_WAIT_TIMEOUT):
+        """等待登记的任务退出(被取消的 graph 在退出前回滚 checkpoint)"""
+        tasks = [task for task in self._tasks if not task.done()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+# 当前任务所属的轮次，由 app 在运行 graph 前设置；模型和工具调用据此区分用户取消和对冲等内部取消
+current_turn = contextvars.ContextVar("current_turn", default=None)
+
+# 会话 -> 正在进行的轮次
+_turns = {}
+
+def is_cancelled() -> bool:
+    """当前任务所属的轮次是否已被取消"""
+    turn = current_turn.get()
+    return turn is not None and turn.cancelled
+
+def get_turn(session: str) -> Turn | None:
+    return _turns.get(session)
+
+async def start_turn(session: str) -> Turn:
+    """开始新的一轮；同一会话上一轮仍在进行时先取消它并等待其退出"""
+    previous = _turns.get(session)
+    turn = Turn(session)
+    if previous is not None and CANCEL_ON_NEW_MESSAGE:
+        await cancel_turn(previous, "superseded")
+        turn.superseded, previous.superseded = previous, None
+    _turns[session] = turn
+    return turn
+
+def finish_turn(turn: Turn):
+    if _turns.get(turn.session) is turn:
+        del _turns[turn.session]
+
+async def cancel_turn(turn: Turn, reason: str):
+    if not turn.cancel(reason):
+        # 已在取消中，等待其退出即可
+        await turn.wait()
+        return
+    start = time.monotonic()
+    await turn.wait()
+    finish_turn(turn)
+    elapsed = time.monotonic() - start
+    record_cancellation(turn.session, reason, elapsed)
+    print(f"🛑 已取消会话 {turn.session[:8]} 进行中的一轮 ({reason}, {elapsed:.2f}s)")
+
+async def cancel_session(session: str, reason: str) -> bool:
+    """取消会话中正在进行的一轮，返回是否有需要取消的轮次"""
+    turn = _turns.get(session)
+    if turn is None:
+        return False
+    await cancel_turn(turn, reason)
+    return True
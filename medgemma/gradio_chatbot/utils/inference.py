@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from medgemma.gradio_chatbot.config.settings import INFERENCE_WORKERS, INFERENCE_MAX_QUEUE
+from medgemma.gradio_chatbot.utils.metrics import record_speech, record_cancelled_work
+
+class InferenceBusyError(RuntimeError):
+    """推理队列已满，调用方应降级处理(跳过语音回复、提示用户稍后重试等)"""
+
+class InferenceExecutor:
+    """
+    语音模型(ASR/TTS)专用的推理线程池
+    - 同步的 PyTorch 推理在工作线程中执行，不阻塞 asyncio 事件循环
+    - 排队中的任务超过 max_queue 时直接拒绝，避免请求无限堆积
+    - 记录队列深度和排队等待时间
+    """
+    def __init__(self, workers: int = INFERENCE_WORKERS, max_queue: int = INFERENCE_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._wait_times = deque(maxlen=200)
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+    def _wrap(self, fn, args, kwargs, submitted_at: float):
+        def task():
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_times.append(time.monotonic() - submitted_at)
+            started = time.monotonic()
+            try:
+                return fn(*args, **kwargs), time.monotonic() - started
+            finally:
+                with self._lock:
+                    self._running -= 1
+        return task
+
+    async def run(self, fn, *args, name: str = "", **kwargs):
+        """在推理线程池中执行 fn，队列已满时抛出 InferenceBusyError"""
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise InferenceBusyError(f"推理队列已满 ({self._queued}/{self.max_queue})，拒绝任务 {name}")
+            self._queued += 1
+            self.stats["submitted"] += 1
+
+        # name 形如 "tts" 或 "asr x4"(批处理条数)
+        task, _, batch = name.partition(" x")
+        future = self._pool.submit(self._wrap(fn, args, kwargs, time.monotonic()))
+        try:
+            result, elapsed = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 还在排队的任务直接取消，释放队列位置；已开始的推理无法中断，照常执行完
+            if future.cancel():
+                with self._lock:
+                    self._queued -= 1
+                if task:
+                    record_cancelled_work(task, 0.0)
+            raise
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        self.stats["completed"] += 1
+        if task:
+            record_speech(task, elapsed, int(batch) if batch.isdigit() else 1)
+        return result
+
+    def get_stats(self) -> dict:
+        """返回队列深度、运行中任务数和排队等待时间"""
+        with self._lock:
+            waits = sorted(self._wait_times)
+            queued, running = self._queued, self._running
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "queue_depth": queued,
+            "running": running,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+        }
+
+# ASR 和 TTS 共享的推理线程池
+inference_executor = InferenceExecutor()
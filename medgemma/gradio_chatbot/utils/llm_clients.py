@@ -0,0 +1,45 @@
+import importlib.util
+import httpx
+from langchain_openai import ChatOpenAI
+from medgemma.gradio_chatbot.config.settings import LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE, LLM_KEEPALIVE_EXPIRY, LLM_HTTP2, LLM_STREAM_USAGE
+
+# HTTP/2 需要可选依赖 h2 (pip install "httpx[http2]")，未安装时使用 HTTP/1.1 keep-alive
+_http2 = LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+
+# base_url -> 共享的 httpx.AsyncClient
+_http_clients = {}
+# 模型配置 -> ChatOpenAI 客户端
+_chat_models = {}
+
+def get_http_client(base_url: str) -> httpx.AsyncClient:
+    """同一后端的所有模型客户端共享一个连接池"""
+    client = _http_clients.get(base_url)
+    if client is None:
+        client = _http_clients[base_url] = httpx.AsyncClient(
+            http2=_http2,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return client
+
+def get_chat_model(config: dict, **overrides) -> ChatOpenAI:
+    """按模型配置(含参数覆盖项)复用 ChatOpenAI 客户端，底层使用共享连接池"""
+    merged = {"stream_usage": LLM_STREAM_USAGE, **config, **overrides}
+    # SecretStr 的 str() 被遮蔽，需取出真实值参与比较，避免不同 API Key 共用客户端
+    key = repr(sorted((k, str(getattr(v, "get_secret_value", lambda: v)())) for k, v in merged.items()))
+    model = _chat_models.get(key)
+    if model is None:
+        model = _chat_models[key] = ChatOpenAI(
+            **merged, http_async_client=get_http_client(merged.get("base_url") or "")
+        )
+    return model
+
+async def close_clients():
+    """关闭共享连接池(进程退出或压测结束时调用)"""
+    for client in _http_clients.values():
+        await client.aclose()
+    _http_clients.clear()
+    _chat_models.clear()
@@ -0,0 +1,414 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from medgemma.gradio_chatbot.config.settings import (
+    METRICS_ENABLED, METRICS_LOG, METRICS_MAX_SESSIONS, METRICS_NAMESPACE
+)
+
+# 当前正在执行的 graph 节点，模型调用和排队时间按节点归类；后台任务中为空
+current_node = contextvars.ContextVar("current_node", default="")
+
+# 延迟直方图的桶边界(秒)，覆盖决策调用(几十毫秒)到长文本生成(几十秒)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# 单个会话累计的耗时和用量
+SESSION_FIELDS = (
+    "turns", "wall_seconds", "queue_seconds", "model_seconds", "model_calls",
+    "prompt_tokens", "cached_tokens", "completion_tokens", "retries", "fallbacks", "errors",
+    "tool_calls", "tool_seconds", "asr_seconds", "tts_seconds", "cancellations",
+)
+
+class MetricsRegistry:
+    """
+    进程内的指标汇总
+    - 计数器和直方图按 (指标名, 标签) 聚合，以 Prometheus 文本格式导出
+    - 同时按会话累计耗时、token 用量、重试和备用模型使用次数 (LRU，最多 max_sessions 个会话)
+    指标由事件循环写入、由 /metrics 线程读取，读写都在锁内进行
+    """
+    def __init__(self, max_sessions: int = METRICS_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)  # (名称, 标签) -> 值
+        self._histograms = {}                # (名称, 标签) -> Histogram
+        self._help = {}
+        self._sessions = OrderedDict()       # 会话 -> {字段: 值, "nodes": {节点: 耗时}}
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels):
+        with self._lock:
+            self._help.setdefault(name, help)
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        with self._lock:
+            self._help.setdefault(name, help)
+            key = (name, tuple(sorted(labels.items())))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def mean(self, name: str, **labels) -> float:
+        """标签包含 labels 的所有直方图的平均值，没有样本时返回 0"""
+        wanted = set(labels.items())
+        total = count = 0
+        with self._lock:
+            for (hist_name, hist_labels), histogram in self._histograms.items():
+                if hist_name == name and wanted <= set(hist_labels):
+                    total += histogram.sum
+                    count += histogram.count
+        return total / count if count else 0.0
+
+    def add_session(self, session: str, node: str = "", node_seconds: float = 0.0, **values):
+        if not session:
+            return
+        with self._lock:
+            entry = self._sessions.get(session)
+            if entry is None:
+                entry = self._sessions[session] = {**dict.fromkeys(SESSION_FIELDS, 0), "nodes": {}}
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session)
+            for field, value in values.items():
+                entry[field] += value
+            if node:
+                entry["nodes"][node] = entry["nodes"].get(node, 0) + node_seconds
+
+    def get_session(self, session: str) -> dict | None:
+        with self._lock:
+            entry = self._sessions.get(session)
+            return None if entry is None else {**entry, "nodes": dict(entry["nodes"])}
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()),
+                key=lambda item: item[0]
+            )
+            helps = dict(self._help)
+            sessions = len(self._sessions)
+
+        lines, declared = [], set()
+
+        def declare(name: str, kind: str):
+            if name not in declared:
+                declared.add(name)
+                if helps.get(name):
+                    lines.append(f"# HELP {name} {helps[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), counts, total, count, buckets in histograms:
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}' if bound != '+Inf' else bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        declare(f"{METRICS_NAMESPACE}_tracked_sessions", "gauge")
+        lines.append(f"{METRICS_NAMESPACE}_tracked_sessions {sessions}")
+        lines.extend(_component_gauges())
+        return "\n".join(lines) + "\n"
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+registry = MetricsRegistry()
+
+# ==================== Structured Log ====================
+
+_logger = logging.getLogger("smartconsult.metrics")
+_logger.propagate = False
+if METRICS_LOG:
+    _handler = logging.StreamHandler(sys.stdout) if METRICS_LOG == "stdout" else logging.FileHandler(METRICS_LOG, encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger.addHandler(_handler)
+    _logger.setLevel(logging.INFO)
+
+def log_event(event: str, **fields):
+    """以 JSON 行的形式输出一条结构化日志 (METRICS_LOG 未配置时不输出)"""
+    if _logger.handlers:
+        _logger.info(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False, default=str))
+
+# ==================== Recorders ====================
+
+def _session() -> str:
+    from medgemma.gradio_chatbot.utils.scheduler import current_session
+    return current_session.get()
+
+def usage_of(result) -> tuple[int, int, int]:
+    """
+    从 AIMessage (或 Agent 中间件的 ModelResponse) 中取出 (输入 token, 输出 token, 命中前缀缓存的输入 token)
+    后端未返回缓存信息时(vLLM 需开启 --enable-prompt-tokens-details)缓存 token 记为 0
+    """
+    messages = getattr(result, "result", None)
+    if not isinstance(messages, list):
+        messages = [result]
+    prompt = completion = cached = 0
+    for message in messages:
+        usage = getattr(message, "usage_metadata", None) or {}
+        prompt += usage.get("input_tokens", 0)
+        completion += usage.get("output_tokens", 0)
+        cached += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    return prompt, completion, cached
+
+def record_node(node: str, seconds: float, session: str, error: bool = False):
+    if not METRICS_ENABLED:
+        return
+    registry.observe(f"{METRICS_NAMESPACE}_node_seconds", seconds, "graph 节点耗时", node=node)
+    if error:
+        registry.inc(f"{METRICS_NAMESPACE}_node_errors_total", help="graph 节点异常次数", node=node)
+    registry.add_session(session, node=node, node_seconds=seconds, errors=int(error))
+    log_event("node", session=session, node=node, seconds=round(seconds, 4), error=error)
+
+def record_queue_wait(backend: str, kind: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    registry.observe(f"{METRICS_NAMESPACE}_queue_wait_seconds", seconds, "模型后端排队等待时间", backend=backend, kind=kind)
+    registry.add_session(_session(), queue_seconds=seconds)
+
+def record_model_call(router: str, endpoint: str, kind: str, seconds: float, result=None, error: Exception | None = None):
+    """记录一次模型调用(不含排队时间)的延迟、token 用量和结果"""
+    if not METRICS_ENABLED:
+        return
+    node = current_node.get() or "background"
+    labels = {"router": router, "endpoint": endpoint, "kind": kind}
+    registry.observe(f"{METRICS_NAMESPACE}_model_seconds", seconds, "模型调用延迟(不含排队)", **labels)
+    if error is not None:
+        registry.inc(f"{METRICS_NAMESPACE}_model_errors_total", help="模型调用失败次数", **labels)
+        log_event("model_error", session=_session(), node=node, **labels, seconds=round(seconds, 4), error=repr(error))
+        return
+    prompt, completion, cached = usage_of(result)
+    for token_type, value in (("prompt", prompt), ("cached", cached), ("completion", completion)):
+        if value:
+            registry.inc(f"{METRICS_NAMESPACE}_model_tokens_total", value, "模型 token 用量(cached 为命中前缀缓存的输入 token)",
+                         router=router, endpoint=endpoint, kind=kind, type=token_type)
+    registry.add_session(_session(), model_seconds=seconds, model_calls=1,
+                         prompt_tokens=prompt, cached_tokens=cached, completion_tokens=completion)
+    log_event("model", session=_session(), node=node, **labels, seconds=round(seconds, 4),
+              prompt_tokens=prompt, cached_tokens=cached, completion_tokens=completion)
+
+def record_retry(router: str, kind: str):
+    """上一个端点失败后改由下一个端点重试"""
+    if not METRICS_ENABLED:
+        return
+    registry.inc(f"{METRICS_NAMESPACE}_model_retries_total", help="端点失败后的重试次数", router=router, kind=kind)
+    registry.add_session(_session(), retries=1)
+
+def record_fallback(router: str, kind: str, hedged: bool):
+    """结果由备用端点返回(切换或对冲胜出)"""
+    if not METRICS_ENABLED:
+        return
+    registry.inc(f"{METRICS_NAMESPACE}_model_fallbacks_total", help="由备用端点返回结果的次数",
+                 router=router, kind=kind, reason="hedge" if hedged else "failover")
+    registry.add_session(_session(), fallbacks=1)
+
+def record_tool_call(tool: str, seconds: float, outcome: str, attempts: int = 1):
+    """
+    一次工具调用的总耗时(含重试和对冲)
+    outcome: ok / error / budget (时间预算耗尽)；单次尝试的延迟由 record_tool_attempt 记录
+    """
+    if not METRICS_ENABLED:
+        return
+    registry.observe(f"{METRICS_NAMESPACE}_tool_seconds", seconds, "工具调用总耗时(含重试和对冲)", tool=tool, outcome=outcome)
+    if attempts > 1:
+        registry.inc(f"{METRICS_NAMESPACE}_tool_retries_total", attempts - 1, "工具调用失败后的重试次数", tool=tool)
+    registry.add_session(_session(), tool_calls=1, tool_seconds=seconds)
+    log_event("tool", session=_session(), node=current_node.get(), tool=tool, seconds=round(seconds, 4),
+              outcome=outcome, attempts=attempts)
+
+def record_tool_attempt(tool: str, seconds: float, error: bool, hedge: bool = False):
+    """单次工具调用尝试的延迟 (hedge=True 为对冲发起的尝试)"""
+    if not METRICS_ENABLED:
+        return
+    registry.observe(f"{METRICS_NAMESPACE}_tool_attempt_seconds", seconds, "单次工具调用尝试的延迟",
+                     tool=tool, result="error" if error else "ok")
+    if hedge:
+        registry.inc(f"{METRICS_NAMESPACE}_tool_hedges_total", help="慢调用的对冲次数", tool=tool)
+
+def record_speech(task: str, seconds: float, items: int = 1):
+    """ASR/TTS 推理耗时 (task 为 asr 或 tts，批处理时 items 为本批条数)"""
+    if not METRICS_ENABLED:
+        return
+    registry.observe(f"{METRICS_NAMESPACE}_speech_seconds", seconds, "语音模型推理耗时", task=task)
+    registry.inc(f"{METRICS_NAMESPACE}_speech_items_total", items, "语音模型处理条数", task=task)
+    registry.add_session(_session(), **{f"{task}_seconds": seconds})
+    log_event("speech", session=_session(), task=task, seconds=round(seconds, 4), items=items)
+
+def record_cancellation(session: str, reason: str, seconds: float):
+    """
+    一轮对话被取消 (reason: clear 清空对话 / superseded 发送了新消息 / disconnect 关闭页面)
+    seconds 为从发出取消到进行中的任务全部退出(含回滚 checkpoint)的时间
+    """
+    if not METRICS_ENABLED:
+        return
+    registry.inc(f"{METRICS_NAMESPACE}_cancellations_total", help="被取消的对话轮次", reason=reason)
+    registry.observe(f"{METRICS_NAMESPACE}_cancel_seconds", seconds, "取消到进行中的任务全部退出的时间")
+    registry.add_session(session, cancellations=1)
+    log_event("cancel", session=session, reason=reason, seconds=round(seconds, 4))
+
+def record_cancelled_work(work: str, elapsed: float, **labels):
+    """
+    被取消的模型调用、工具调用或语音推理 (work: model / tool / tts / asr)
+    elapsed 为取消前已经花掉的时间；按同类调用的平均耗时估算省下的时间
+    """
+    if not METRICS_ENABLED:
+        return
+    expected = {
+        "model": lambda: registry.mean(f"{METRICS_NAMESPACE}_model_seconds", **labels),
+        "tool": lambda: registry.mean(f"{METRICS_NAMESPACE}_tool_attempt_seconds", result="ok", **labels),
+    }.get(work, lambda: registry.mean(f"{METRICS_NAMESPACE}_speech_seconds", task=work))()
+    registry.inc(f"{METRICS_NAMESPACE}_cancelled_work_total", help="因取消而中止的调用次数", work=work)
+    registry.inc(f"{METRICS_NAMESPACE}_cancel_wasted_seconds_total", elapsed,
+                 "被取消的调用在取消前已花费的时间", work=work)
+    registry.inc(f"{METRICS_NAMESPACE}_cancel_saved_seconds_total", max(expected - elapsed, 0.0),
+                 "取消省下的计算时间(按同类调用的平均耗时估算)", work=work)
+
+def record_turn(session: str, seconds: float, ttft: float | None):
+    """一轮对话(一次 graph 运行)的总耗时和首 token 延迟"""
+    if not METRICS_ENABLED:
+        return
+    registry.observe(f"{METRICS_NAMESPACE}_turn_seconds", seconds, "单轮对话总耗时")
+    if ttft is not None:
+        registry.observe(f"{METRICS_NAMESPACE}_ttft_seconds", ttft, "首 token 延迟")
+    registry.add_session(session, turns=1, wall_seconds=seconds)
+    log_event("turn", session=session, seconds=round(seconds, 4),
+              ttft=None if ttft is None else round(ttft, 4), totals=registry.get_session(session))
+
+def get_session_metrics(session: str) -> dict | None:
+    """返回会话累计的耗时和用量，未记录过的会话返回 None"""
+    return registry.get_session(session)
+
+def instrument_node(name: str, node):
+    """包装 graph 节点：记录节点耗时，并在节点内部标记当前节点名"""
+    from langgraph.errors import GraphInterrupt
+
+    @functools.wraps(node)
+    async def wrapper(state, config=None, **kwargs):
+        token = current_node.set(name)
+        session = (config or {}).get("configurable", {}).get("thread_id") or _session()
+        start = time.perf_counter()
+        error = False
+        try:
+            if config is None:
+                return await node(state, **kwargs)
+            return await node(state, config, **kwargs)
+        except GraphInterrupt:
+            # 摘要审核的中断不算节点异常
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            record_node(name, time.perf_counter() - start, session, error=error)
+            current_node.reset(token)
+    return wrapper
+
+# ==================== Component Gauges ====================
+
+_BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def _component_gauges() -> list[str]:
+    """各组件现有的运行状态(排队深度、熔断器状态、缓存命中率等)转为 gauge"""
+    from medgemma.gradio_chatbot.utils.scheduler import get_scheduler_stats
+    from medgemma.gradio_chatbot.utils.model_router import get_router_stats
+    from medgemma.gradio_chatbot.utils.inference import inference_executor
+    from medgemma.gradio_chatbot.utils.response_cache import get_cache_stats
+    from medgemma.gradio_chatbot.utils.tts_cache import audio_cache
+
+    ns = METRICS_NAMESPACE
+    gauges = defaultdict(list)  # 名称 -> [(标签, 值)]
+    # 组件统计由事件循环更新，这里只读取数值快照
+    for backend, stats in list(get_scheduler_stats().items()):
+        for field in ("in_flight", "waiting", "limit", "rejected"):
+            gauges[f"{ns}_scheduler_{field}"].append(((("backend", backend),), stats[field]))
+    for router, stats in list(get_router_stats().items()):
+        for name, endpoint in list(stats["endpoints"].items()):
+            labels = (("router", router), ("endpoint", name))
+            gauges[f"{ns}_breaker_state"].append((labels, _BREAKER_STATES.get(endpoint["state"], 0)))
+            gauges[f"{ns}_endpoint_ewma_error"].append((labels, endpoint["ewma_error"]))
+            gauges[f"{ns}_prompt_cache_ratio"].append((labels, endpoint["prompt_cache_ratio"]))
+    inference = inference_executor.get_stats()
+    for field in ("queue_depth", "running", "rejected"):
+        gauges[f"{ns}_inference_{field}"].append(((), inference[field]))
+    for cache, stats in list({**get_cache_stats(), "tts": audio_cache.get_stats()}.items()):
+        gauges[f"{ns}_cache_entries"].append(((("cache", cache),), stats["entries"]))
+        gauges[f"{ns}_cache_hit_rate"].append(((("cache", cache),), stats["hit_rate"]))
+
+    lines = []
+    for name, samples in gauges.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{name}{_labels(labels)} {value:g}" for labels, value in samples)
+    return lines
+
+def render_metrics() -> str:
+    for _ in range(3):
+        try:
+            return registry.render()
+        except RuntimeError:
+            # 组件统计的字典恰好在读取时被事件循环修改，重新读取
+            continue
+    return registry.render()
+
+# ==================== Metrics Endpoint ====================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """在后台线程中启动 Prometheus 指标端点 (GET /metrics)，重复调用只启动一次"""
+    global _server
+    if _server is not None or not METRICS_ENABLED:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        # 端口被占用(如同一台机器上的另一个实例)时不影响应用启动，只是不提供指标端点
+        print(f"⚠️ 指标端点启动失败 ({host}:{port}): {e}，可通过 METRICS_PORT 指定其他端口")
+        return None
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📈 指标端点已启动: http://{host}:{port}/metrics")
+    return _server
@@ -0,0 +1,281 @@
+import asyncio
+import time
+from collections import deque
+from langchain_openai import ChatOpenAI
+from medgemma.gradio_chatbot.utils.llm_clients import get_chat_model
+from medgemma.gradio_chatbot.utils.scheduler import backend_slot, BackendBusyError
+from medgemma.gradio_chatbot.utils.metrics import record_model_call, record_retry, record_fallback, record_cancelled_work, usage_of
+from medgemma.gradio_chatbot.utils.cancellation import is_cancelled
+from medgemma.gradio_chatbot.config.settings import (
+    QUESTIONER_MODEL_CONFIG, FALLBACK_MODEL_CONFIG, MEDGEMMA_MODEL_CONFIG, MEDGEMMA_FALLBACK_MODEL_CONFIG,
+    MODEL_BREAKER_FAILURES, MODEL_BREAKER_RESET, MODEL_EWMA_ALPHA, MODEL_LATENCY_WINDOW,
+    MODEL_HEDGE, MODEL_HEDGE_DELAY, MODEL_HEDGE_MIN_DELAY, MODEL_HEDGE_MAX_DELAY, MODEL_HEDGE_MIN_SAMPLES,
+    MODEL_ROUTER_MAX_RETRIES
+)
+
+class ModelUnavailableError(RuntimeError):
+    """所有模型端点的熔断器都处于打开状态"""
+
+# ==================== Circuit Breaker ====================
+
+class CircuitBreaker:
+    """
+    单个端点的熔断器
+    - closed: 正常调用，连续失败达到阈值后打开
+    - open: 直接跳过该端点，reset_timeout 秒后进入 half_open
+    - half_open: 只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+    def __init__(self, failure_threshold: int = MODEL_BREAKER_FAILURES, reset_timeout: float = MODEL_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def release(self):
+        """探测请求被取消(未得出结论)，允许下一个请求继续探测"""
+        self.probing = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"🔌 熔断器打开 (连续失败 {self.failures} 次)")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+# ==================== Endpoint ====================
+
+def _is_endpoint_failure(error: Exception) -> bool:
+    """请求本身有问题(4xx，限流和超时除外)或本地排队已满不算端点故障，不计入熔断"""
+    if isinstance(error, BackendBusyError):
+        return False
+    status = getattr(error, "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status not in (408, 429))
+
+class Endpoint:
+    """一个模型端点：模型配置 + 熔断器 + EWMA 延迟/错误率"""
+    def __init__(self, name: str, config: dict, max_retries: int | None = None):
+        self.name = name
+        self.config = dict(config)
+        if max_retries is not None:
+            self.config["max_retries"] = max_retries
+        self.breaker = CircuitBreaker()
+        self.ewma_latency = None
+        self.ewma_error = 0.0
+        self.latencies = {}  # 调用类型 -> 最近的成功延迟
+        self.calls = 0
+        self.failures = 0
+        # 后端报告的输入 token 和其中命中前缀缓存的部分
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def base_url(self) -> str:
+        return self.config.get("base_url") or ""
+
+    def model(self, **overrides) -> ChatOpenAI:
+        """从共享客户端注册表获取 ChatOpenAI (overrides 覆盖 temperature、max_tokens 等参数)"""
+        return get_chat_model(self.config, **overrides)
+
+    def record_success(self, kind: str, latency: float):
+        self.calls += 1
+        self.ewma_latency = latency if self.ewma_latency is None else (
+            MODEL_EWMA_ALPHA * latency + (1 - MODEL_EWMA_ALPHA) * self.ewma_latency
+        )
+        self.ewma_error *= 1 - MODEL_EWMA_ALPHA
+        self.latencies.setdefault(kind, deque(maxlen=MODEL_LATENCY_WINDOW)).append(latency)
+        self.breaker.record_success()
+
+    def record_usage(self, result):
+        prompt, _, cached = usage_of(result)
+        self.prompt_tokens += prompt
+        self.cached_tokens += cached
+
+    def record_failure(self, error: Exception):
+        self.calls += 1
+        if not _is_endpoint_failure(error):
+            self.breaker.release()
+            return
+        self.failures += 1
+        self.ewma_error = MODEL_EWMA_ALPHA + (1 - MODEL_EWMA_ALPHA) * self.ewma_error
+        self.breaker.record_failure()
+
+    def p95(self, kind: str) -> float | None:
+        window = self.latencies.get(kind)
+        if not window or len(window) < MODEL_HEDGE_MIN_SAMPLES:
+            return None
+        values = sorted(window)
+        return values[int(0.95 * (len(values) - 1))]
+
+    def get_stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "ewma_latency": self.ewma_latency,
+            "ewma_error": self.ewma_error,
+            "p95": {kind: self.p95(kind) for kind in self.latencies},
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "prompt_cache_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+        }
+
+# ==================== Model Router ====================
+
+class ModelRouter:
+    """
+    按优先级在多个模型端点之间路由
+    - 熔断器打开的端点直接跳过，不再等待超时
+    - 调用失败立即切换到下一个端点
+    - 对冲请求: 当前端点超过该调用类型的 p95 延迟仍未返回时，同时向下一个端点发起请求，取先返回的结果
+    流式输出给用户的调用不应开启对冲，否则两个端点的 token 会同时推送
+    """
+    def __init__(self, name: str, configs: list, hedge: bool = MODEL_HEDGE):
+        self.name = name
+        # 有备用端点时由路由负责重试，客户端内部不再重复重试
+        max_retries = MODEL_ROUTER_MAX_RETRIES if len(configs) > 1 else None
+        self.endpoints = [Endpoint(f"{name}[{i}]", config, max_retries) for i, config in enumerate(configs)]
+        self.hedge = hedge
+        self.stats = {"calls": 0, "failovers": 0, "hedged": 0, "hedge_wins": 0, "rejected": 0}
+
+    @property
+    def primary(self) -> Endpoint:
+        return self.endpoints[0]
+
+    def _hedge_delay(self, endpoint: Endpoint, kind: str) -> float:
+        p95 = endpoint.p95(kind)
+        if p95 is None:
+            return MODEL_HEDGE_DELAY
+        return min(max(p95, MODEL_HEDGE_MIN_DELAY), MODEL_HEDGE_MAX_DELAY)
+
+    async def run(self, call, kind: str = "default", hedge: bool | None = None):
+        """
+        call(endpoint) 返回一个 awaitable，按路由策略执行并返回第一个成功的结果
+        kind 区分不同类型的调用(如决策和长文本生成)，分别统计 p95 延迟
+        """
+        hedge = self.hedge if hedge is None else hedge
+        self.stats["calls"] += 1
+        remaining = iter(self.endpoints)
+        pending = {}  # task -> (endpoint, 获得后端名额的时间(future))
+        last_error = None
+
+        async def attempt(endpoint: Endpoint, admitted: asyncio.Future):
+            async with backend_slot(endpoint.base_url, kind):
+                # 延迟统计(指标、EWMA、p95)和对冲计时都从获得名额开始，不含本地排队时间
+                started = time.monotonic()
+                admitted.set_result(started)
+                try:
+                    result = await call(endpoint)
+                except asyncio.CancelledError:
+                    # 用户取消本轮时中断 HTTP 请求，后端随之停止生成；对冲落败的请求不计入
+                    if is_cancelled():
+                        record_cancelled_work("model", time.monotonic() - started,
+                                              router=self.name, endpoint=endpoint.name, kind=kind)
+                    raise
+                except Exception as e:
+                    record_model_call(self.name, endpoint.name, kind, time.monotonic() - started, error=e)
+                    raise
+                record_model_call(self.name, endpoint.name, kind, time.monotonic() - started, result)
+                endpoint.record_usage(result)
+                return result
+
+        def launch() -> bool:
+            for endpoint in remaining:
+                if endpoint.breaker.allow():
+                    admitted = asyncio.get_running_loop().create_future()
+                    task = asyncio.ensure_future(attempt(endpoint, admitted))
+                    pending[task] = (endpoint, admitted)
+                    return True
+            return False
+
+        if not launch():
+            self.stats["rejected"] += 1
+            raise ModelUnavailableError(f"{self.name}: 所有模型端点均已熔断")
+
+        hedged = False
+        try:
+            while pending:
+                waits = set(pending)
+                timeout = None
+                if hedge and not hedged and len(pending) == 1:
+                    endpoint, admitted = next(iter(pending.values()))
+                    if admitted.done():
+                        timeout = max(self._hedge_delay(endpoint, kind) - (time.monotonic() - admitted.result()), 0)
+                    else:
+                        # 还在本地排队，等获得名额后再开始对冲计时
+                        waits.add(admitted)
+                done, _ = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                done = {task for task in done if task in pending}
+
+                if not done:
+                    if timeout is None:
+                        # 刚获得名额，重新计算对冲等待时间
+                        continue
+                    # 超过 p95 延迟预算，向下一个端点发起对冲请求
+                    hedged = True
+                    if launch():
+                        self.stats["hedged"] += 1
+                        print(f"⏳ {self.name}: 超过延迟预算，发起对冲请求")
+                    continue
+
+                for task in done:
+                    endpoint, admitted = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        endpoint.record_success(kind, time.monotonic() - admitted.result())
+                        if endpoint is not self.primary:
+                            self.stats["hedge_wins" if hedged else "failovers"] += 1
+                            record_fallback(self.name, kind, hedged)
+                        return task.result()
+                    endpoint.record_failure(error)
+                    last_error = error
+                    print(f"⚠️ {endpoint.name} [{kind}] 调用失败: {error}")
+
+                if not pending:
+                    if not launch():
+                        break
+                    record_retry(self.name, kind)
+            raise last_error or ModelUnavailableError(f"{self.name}: 没有可用的模型端点")
+        finally:
+            for task, (endpoint, _) in pending.items():
+                task.cancel()
+                endpoint.breaker.release()
+
+    async def ainvoke(self, messages: list, kind: str = "default", hedge: bool | None = None, **overrides):
+        """按路由策略调用 ChatOpenAI.ainvoke，overrides 覆盖模型参数(temperature、max_tokens 等)"""
+        return await self.run(lambda endpoint: endpoint.model(**overrides).ainvoke(messages), kind, hedge)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "endpoints": {endpoint.name: endpoint.get_stats() for endpoint in self.endpoints},
+        }
+
+# 问诊模型(OpenRouter 主模型 + 备用模型)和 MedGemma 的共享路由
+questioner_router = ModelRouter("questioner", [QUESTIONER_MODEL_CONFIG, FALLBACK_MODEL_CONFIG])
+medgemma_router = ModelRouter(
+    "medgemma",
+    [MEDGEMMA_MODEL_CONFIG] + ([MEDGEMMA_FALLBACK_MODEL_CONFIG] if MEDGEMMA_FALLBACK_MODEL_CONFIG else [])
+)
+
+def get_router_stats() -> dict:
+    return {router.name: router.get_stats() for router in (questioner_router, medgemma_router)}
@@ -0,0 +1,87 @@
+import json
+import re
+import time
+from collections import OrderedDict
+from medgemma.gradio_chatbot.config.settings import (
+    TOOL_CACHE_TTL, TOOL_CACHE_MAX_ENTRIES, TOOL_CACHE_MAX_BYTES,
+    QUESTION_CACHE_TTL, QUESTION_CACHE_MAX_ENTRIES, QUESTION_CACHE_MAX_BYTES
+)
+from medgemma.gradio_chatbot.utils.text_utils import convert_t2s
+
+class ResponseCache:
+    """
+    带 TTL 的 LRU 缓存
+    - 条目数和估算字节数都有上限，超出时淘汰最久未使用的条目
+    - 记录命中率，便于评估缓存是否值得开启
+    """
+    def __init__(self, name: str, max_entries: int, max_bytes: int, ttl: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (过期时间, 估算字节数, value)
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, size, value = entry
+        if self.ttl and time.monotonic() > expires_at:
+            self._remove(key)
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def put(self, key, value):
+        size = len(repr(value).encode())
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+        self.stats["puts"] += 1
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+        }
+
+# ==================== Cache Keys ====================
+
+_PUNCTUATION = re.compile(r'[\s，。！？、；：,.!?;:~～…]+')
+
+def normalize_text(text: str) -> str:
+    """繁体转简体、统一大小写，去掉空白和标点，使写法略有差异的同一句话得到相同的键"""
+    return _PUNCTUATION.sub("", convert_t2s(text)).lower()
+
+def tool_cache_key(server_name: str, tool_name: str, arguments: dict) -> str:
+    return f"{server_name}:{tool_name}:{json.dumps(arguments, sort_keys=True, ensure_ascii=False)}"
+
+# MCP 工具结果(知识库查询)和首轮问诊回复的缓存
+tool_cache = ResponseCache("mcp_tools", TOOL_CACHE_MAX_ENTRIES, TOOL_CACHE_MAX_BYTES, TOOL_CACHE_TTL)
+question_cache = ResponseCache("first_question", QUESTION_CACHE_MAX_ENTRIES, QUESTION_CACHE_MAX_BYTES, QUESTION_CACHE_TTL)
+
+def get_cache_stats() -> dict:
+    return {cache.name: cache.get_stats() for cache in (tool_cache, question_cache)}
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from medgemma.gradio_chatbot.config.settings import (
+    LLM_DEFAULT_CONCURRENCY, MEDGEMMA_MAX_CONCURRENCY, SCHEDULER_MAX_QUEUE,
+    MEDGEMMA_MODEL_CONFIG, MEDGEMMA_FALLBACK_MODEL_CONFIG
+)
+
+class BackendBusyError(RuntimeError):
+    """后端排队的请求已达上限，新请求直接拒绝"""
+
+# 当前请求所属的会话，由 app 在运行 graph 前设置；后台任务没有会话
+current_session = contextvars.ContextVar("current_session", default="")
+
+# 调用类型 -> 优先级 (数字越小越优先)
+# 建议生成时用户已经在等待审核结果，优先于决策和后台任务
+PRIORITIES = {
+    "advice": 0,
+    "agent": 1,
+    "summary": 1,
+    "decision": 1,
+    "compact": 1,
+    "speculative": 2,
+}
+PRIORITY_LEVELS = 3
+
+# 本地 MedGemma(vLLM) 只有一张卡，单独限制并发
+_LOCAL_BACKENDS = {
+    config["base_url"] for config in (MEDGEMMA_MODEL_CONFIG, MEDGEMMA_FALLBACK_MODEL_CONFIG) if config
+}
+
+def backend_limit(base_url: str) -> int:
+    return MEDGEMMA_MAX_CONCURRENCY if base_url in _LOCAL_BACKENDS else LLM_DEFAULT_CONCURRENCY
+
+class _Waiter:
+    __slots__ = ("future", "session", "priority", "enqueued_at")
+
+    def __init__(self, future, session: str, priority: int):
+        self.future = future
+        self.session = session
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+class BackendScheduler:
+    """
+    单个模型后端的请求调度器
+    - 同时进行的请求数不超过 limit，其余请求排队
+    - 高优先级先调度；同一优先级内按会话轮转，每个会话内部先进先出，避免单个会话占满后端
+    - 排队请求超过 max_queue 时直接拒绝(准入控制)
+    """
+    def __init__(self, name: str, limit: int, max_queue: int = SCHEDULER_MAX_QUEUE):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._queues = [OrderedDict() for _ in range(PRIORITY_LEVELS)]  # 会话 -> 等待队列
+        self._waiting = 0
+        self._wait_times = deque(maxlen=200)
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "peak_in_flight": 0}
+
+    def _admit(self, waited: float):
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+        self._wait_times.append(waited)
+
+    async def acquire(self, priority: int, session: str):
+        if self.in_flight < self.limit and self._waiting == 0:
+            self._admit(0.0)
+            return
+        if self._waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise BackendBusyError(f"{self.name} 排队请求已满 ({self._waiting}/{self.max_queue})")
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), session, priority)
+        self._queues[priority].setdefault(session, deque()).append(waiter)
+        self._waiting += 1
+        self.stats["queued"] += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已分配到名额但调用方被取消，归还名额
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        while self.in_flight < self.limit:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            if waiter.future.done():
+                # 等待者已被取消，跳过
+                continue
+            self._admit(time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def _next_waiter(self) -> _Waiter | None:
+        for sessions in self._queues:
+            if sessions:
+                session, queue = next(iter(sessions.items()))
+                waiter = queue.popleft()
+                if queue:
+                    # 本会话还有请求，轮转到队尾，先服务其他会话
+                    sessions.move_to_end(session)
+                else:
+                    del sessions[session]
+                self._waiting -= 1
+                return waiter
+        return None
+
+    def _remove(self, waiter: _Waiter):
+        sessions = self._queues[waiter.priority]
+        queue = sessions.get(waiter.session)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._waiting -= 1
+            if not queue:
+                del sessions[waiter.session]
+
+    def position(self, session: str) -> int:
+        """会话在队列中的大致位置(1 表示下一个)，未在排队时返回 0"""
+        ahead = 0
+        for sessions in self._queues:
+            if session in sessions:
+                return ahead + list(sessions).index(session) + 1
+            ahead += sum(len(queue) for queue in sessions.values())
+        return 0
+
+    def get_stats(self) -> dict:
+        waits = sorted(self._wait_times)
+        return {
+            **self.stats,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self._waiting,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+        }
+
+# base_url -> 调度器
+_schedulers = {}
+
+def get_scheduler(base_url: str) -> BackendScheduler:
+    scheduler = _schedulers.get(base_url)
+    if scheduler is None:
+        scheduler = _schedulers[base_url] = BackendScheduler(base_url, backend_limit(base_url))
+    return scheduler
+
+@asynccontextmanager
+async def backend_slot(base_url: str, kind: str = "default"):
+    """按调用类型的优先级排队，占用一个后端名额"""
+    from medgemma.gradio_chatbot.utils.metrics import record_queue_wait
+
+    scheduler = get_scheduler(base_url)
+    start = time.monotonic()
+    await scheduler.acquire(PRIORITIES.get(kind, 1), current_session.get())
+    record_queue_wait(base_url, kind, time.monotonic() - start)
+    try:
+        yield
+    finally:
+        scheduler.release()
+
+def queue_position(session: str) -> int:
+    """会话在所有后端中最靠后的排队位置，未在排队时返回 0"""
+    return max((scheduler.position(session) for scheduler in _schedulers.values()), default=0)
+
+def get_scheduler_stats() -> dict:
+    return {base_url: scheduler.get_stats() for base_url, scheduler in _schedulers.items()}
@@ -1,26 +1,33 @@
+import io
 import os
-import torch
+import asyncio
+import threading
+import time
 import numpy as np
 import soundfile as sf
-import tempfile
-from kokoro import KPipeline, KModel
-from medgemma.gradio_chatbot.config.settings import KOKORO_MODEL_PATH, KOKORO_CONFIG_PATH, KOKORO_REPO_ID, KOKORO_VOICES_DIR
-# TTS 模型 (Kokoro)
-print("正在加载 TTS 模型...")
-voice_zf = "zf_xiaoxiao"
-voice_zf_tensor = torch.load(
-    os.path.join(KOKORO_VOICES_DIR, f"{voice_zf}.pt"), 
-    weights_only=True
+from medgemma.gradio_chatbot.utils import text_utils
+from medgemma.gradio_chatbot.utils.inference import inference_executor, InferenceBusyError
+from medgemma.gradio_chatbot.utils.metrics import record_cancelled_work
+from medgemma.gradio_chatbot.utils.tts_cache import audio_cache, normalize_tts_text
+from medgemma.gradio_chatbot.config.settings import (
+    KOKORO_MODEL_PATH, KOKORO_CONFIG_PATH, KOKORO_REPO_ID, KOKORO_VOICES_DIR, TTS_CACHE_ENABLED,
+    TTS_AUDIO_FORMAT
 )
 
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-tts_model = KModel(model=KOKORO_MODEL_PATH, config=KOKORO_CONFIG_PATH, repo_id=KOKORO_REPO_ID).to(device).eval()
-
-en_pipeline = KPipeline(lang_code='a', repo_id=KOKORO_REPO_ID, model=tts_model)
+# TTS 模型 (Kokoro)，首次使用或后台预热时加载
+voice_zf = "zf_xiaoxiao"
+voice_zf_tensor = None
+tts_model = None
+en_pipeline = None
+zh_pipeline = None
+_load_lock = threading.Lock()
 
 def en_callable(text):
     return next(en_pipeline(text, voice=voice_zf_tensor)).phonemes
 
+# speed_callable 的版本标识，参与缓存键；修改语速曲线时同步修改，使旧的缓存失效
+SPEED_PROFILE = "auto-v1x1.1"
+
 def speed_callable(len_ps):
     speed = 0.8
     if len_ps <= 83:
@@ -29,13 +36,40 @@ def speed_callable(len_ps):
         speed = 1 - (len_ps - 83) / 500
     return speed * 1.1
 
-zh_pipeline = KPipeline(lang_code='z', repo_id=KOKORO_REPO_ID, model=tts_model, en_callable=en_callable)
-print("TTS 模型加载完成！")
+def load_tts_model():
+    """加载 Kokoro 模型和音色(只加载一次，线程安全)"""
+    global voice_zf_tensor, tts_model, en_pipeline, zh_pipeline
+    if zh_pipeline is not None:
+        return zh_pipeline
+    with _load_lock:
+        if zh_pipeline is not None:
+            return zh_pipeline
+        print("正在加载 TTS 模型...")
+        start = time.perf_counter()
+        import torch
+        from kokoro import KPipeline, KModel
+
+        voice_zf_tensor = torch.load(
+            os.path.join(KOKORO_VOICES_DIR, f"{voice_zf}.pt"), 
+            weights_only=True
+        )
+
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        tts_model = KModel(model=KOKORO_MODEL_PATH, config=KOKORO_CONFIG_PATH, repo_id=KOKORO_REPO_ID).to(device).eval()
+
+        en_pipeline = KPipeline(lang_code='a', repo_id=KOKORO_REPO_ID, model=tts_model)
+        zh_pipeline = KPipeline(lang_code='z', repo_id=KOKORO_REPO_ID, model=tts_model, en_callable=en_callable)
+        print(f"TTS 模型加载完成！耗时 {time.perf_counter() - start:.1f}s")
+        return zh_pipeline
 
-def text_to_speech(text: str) -> str | None:
+def is_tts_ready() -> bool:
+    return zh_pipeline is not None
+
+SAMPLE_RATE = 24000
+
+def synthesize(text: str):
     """
-    将文本转换为语音
-    返回音频文件路径
+    合成一段文本，返回音频数组 (采样率 SAMPLE_RATE)
     """
     if not text or not text.strip():
         return None
@@ -43,28 +77,250 @@ def text_to_speech(text: str) -> str | None:
     # 清理换行符，避免TTS处理问题
     text = text.replace('\n', ' ').replace('\r', ' ').strip()
     
-    try:
-        # 使用中文管道生成语音
-        generator = zh_pipeline(
-            text, 
-            voice=voice_zf_tensor, 
-            speed=speed_callable
-        )
-        # 收集所有音频片段并拼接
-        audio_chunks = []
-        for result in generator:
-            audio_chunks.append(result.audio)
-        
-        if not audio_chunks:
+    # 使用中文管道生成语音
+    generator = load_tts_model()(
+        text, 
+        voice=voice_zf_tensor, 
+        speed=speed_callable
+    )
+    # 收集所有音频片段并拼接
+    audio_chunks = []
+    for result in generator:
+        audio_chunks.append(result.audio)
+    
+    if not audio_chunks:
+        return None
+    return np.concatenate(audio_chunks)
+
+# ==================== Sentence Cache ====================
+
+def split_sentences(text: str) -> list[str]:
+    """按句切分并清理 Markdown 标记，与流式合成的切分方式一致"""
+    sentences, remaining = text_utils.extract_sentences(text)
+    sentences = [normalize_tts_text(text_utils.clean_markdown(s)) for s in sentences + [remaining]]
+    return [s for s in sentences if s]
+
+def _cache_key(sentence: str) -> str:
+    return audio_cache.key(sentence, model=KOKORO_REPO_ID, voice=voice_zf, speed=SPEED_PROFILE)
+
+def cached_sentence(sentence: str):
+    """只查缓存，未命中返回 None (会读磁盘，不要在事件循环中直接调用)"""
+    if not TTS_CACHE_ENABLED or not sentence:
+        return None
+    return audio_cache.get(_cache_key(sentence))
+
+def synthesize_sentence(sentence: str, check_cache: bool = True):
+    """合成单句，优先使用缓存，新合成的句子写入缓存 (调用方已查过缓存时传 check_cache=False)"""
+    wav = cached_sentence(sentence) if check_cache else None
+    if wav is not None:
+        return wav
+    wav = synthesize(sentence)
+    if wav is not None and TTS_CACHE_ENABLED:
+        audio_cache.put(_cache_key(sentence), wav)
+    return wav
+
+def cached_text(text: str):
+    """整段文本的所有句子都已缓存时直接拼接返回，否则返回 None"""
+    chunks = []
+    for sentence in split_sentences(text):
+        wav = cached_sentence(sentence)
+        if wav is None:
             return None
-        wav = np.concatenate(audio_chunks)
-        
-        # 保存到临时文件
-        temp_fd, temp_path = tempfile.mkstemp(suffix='.wav')
-        os.close(temp_fd)  # 关闭文件描述符
-        sf.write(temp_path, wav, 24000)
-        
-        return temp_path
+        chunks.append(wav)
+    return np.concatenate(chunks) if chunks else None
+
+# ==================== Audio Delivery ====================
+
+# 输出格式 -> (soundfile 格式, 编码, 文件扩展名)
+AUDIO_FORMATS = {
+    "wav": ("WAV", "PCM_16", "wav"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "mp3"),
+    "opus": ("OGG", "OPUS", "ogg"),
+}
+
+def encode_audio(wav, audio_format: str = "wav") -> bytes:
+    """在内存中把音频数组编码为 wav/mp3/opus 字节，不写临时文件"""
+    container, subtype, _ = AUDIO_FORMATS[audio_format]
+    buffer = io.BytesIO()
+    sf.write(buffer, np.clip(wav, -1.0, 1.0), SAMPLE_RATE, format=container, subtype=subtype)
+    return buffer.getvalue()
+
+def synthesize_text(text: str):
+    """
+    将文本合成为音频数组 (采样率 SAMPLE_RATE)
+    按句合成，已缓存的句子直接复用，只合成新的部分
+    """
+    chunks = [wav for wav in map(synthesize_sentence, split_sentences(text)) if wav is not None]
+    return np.concatenate(chunks) if chunks else None
+
+def text_to_speech(text: str) -> bytes | None:
+    """
+    将文本转换为语音
+    返回按 TTS_AUDIO_FORMAT 编码的音频字节(Gradio Audio 可直接输出)
+    """
+    if not text or not text.strip():
+        return None
+    
+    try:
+        wav = synthesize_text(text)
+        return encode_audio(wav, TTS_AUDIO_FORMAT) if wav is not None else None
     except Exception as e:
         print(f"TTS 错误: {e}")
         return None
+
+def _cached_text_to_speech(text: str) -> bytes | None:
+    wav = cached_text(text)
+    return encode_audio(wav, TTS_AUDIO_FORMAT) if wav is not None else None
+
+async def text_to_speech_async(text: str) -> bytes | None:
+    """
+    在推理线程池中执行语音合成，不阻塞事件循环
+    所有句子都已缓存时不进入推理队列
+    推理队列已满时放弃语音回复，返回 None
+    """
+    if not text or not text.strip():
+        return None
+    if TTS_CACHE_ENABLED:
+        audio = await asyncio.to_thread(_cached_text_to_speech, text)
+        if audio is not None:
+            return audio
+    try:
+        return await inference_executor.run(text_to_speech, text, name="tts")
+    except InferenceBusyError as e:
+        print(f"⚠️ TTS 繁忙，跳过语音回复: {e}")
+        return None
+
+class StreamingTTS:
+    """
+    流式语音合成：边生成边合成
+    - feed() 接收 LLM 的 token 片段，按句切分后送入后台合成任务
+    - pop_ready() 取出已合成好的音频 (多个句子合并为一段，内存中编码为 WAV 字节)
+    - close() 提交剩余文本，remaining() 等待剩余音频合成完成
+    - reset() 撤回已送入但尚未播放的文本(回复被撤回重新生成时)
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._sentences = asyncio.Queue()
+        self._audio = asyncio.Queue()
+        self._closed = False
+        self._generation = 0  # reset() 的次数，合成完成时已被撤回的句子不再输出
+        self._worker = asyncio.create_task(self._run())
+
+    def feed(self, text_chunk: str):
+        if self._closed or not text_chunk:
+            return
+        self._buffer += text_chunk
+        sentences, self._buffer = text_utils.extract_sentences(self._buffer)
+        for sentence in sentences:
+            if sentence.strip():
+                self._sentences.put_nowait(sentence)
+
+    def reset(self):
+        """撤回已送入的文本：丢弃未成句的文本、尚未合成的句子和尚未取走的音频(已播放的部分无法撤回)"""
+        if self._closed:
+            return
+        self._generation += 1
+        self._buffer = ""
+        while not self._sentences.empty():
+            self._sentences.get_nowait()
+            record_cancelled_work("tts", 0.0)
+        while not self._audio.empty():
+            self._audio.get_nowait()
+
+    def close(self):
+        """文本已全部生成，提交最后未以标点结尾的部分"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._buffer.strip():
+            self._sentences.put_nowait(self._buffer)
+        self._buffer = ""
+        self._sentences.put_nowait(None)
+
+    def cancel(self):
+        """放弃尚未合成的句子和尚未取走的音频，remaining() 随即结束"""
+        self._closed = True
+        if self._worker.done():
+            return
+        self._worker.cancel()
+        # 尚未送入推理队列的句子直接丢弃(正在排队的一句由推理线程池记录)
+        while not self._sentences.empty():
+            if self._sentences.get_nowait() is not None:
+                record_cancelled_work("tts", 0.0)
+        while not self._audio.empty():
+            self._audio.get_nowait()
+        self._audio.put_nowait(None)
+
+    async def _run(self):
+        while True:
+            sentence = await self._sentences.get()
+            if sentence is None:
+                break
+            generation = self._generation
+            sentence = normalize_tts_text(text_utils.clean_markdown(sentence))
+            if not sentence:
+                continue
+            # 已缓存的句子不进入推理队列
+            wav = await asyncio.to_thread(cached_sentence, sentence) if TTS_CACHE_ENABLED else None
+            if wav is not None:
+                if generation == self._generation:
+                    self._audio.put_nowait(wav)
+                continue
+            try:
+                wav = await inference_executor.run(
+                    synthesize_sentence, sentence, check_cache=False, name="tts"
+                )
+            except InferenceBusyError as e:
+                print(f"⚠️ TTS 繁忙，跳过本句: {e}")
+                continue
+            except Exception as e:
+                print(f"TTS 错误: {e}")
+                continue
+            if wav is not None and generation == self._generation:
+                self._audio.put_nowait(wav)
+        self._audio.put_nowait(None)
+
+    def pop_ready(self):
+        """取出所有已合成的音频，返回 WAV 字节，没有则返回 None"""
+        chunks = []
+        while not self._audio.empty():
+            wav = self._audio.get_nowait()
+            if wav is None:
+                # 结束标记留给 remaining()
+                self._audio.put_nowait(None)
+                break
+            chunks.append(wav)
+        if not chunks:
+            return None
+        # 流式输出的音频块由 Gradio 在内存中转码推送，不经过临时文件
+        return encode_audio(np.concatenate(chunks))
+
+    async def remaining(self):
+        """close() 之后逐句产出剩余音频，直到全部合成完成"""
+        while True:
+            wav = await self._audio.get()
+            if wav is None:
+                return
+            yield encode_audio(wav)
+
+_prewarmed = False
+
+async def prewarm_tts_cache(texts: list[str]):
+    """预先合成固定内容(逐句通过推理线程池，已缓存的句子跳过)，只执行一次"""
+    global _prewarmed
+    if _prewarmed or not TTS_CACHE_ENABLED:
+        return
+    _prewarmed = True
+    start = time.perf_counter()
+    synthesized = 0
+    for text in texts:
+        for sentence in split_sentences(text):
+            if await asyncio.to_thread(cached_sentence, sentence) is not None:
+                continue
+            try:
+                await inference_executor.run(synthesize_sentence, sentence, check_cache=False, name="tts")
+                synthesized += 1
+            except Exception as e:
+                print(f"⚠️ TTS 缓存预热失败: {e}")
+                return
+    print(f"✅ TTS 缓存预热完成，新合成 {synthesized} 句，耗时 {time.perf_counter() - start:.1f}s")
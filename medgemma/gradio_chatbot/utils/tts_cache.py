@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+import numpy as np
+from medgemma.gradio_chatbot.config.settings import TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES
+
+def normalize_tts_text(text: str) -> str:
+    """合并换行和多余空白(与合成前的清理一致)，标点会影响语调，保持不变"""
+    return " ".join(text.split())
+
+class AudioCache:
+    """
+    内容寻址的句子级语音缓存 (磁盘存储)
+    - 键为 模型 + 音色 + 语速配置 + 规范化文本 的 sha256，每句一个 <键>.npy 文件
+    - 总大小超过 max_bytes 时淘汰最久未使用的句子
+    - 首次访问时扫描目录重建索引(按修改时间排序)，进程重启后缓存仍然有效
+    推理线程和事件循环都会访问，索引的读写在锁内进行
+    """
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None  # 键 -> 文件大小 (LRU 顺序)
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+    @staticmethod
+    def key(text: str, **params) -> str:
+        digest = hashlib.sha256()
+        for name, value in sorted(params.items()):
+            digest.update(f"{name}={value}\x00".encode())
+        digest.update(normalize_tts_text(text).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith(".npy"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._bytes = sum(self._index.values())
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            self._ensure_index()
+            if key not in self._index:
+                self.stats["misses"] += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            wav = np.load(self._path(key))
+            # 更新修改时间，重启后重建的索引保持最近使用顺序
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            # 文件已被淘汰或损坏，按未命中处理
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return wav
+
+    def put(self, key: str, wav: np.ndarray):
+        os.makedirs(self.directory, exist_ok=True)
+        # 先写临时文件再原子替换，读取方不会读到写了一半的文件
+        temp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, "wb") as f:
+            np.save(f, wav)
+        os.replace(temp_path, self._path(key))
+        size = os.path.getsize(self._path(key))
+
+        stale = []
+        with self._lock:
+            self._ensure_index()
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = size
+            self._bytes += size
+            self.stats["puts"] += 1
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                old_key, old_size = self._index.popitem(last=False)
+                self._bytes -= old_size
+                self.stats["evictions"] += 1
+                stale.append(old_key)
+        for old_key in stale:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._index or ()),
+                "bytes": self._bytes,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            }
+
+# 句子级语音缓存
+audio_cache = AudioCache()